@@ -0,0 +1,40 @@
+"""
+Benchmark of the event representations of dataset.representations at DSEC resolution.
+
+Every representation converts the same synthetic events (rectified coordinates, time
+normalized to [0, 1], as they come out of Sequence). Throughput is in million events per
+second of a single convert.
+
+Run from the repository root:
+    python -m benchmarks.event_representations --num_events 100000 1000000 5000000
+"""
+from benchmarks.voxel_grid import random_events, timeit
+from dataset.representations import make_representation
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_events', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--num_bins', type=int, default=15)
+    parser.add_argument('--representations', nargs='+',
+                        default=['voxel_grid', 'polarity_voxel_grid', 'event_count', 'time_surface'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    height, width = 480, 640
+    representations = {name: make_representation(name, args.num_bins, height, width) for name in args.representations}
+
+    print('{:>10s} {:>20s} {:>9s} {:>12s} {:>10s} {:>9s}'.format(
+        'events', 'representation', 'channels', 'convert [ms]', 'Mev/s', 'vs voxel'))
+    for num_events in args.num_events:
+        events = [a.to(args.device) for a in random_events(num_events, height, width)]
+        t_voxel_grid = None
+        for name, representation in representations.items():
+            t_convert = timeit(lambda: representation.convert(*events), args.repeat)
+            if name == 'voxel_grid':
+                t_voxel_grid = t_convert
+            print('{:>10d} {:>20s} {:>9d} {:>12.2f} {:>10.2f} {:>9s}'.format(
+                num_events, name, representation.shape[0], 1000 * t_convert, num_events / t_convert / 1e6,
+                '{:.2f}x'.format(t_voxel_grid / t_convert) if t_voxel_grid is not None else '-'))
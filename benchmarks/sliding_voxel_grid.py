@@ -0,0 +1,88 @@
+"""
+Benchmark of SlidingVoxelGrid against VoxelGrid.convert of every window from scratch.
+
+Windows of --delta_t_ms are produced every --stride_ms over synthetic events of a
+constant rate. All windows after the first use the incremental path, whatever the number of
+bins (see SlidingVoxelGrid). The first window is not timed.
+
+Run from the repository root:
+    python -m benchmarks.sliding_voxel_grid --rates 1 5 20 --delta_t_ms 50 --stride_ms 10 --num_bins 15
+"""
+import time
+from typing import Dict
+
+import numpy as np
+import torch
+
+from benchmarks.voxel_grid import timeit
+from dataset.representations import VoxelGrid
+from dataset.sliding_voxel_grid import SlidingVoxelGrid
+
+
+class ArrayEventSlicer:
+    """In-memory stand-in for EventSlicer over sorted event arrays"""
+    def __init__(self, events: Dict[str, np.ndarray]):
+        self.events = events
+
+    def get_events(self, t_start_us: int, t_end_us: int):
+        idx_start, idx_end = np.searchsorted(self.events['t'], [t_start_us, t_end_us], side='left')
+        return {k: v[idx_start:idx_end] for k, v in self.events.items()}
+
+
+def random_event_stream(rate_mev_s: float, duration_us: int, height: int, width: int, seed: int=0):
+    rng = np.random.default_rng(seed)
+    num_events = int(rate_mev_s * duration_us)
+    return {
+        'x': rng.integers(0, width, num_events).astype('uint16'),
+        'y': rng.integers(0, height, num_events).astype('uint16'),
+        'p': rng.integers(0, 2, num_events).astype('uint8'),
+        't': np.sort(rng.integers(0, duration_us, num_events)).astype('int64'),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rates', type=float, nargs='+', default=[1, 5, 20], help='Event rates in Mev/s')
+    parser.add_argument('--delta_t_ms', type=int, default=50)
+    parser.add_argument('--stride_ms', type=int, default=10)
+    parser.add_argument('--num_bins', type=int, default=15)
+    parser.add_argument('--num_windows', type=int, default=20)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    height, width = 480, 640
+    delta_t_us = 1000 * args.delta_t_ms
+    stride_us = 1000 * args.stride_ms
+    t_ends = [delta_t_us + k * stride_us for k in range(args.num_windows)]
+    representation = VoxelGrid(args.num_bins, height, width, normalize=True)
+
+    print('{:>10s} {:>14s} {:>14s} {:>8s} {:>10s}'.format('Mev/s', 'convert [ms]', 'sliding [ms]', 'speedup', 'max error'))
+    for rate in args.rates:
+        slicer = ArrayEventSlicer(random_event_stream(rate, t_ends[-1], height, width))
+
+        def convert(t_end):
+            events = slicer.get_events(t_end - delta_t_us, t_end)
+            return representation.convert(
+                    torch.from_numpy(events['x'].astype('float32')).to(args.device),
+                    torch.from_numpy(events['y'].astype('float32')).to(args.device),
+                    torch.from_numpy(events['p'].astype('float32')).to(args.device),
+                    torch.from_numpy((events['t'] - (t_end - delta_t_us)).astype('float32')).to(args.device),
+                    time_window=(0, delta_t_us))
+
+        def make_sliding():
+            return SlidingVoxelGrid(slicer, args.num_bins, height, width, delta_t_us, stride_us, device=args.device)
+
+        sliding = make_sliding()
+        max_error = max((convert(t_end) - sliding.get(t_end)).abs().max().item() for t_end in t_ends)
+        # Steady state: the first window of the sliding grid is built from scratch. A sliding grid
+        # only moves forward, hence it is timed over a single pass.
+        sliding = make_sliding()
+        sliding.get(t_ends[0])
+        t_convert = timeit(lambda: [convert(t_end) for t_end in t_ends[1:]], 1) / (len(t_ends) - 1)
+        t_sliding = time.perf_counter()
+        for t_end in t_ends[1:]:
+            sliding.get(t_end)
+        t_sliding = (time.perf_counter() - t_sliding) / (len(t_ends) - 1)
+        print('{:>10.1f} {:>14.2f} {:>14.2f} {:>7.2f}x {:>10.2e}'.format(
+            rate, 1000 * t_convert, 1000 * t_sliding, t_convert / t_sliding, max_error))
@@ -0,0 +1,97 @@
+"""
+Benchmark of SeparableSSIM against the previous SSIM of model.pytorch_ssim, on DSEC-sized depth.
+
+The previous SSIM was constructed on every call (window built in Python and moved to the
+device) and ran five 2-D convolutions with the 11x11 window. Rows:
+    ssim: SSIM of a (1, B, H, W) pair, as in get_ssim_loss
+    loss: DepthLoss forward and backward, with the previous SSIM or SeparableSSIM
+    ssim_error, log_ssim_error: the metrics, on DepthTargets
+
+Run from the repository root:
+    python -m benchmarks.ssim --batch_size 4
+"""
+import torch
+
+import model.pytorch_ssim as pytorch_ssim
+from benchmarks.voxel_grid import timeit
+from model.loss import DepthLoss, depth_targets, from_log_to_depth, get_projectmat
+from model.metric import log_ssim_error, ssim_error
+
+
+def reference_ssim_loss(img1, img2, mask=None):
+    """Previous get_ssim_loss, with the pixels outside of mask set to 0 by the caller"""
+    if mask is not None:
+        img1 = torch.where(mask, img1, 0.0)
+        img2 = torch.where(mask, img2, 0.0)
+    return 1 - pytorch_ssim.SSIM()(img1, img2)
+
+
+class ReferenceSSIM(torch.nn.Module):
+    """Previous SSIM in place of DepthLoss.ssim"""
+    def forward(self, img1, img2, mask=None):
+        return 1 - reference_ssim_loss(img1, img2, mask)
+
+
+def reference_ssim_error(output, targets):
+    depth_output = from_log_to_depth(output.reshape(targets.normalized_depth.shape))
+    return reference_ssim_loss(targets.normalized_depth.unsqueeze(0), depth_output.unsqueeze(0), targets.valid.unsqueeze(0))
+
+
+def reference_log_ssim_error(output, targets):
+    log_depth_output = output.reshape(targets.log_depth.shape)
+    return reference_ssim_loss(targets.log_depth.unsqueeze(0), log_depth_output.unsqueeze(0), targets.valid.unsqueeze(0))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--density', type=float, default=0.3, help='Fraction of pixels with ground truth')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    shape = (args.batch_size, args.height, args.width)
+    disparity = torch.rand(shape, device=device) * 60
+    disparity[torch.rand(shape, device=device) > args.density] = 0
+    output = (0.6 + 0.2 * torch.randn((args.batch_size, 1) + shape[1:], device=device)).requires_grad_()
+    targets = depth_targets(disparity, get_projectmat().float().to(device))
+
+    def synchronized(fn):
+        def run():
+            result = fn()
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            return result
+        return run
+
+    def loss_step(criterion):
+        def run():
+            output.grad = None
+            loss = criterion(output, targets)
+            loss.backward()
+            return loss.detach()
+        return run
+
+    reference_loss = DepthLoss().to(device)
+    reference_loss.ssim = ReferenceSSIM()
+    separable = pytorch_ssim.SeparableSSIM().to(device)
+    img1, img2, mask = targets.log_depth.unsqueeze(0), output.detach().reshape(shape).unsqueeze(0), targets.valid.unsqueeze(0)
+    rows = [
+        ('ssim', lambda: reference_ssim_loss(img1, img2, mask), lambda: 1 - separable(img1, img2, mask)),
+        ('loss', loss_step(reference_loss), loss_step(DepthLoss().to(device))),
+        ('ssim_error', lambda: reference_ssim_error(output.detach(), targets), lambda: ssim_error(output.detach(), targets)),
+        ('log_ssim_error', lambda: reference_log_ssim_error(output.detach(), targets), lambda: log_ssim_error(output.detach(), targets)),
+    ]
+
+    # Computed for all rows before timing, which also warms up the allocator
+    differences = [(reference() - new()).abs().item() for _, reference, new in rows]
+    print('{:>16s} {:>15s} {:>15s} {:>8s} {:>10s}'.format('', 'previous [ms]', 'separable [ms]', 'speedup', 'abs diff'))
+    for (name, reference, new), difference in zip(rows, differences):
+        t_reference = timeit(synchronized(reference), args.repeat)
+        t_new = timeit(synchronized(new), args.repeat)
+        print('{:>16s} {:>15.2f} {:>15.2f} {:>7.2f}x {:>10.2e}'.format(
+            name, 1000 * t_reference, 1000 * t_new, t_reference / t_new, difference))
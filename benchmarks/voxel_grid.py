@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of VoxelGrid.convert against the previous per-corner implementation.
+
+Run from the repository root:
+    python -m benchmarks.voxel_grid --num_events 100000 1000000 5000000
+"""
+import time
+
+import numpy as np
+import torch
+
+from dataset.representations import VoxelGrid
+
+
+def reference_convert(voxel_grid: torch.Tensor, normalize: bool, x, y, pol, time):
+    """Previous VoxelGrid.convert: one put_ with boolean-mask gathers per trilinear corner"""
+    C, H, W = voxel_grid.shape
+    with torch.no_grad():
+        voxel_grid = voxel_grid.to(pol.device).clone()
+
+        t_norm = time
+        t_norm = (C - 1) * (t_norm-t_norm[0]) / (t_norm[-1]-t_norm[0])
+
+        x0 = x.int()
+        y0 = y.int()
+        t0 = t_norm.int()
+
+        value = 2*pol-1
+
+        for xlim in [x0,x0+1]:
+            for ylim in [y0,y0+1]:
+                for tlim in [t0,t0+1]:
+
+                    mask = (xlim < W) & (xlim >= 0) & (ylim < H) & (ylim >= 0) & (tlim >= 0) & (tlim < C)
+                    interp_weights = value * (1 - (xlim-x).abs()) * (1 - (ylim-y).abs()) * (1 - (tlim - t_norm).abs())
+
+                    index = H * W * tlim.long() + \
+                            W * ylim.long() + \
+                            xlim.long()
+
+                    voxel_grid.put_(index[mask], interp_weights[mask], accumulate=True)
+
+        if normalize:
+            mask = torch.nonzero(voxel_grid, as_tuple=True)
+            if mask[0].size()[0] > 0:
+                mean = voxel_grid[mask].mean()
+                std = voxel_grid[mask].std()
+                if std > 0:
+                    voxel_grid[mask] = (voxel_grid[mask] - mean) / std
+                else:
+                    voxel_grid[mask] = voxel_grid[mask] - mean
+
+    return voxel_grid
+
+
+def random_events(num_events: int, height: int, width: int, seed: int=0):
+    """Events as they come out of Sequence: rectified (float) coordinates, t normalized to [0, 1]"""
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-2, width + 1, num_events).astype('float32')
+    y = rng.uniform(-2, height + 1, num_events).astype('float32')
+    pol = rng.integers(0, 2, num_events).astype('float32')
+    t = np.sort(rng.integers(0, 50_000, num_events)).astype('int64')
+    t = (t - t[0]).astype('float32')
+    t = t/t[-1]
+    return [torch.from_numpy(a) for a in (x, y, pol, t)]
+
+
+def timeit(fn, repeat: int):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_events', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--num_bins', type=int, default=15)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    height, width = 480, 640
+    representation = VoxelGrid(args.num_bins, height, width, normalize=True)
+    template = torch.zeros((args.num_bins, height, width), dtype=torch.float)
+
+    print('{:>10s} {:>14s} {:>14s} {:>8s} {:>10s}'.format('events', 'reference [ms]', 'convert [ms]', 'speedup', 'identical'))
+    for num_events in args.num_events:
+        events = [a.to(args.device) for a in random_events(num_events, height, width)]
+        reference = reference_convert(template, True, *events)
+        output = representation.convert(*events)
+        identical = torch.equal(reference, output)
+
+        t_reference = timeit(lambda: reference_convert(template, True, *events), args.repeat)
+        t_convert = timeit(lambda: representation.convert(*events), args.repeat)
+        print('{:>10d} {:>14.2f} {:>14.2f} {:>7.2f}x {:>10s}'.format(
+            num_events, 1000 * t_reference, 1000 * t_convert, t_reference / t_convert, str(identical)))
@@ -0,0 +1,31 @@
+"""
+Compile the dataset manifest of a DSEC directory ahead of training.
+
+The manifest (see dataset/manifest.py) holds the exact event index range of every sample
+and location, the ground truth paths and memory-mappable copies of the rectify maps.
+DatasetProvider builds or updates it on startup when manifest_dir is set; this script
+does the same without starting a training, e.g. right after downloading the dataset.
+"""
+import time
+from pathlib import Path
+
+from dataset.manifest import DatasetManifest
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsec_dir', default="/home/lxz/DSEC/", help='Path to DSEC dataset directory')
+    parser.add_argument('--manifest_dir', default="saved/manifest", help='Directory of the manifest')
+    parser.add_argument('--split', default="train", help='Subdirectory containing the sequences')
+    parser.add_argument('--delta_t_ms', type=int, default=50)
+    parser.add_argument('--num_workers', type=int, default=None, help='Processes building the manifest (default: one per CPU)')
+    args = parser.parse_args()
+
+    split_dir = Path(args.dsec_dir) / args.split
+    assert split_dir.is_dir(), str(split_dir)
+
+    t_start = time.time()
+    manifest = DatasetManifest(split_dir, args.delta_t_ms, Path(args.manifest_dir), args.num_workers)
+    print('{} sequences rebuilt in {:.1f} s: {}'.format(manifest.num_rebuilt, time.time() - t_start, manifest.manifest_file))
@@ -0,0 +1,43 @@
+"""
+Precompute the voxel grids of all samples of a DSEC directory.
+
+The grids are written to a VoxelCache (see dataset/voxel_cache.py), one shard per
+sequence and location. DatasetProvider/Sequence read them with voxel_cache_dir and
+fall back to computing the grids from the events on a cache miss, e.g. when the
+source events.h5 changed after the cache was built.
+"""
+from pathlib import Path
+
+from tqdm import tqdm
+
+from dataset.sequence import Sequence
+from dataset.voxel_cache import VoxelCache
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsec_dir', default="/home/lxz/DSEC/", help='Path to DSEC dataset directory')
+    parser.add_argument('--cache_dir', required=True, help='Path to the voxel grid cache directory')
+    parser.add_argument('--split', default="train", help='Subdirectory containing the sequences')
+    parser.add_argument('--delta_t_ms', type=int, default=50)
+    parser.add_argument('--num_bins', type=int, default=15)
+    parser.add_argument('--dtype', default="float16", choices=VoxelCache.dtypes, help='Storage type of the grids')
+    parser.add_argument('--overwrite', action='store_true', help='Rebuild shards that already exist')
+    args = parser.parse_args()
+
+    split_dir = Path(args.dsec_dir) / args.split
+    assert split_dir.is_dir(), str(split_dir)
+    voxel_cache = VoxelCache(Path(args.cache_dir), args.num_bins, args.delta_t_ms, dtype=args.dtype)
+
+    for seq_path in sorted(split_dir.iterdir()):
+        sequence = Sequence(seq_path, args.split, args.delta_t_ms, args.num_bins)
+        file_indices = [sequence.get_file_index(index) for index in range(len(sequence))]
+        for location in sequence.locations:
+            if not args.overwrite and voxel_cache.shard_path(sequence.name, location).is_file():
+                continue
+            grids = (sequence.get_event_representation(index, location)
+                     for index in tqdm(range(len(sequence)), desc='{} {}'.format(sequence.name, location)))
+            voxel_cache.write_shard(sequence.name, location, file_indices, grids,
+                                    sequence.event_dirs[location] / 'events.h5')
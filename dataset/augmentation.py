@@ -0,0 +1,122 @@
+from typing import Dict, Optional, Sequence as SequenceType, Tuple
+
+import numpy as np
+
+
+def output_size(frame_height: int=480, frame_width: int=640, crop: Optional[SequenceType[int]]=None,
+                crop_size: Optional[SequenceType[int]]=None, **kwargs):
+    """(height, width) of the samples of EventAugmentation(frame_height, frame_width, crop, crop_size, ...)"""
+    if crop_size is not None:
+        return tuple(crop_size)
+    if crop is not None:
+        return tuple(crop[2:])
+    return frame_height, frame_width
+
+
+class EventAugmentation:
+    """Cropping and augmentation of raw events, before they are converted to a representation
+    Events are rectified (float) coordinates x, y with polarity p and time t. A sample goes
+    through, in this order:
+    crop: static region [top, top + height) x [left, left + width) of the frame, e.g. the region
+        of valid ground truth. MonoDepthNet needs height and width to be multiples of 8.
+    crop_size: random (height, width) crop within the static crop.
+    hflip: probability of a horizontal flip.
+    polarity_flip: probability of inverting the polarity of all events.
+    time_reversal: probability of playing the window backwards: the order of the events is
+        reversed, their times are mirrored over the window and their polarity is inverted.
+    Events outside of the crop are dropped and coordinates are shifted into the crop, hence
+    representations are built at the size of the crop only. Ground truth maps are cropped
+    and flipped with apply_map.
+
+    The random parameters of a sample depend on seed, the epoch (see set_epoch), the
+    sequence and index // hold_length. With hold_length > 1, consecutive windows share their
+    parameters. SequenceLaneBatchSampler cuts its chunks at the same multiples of the index
+    within the sequence: with a hold_length dividing lane_chunk_length, the parameters stay
+    the same while a lane carries its recurrent state through a chunk.
+    set_epoch(..., training=False) disables the random augmentation for validation: the static
+    crop is kept and the random crop becomes a center crop.
+    """
+    def __init__(self, frame_height: int=480, frame_width: int=640, crop: Optional[SequenceType[int]]=None,
+                 crop_size: Optional[SequenceType[int]]=None, hflip: float=0.0, polarity_flip: float=0.0,
+                 time_reversal: float=0.0, hold_length: int=1, seed: Optional[int]=None):
+        """
+        :param crop: Static crop (top, left, height, width), None for the full frame.
+        :param crop_size: Size (height, width) of the random crop, None to disable it.
+        """
+        top, left, height, width = crop if crop is not None else (0, 0, frame_height, frame_width)
+        assert 0 <= top and top + height <= frame_height, crop
+        assert 0 <= left and left + width <= frame_width, crop
+        self.crop = (top, left, height, width)
+        if crop_size is not None:
+            assert 0 < crop_size[0] <= height and 0 < crop_size[1] <= width, crop_size
+        self.crop_size = tuple(crop_size) if crop_size is not None else None
+        for probability in [hflip, polarity_flip, time_reversal]:
+            assert 0 <= probability <= 1
+        self.hflip = hflip
+        self.polarity_flip = polarity_flip
+        self.time_reversal = time_reversal
+        assert hold_length >= 1
+        self.hold_length = hold_length
+        self.seed = int(seed) if seed is not None else int(np.random.randint(2**31))
+        self.epoch = 0
+        self.training = True
+
+    @property
+    def height(self) -> int:
+        return output_size(crop=self.crop, crop_size=self.crop_size)[0]
+
+    @property
+    def width(self) -> int:
+        return output_size(crop=self.crop, crop_size=self.crop_size)[1]
+
+    def set_epoch(self, epoch: int, training: bool=True):
+        self.epoch = epoch
+        self.training = training
+
+    def sample(self, sequence_id: int, index: int) -> Dict:
+        """Parameters of a sample: 'top' and 'left' of its crop in the frame, and its flips"""
+        top, left, height, width = self.crop
+        params = {'top': top, 'left': left, 'hflip': False, 'polarity_flip': False, 'time_reversal': False}
+        if not self.training:
+            if self.crop_size is not None:
+                # Center crop, samples have the same size as in training
+                params['top'] += (height - self.crop_size[0]) // 2
+                params['left'] += (width - self.crop_size[1]) // 2
+            return params
+        rng = np.random.default_rng([self.seed, self.epoch, sequence_id, index // self.hold_length])
+        if self.crop_size is not None:
+            params['top'] += int(rng.integers(0, height - self.crop_size[0] + 1))
+            params['left'] += int(rng.integers(0, width - self.crop_size[1] + 1))
+        params['hflip'] = bool(rng.random() < self.hflip)
+        params['polarity_flip'] = bool(rng.random() < self.polarity_flip)
+        params['time_reversal'] = bool(rng.random() < self.time_reversal)
+        return params
+
+    def apply_events(self, x: np.ndarray, y: np.ndarray, p: np.ndarray, t: np.ndarray, params: Dict,
+                     time_window: Optional[Tuple[int, int]]=None):
+        """Events of the crop, in crop coordinates, with the flips of params applied
+        Time is reversed within time_window if given, within the first and the last event otherwise.
+        """
+        x = x - params['left']
+        y = y - params['top']
+        # Events within the pixel centers of the crop, a range that is symmetric under the flip
+        mask = (x >= 0) & (x <= self.width - 1) & (y >= 0) & (y <= self.height - 1)
+        if not mask.all():
+            x, y, p, t = x[mask], y[mask], p[mask], t[mask]
+        if params['hflip']:
+            x = (self.width - 1) - x
+        invert_polarity = params['polarity_flip'] != params['time_reversal']
+        if invert_polarity:
+            p = 1 - p
+        if params['time_reversal'] and t.size > 0:
+            t_start, t_end = time_window if time_window is not None else (t[0], t[-1])
+            t = (t_start + t_end) - t[::-1]
+            x, y, p = x[::-1], y[::-1], p[::-1]
+        return x, y, p, t
+
+    def apply_map(self, image: np.ndarray, params: Dict) -> np.ndarray:
+        """Crop and flip a (..., H, W) map of the frame (e.g. the disparity) like the events"""
+        image = image[..., params['top']:params['top'] + self.height, params['left']:params['left'] + self.width]
+        if params['hflip']:
+            image = image[..., ::-1]
+        return np.ascontiguousarray(image)
@@ -1,21 +1,127 @@
+from pathlib import Path
+
 import numpy as np
-from torch.utils.data import DataLoader
+import torch
+from torch.utils.data import ConcatDataset, DataLoader
 from torch.utils.data.dataloader import default_collate
-from torch.utils.data.sampler import SubsetRandomSampler
+from torch.utils.data.sampler import Sampler, SubsetRandomSampler
+
+from dataset.provider import DatasetProvider
+from utils.h5pool import worker_init_fn as h5_worker_init_fn
+
+
+def collate_events(batch):
+    """
+    default_collate, except for compact events (see Sequence.events_to_compact) and sparse
+    voxel grids (see dataset.representations.compact_voxel_grid) under 'representation':
+    the events or the non-zero voxels of all samples are concatenated and their boundaries
+    are stored in 'offsets', such that sample b is [offsets[b], offsets[b + 1]).
+    """
+    output = default_collate([{k: v for k, v in sample.items() if k != 'representation'} for sample in batch])
+    output['representation'] = dict()
+    for location in batch[0]['representation']:
+        events = [sample['representation'][location] for sample in batch]
+        if not isinstance(events[0], dict):
+            output['representation'][location] = default_collate(events)
+            continue
+        keys = ['indices', 'values'] if 'indices' in events[0] else ['x', 'y', 'p', 't']
+        packed = {k: torch.cat([e[k] for e in events]) for k in keys}
+        counts = torch.tensor([e[keys[-1]].numel() for e in events], dtype=torch.long)
+        packed['offsets'] = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(counts, 0)])
+        output['representation'][location] = packed
+    return output
+
+
+def sequence_starts(dataset) -> np.ndarray:
+    """Global index of the first window of every sequence of a (ConcatDataset of) Sequence"""
+    seq_ends = dataset.cumulative_sizes if isinstance(dataset, ConcatDataset) else [len(dataset)]
+    return np.concatenate([[0], seq_ends[:-1]]).astype('int64')
+
+
+def sequence_chunks(dataset, chunk_length: int):
+    """Global indices of the dataset, split into chunks of the windows i of a sequence with the same i // chunk_length"""
+    seq_starts = sequence_starts(dataset)
+    seq_ends = np.append(seq_starts[1:], len(dataset))
+    return [np.arange(start, min(start + chunk_length, seq_end))
+            for seq_start, seq_end in zip(seq_starts, seq_ends)
+            for start in range(seq_start, seq_end, chunk_length)]
+
+
+class SequenceLaneBatchSampler(Sampler):
+    """
+    Batch sampler for recurrent models: lane b of every batch (i.e. sample b) continues
+    the lane b of the previous batch with the next window of the same sequence.
+
+    The indices are split into runs of consecutive windows of one sequence, cut at the
+    multiples of chunk_length of the index within the sequence (0 for whole runs): windows
+    i and j of a sequence share their chunk only if i // chunk_length == j // chunk_length,
+    like the augmentation parameters with hold_length=chunk_length (see EventAugmentation).
+    Every epoch, the order of the chunks is
+    shuffled (if shuffle), the chunks are concatenated and the result is split into
+    batch_size lanes of equal length. A lane therefore reads its windows sequentially,
+    and only crosses a sequence boundary between two chunks. Such boundaries are found
+    with the 'sequence_id' and 'index' of the samples (see Sequence.__getitem__).
+    The last len(indices) % batch_size indices of an epoch are dropped.
+    """
+    def __init__(self, dataset, indices, batch_size: int, chunk_length: int=0, shuffle: bool=True):
+        assert batch_size >= 1
+        assert chunk_length >= 0
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_indices = len(indices)
+
+        # Global index -> sequence and index within the sequence, from the bounds of the sub-datasets
+        seq_starts = sequence_starts(dataset)
+        indices = np.sort(np.asarray(indices, dtype='int64'))
+        seq_ids = np.searchsorted(seq_starts, indices, side='right') - 1
+        breaks = (np.diff(indices) != 1) | (np.diff(seq_ids) != 0)
+        if chunk_length > 0:
+            breaks |= (indices[1:] - seq_starts[seq_ids[1:]]) % chunk_length == 0
+        self.chunks = np.split(indices, np.flatnonzero(breaks) + 1) if indices.size > 0 else list()
+
+    def __iter__(self):
+        order = np.random.permutation(len(self.chunks)) if self.shuffle else np.arange(len(self.chunks))
+        stream = np.concatenate([self.chunks[i] for i in order]) if len(order) > 0 else np.zeros(0, dtype='int64')
+        lanes = stream[:len(self) * self.batch_size].reshape(self.batch_size, len(self))
+        for step in range(len(self)):
+            yield lanes[:, step].tolist()
+
+    def __len__(self):
+        return self.num_indices // self.batch_size
 
 
 class BaseDataLoader(DataLoader):
     """
     Base class for all data loaders
     """
-    def __init__(self, dataset, batch_size, shuffle, validation_split, num_workers, drop_last, collate_fn=default_collate):
+    def __init__(self, dataset, batch_size, shuffle, validation_split, num_workers, drop_last, collate_fn=default_collate,
+                 worker_init_fn=h5_worker_init_fn, sequence_lanes=False, lane_chunk_length=0):
+        """
+        :param sequence_lanes: Draw batches with SequenceLaneBatchSampler, for recurrent models.
+            The validation split is then made of whole chunks of lane_chunk_length windows.
+        :param lane_chunk_length: Maximum number of consecutive windows a lane reads in a row, 0 for no limit.
+        """
         self.validation_split = validation_split
         self.shuffle = shuffle
+        self.sequence_lanes = sequence_lanes
+        self.lane_chunk_length = lane_chunk_length
 
         self.batch_idx = 0
         self.n_samples = len(dataset)
 
-        self.sampler, self.valid_sampler = self._split_sampler(self.validation_split)
+        self.sampler, self.valid_sampler = self._split_sampler(self.validation_split, dataset)
+
+        if sequence_lanes:
+            self.init_kwargs = {
+                'dataset': dataset,
+                'collate_fn': collate_fn,
+                'num_workers': num_workers,
+                'worker_init_fn': worker_init_fn
+            }
+            train_idx = self.sampler.indices if self.sampler is not None else np.arange(self.n_samples)
+            batch_sampler = SequenceLaneBatchSampler(dataset, train_idx, batch_size, lane_chunk_length, shuffle)
+            super().__init__(batch_sampler=batch_sampler, **self.init_kwargs)
+            return
 
         self.init_kwargs = {
             'dataset': dataset,
@@ -23,18 +129,25 @@ class BaseDataLoader(DataLoader):
             'shuffle': self.shuffle,
             'collate_fn': collate_fn,
             'num_workers': num_workers,
-            'drop_last': drop_last
+            'drop_last': drop_last,
+            'worker_init_fn': worker_init_fn
         }
         super().__init__(sampler=self.sampler, **self.init_kwargs)
 
-    def _split_sampler(self, split):
+    def _split_sampler(self, split, dataset):
         if split == 0.0:
             return None, None
 
         idx_full = np.arange(self.n_samples)
 
         np.random.seed(0)
-        np.random.shuffle(idx_full)
+        if self.sequence_lanes and self.lane_chunk_length > 0:
+            # Keep the chunks of SequenceLaneBatchSampler together, either in the training or in the validation split
+            blocks = sequence_chunks(dataset, self.lane_chunk_length)
+            blocks = [blocks[i] for i in np.random.permutation(len(blocks))]
+            idx_full = np.concatenate(blocks)
+        else:
+            np.random.shuffle(idx_full)
 
         if isinstance(split, int):
             assert split > 0
@@ -43,6 +156,12 @@ class BaseDataLoader(DataLoader):
         else:
             len_valid = int(self.n_samples * split)
 
+        if self.sequence_lanes and self.lane_chunk_length > 0:
+            # Cut at the chunk boundary closest to the configured size, within the chunk of a single-chunk dataset
+            block_ends = np.cumsum([len(block) for block in blocks])[:-1]
+            if block_ends.size > 0:
+                len_valid = int(block_ends[np.argmin(np.abs(block_ends - len_valid))])
+
         valid_idx = idx_full[0:len_valid]
         train_idx = np.delete(idx_full, np.arange(0, len_valid))
 
@@ -58,6 +177,10 @@ class BaseDataLoader(DataLoader):
     def split_validation(self):
         if self.valid_sampler is None:
             return None
+        elif self.sequence_lanes:
+            batch_sampler = SequenceLaneBatchSampler(
+                    self.dataset, self.valid_sampler.indices, self.batch_sampler.batch_size, self.lane_chunk_length, shuffle=False)
+            return DataLoader(batch_sampler=batch_sampler, **self.init_kwargs)
         else:
             return DataLoader(sampler=self.valid_sampler, **self.init_kwargs)
         
@@ -67,4 +190,33 @@ class EventDataLoader(BaseDataLoader):
     MNIST data loading demo using BaseDataLoader
     """
     def __init__(self, dataset, batch_size, shuffle=True, validation_split=0.0, num_workers=1, training=True):
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
\ No newline at end of file
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+
+
+def build_data_loaders(config):
+    """Training and validation data loaders of the 'dsec_dir', 'dataset' and 'data_loader' sections of config
+    Without 'dataset' section, e.g. in the config of an earlier run, the dataset has the default options.
+    """
+    dataset_args = config.config.get('dataset', {}).get('args', {})
+    loader_args = config['data_loader']['args']
+    augmentation = dataset_args.get('augmentation')
+    if loader_args.get('sequence_lanes', False) and augmentation is not None:
+        # Lanes must not change their augmentation parameters within a chunk (see EventAugmentation)
+        hold_length = augmentation.get('hold_length', 1)
+        chunk_length = loader_args.get('lane_chunk_length', 0)
+        assert hold_length == 1 or (chunk_length > 0 and chunk_length % hold_length == 0), \
+            'hold_length {} of the augmentation must divide lane_chunk_length {}'.format(hold_length, chunk_length)
+    dataset_provider = DatasetProvider(Path(config['dsec_dir']), **dataset_args)
+    data_loader = BaseDataLoader(
+        dataset=dataset_provider.get_train_dataset(),
+        batch_size=loader_args['batch_size'],
+        shuffle=loader_args['shuffle'],
+        validation_split=loader_args['validation_split'],
+        num_workers=loader_args['num_workers'],
+        drop_last=True,
+        collate_fn=collate_events if dataset_args.get('representation') == 'events' or \
+                dataset_args.get('voxel_sparse', False) else default_collate,
+        sequence_lanes=loader_args.get('sequence_lanes', False),
+        lane_chunk_length=loader_args.get('lane_chunk_length', 0),
+    )
+    return data_loader, data_loader.split_validation()
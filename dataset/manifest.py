@@ -0,0 +1,119 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import hdf5plugin
+import h5py
+import numpy as np
+
+from utils.eventslicer import EventSlicer
+
+
+MANIFEST_VERSION = 1
+LOCATIONS = ['left', 'right']
+
+
+def sequence_signature(seq_path: Path) -> Dict[str, List[int]]:
+    """Size and mtime of the files a sequence manifest is derived from
+    The disparity/event directory stands for its PNGs: its mtime changes when files are added or removed.
+    """
+    paths = [seq_path / 'disparity' / 'timestamps.txt', seq_path / 'disparity' / 'event']
+    for location in LOCATIONS:
+        paths.append(seq_path / 'events' / location / 'events.h5')
+        paths.append(seq_path / 'events' / location / 'rectify_map.h5')
+    signature = dict()
+    for path in paths:
+        stat = path.stat()
+        signature[str(path.relative_to(seq_path))] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def build_sequence_manifest(seq_path: Path, delta_t_ms: int, manifest_dir: Path) -> Dict:
+    """Write the manifest files of a sequence and return its entry of manifest json
+    <seq>_dt<delta_t_ms>.npz: timestamps, file indices and, per location, the exact
+        [start, end) event indices of every sample, in the order of Sequence
+    <seq>_<location>_rectify_map.npy: rectify maps, memory-mapped read-only by the readers
+    """
+    disp_dir = seq_path / 'disparity'
+    timestamps = np.loadtxt(disp_dir / 'timestamps.txt', dtype='int64')
+    file_indices = sorted(int(entry.stem) for entry in (disp_dir / 'event').iterdir())
+    assert all(entry.suffix == '.png' for entry in (disp_dir / 'event').iterdir())
+    assert len(file_indices) == timestamps.size
+    # The first disparity map is removed as in Sequence: there are no events before it.
+    assert file_indices[0] == 0
+    file_indices = np.array(file_indices[1:], dtype='int64')
+    timestamps = timestamps[1:]
+
+    arrays = {'timestamps': timestamps, 'file_indices': file_indices}
+    for location in LOCATIONS:
+        ev_dir_location = seq_path / 'events' / location
+        with h5py.File(str(ev_dir_location / 'events.h5'), 'r') as h5f:
+            event_slicer = EventSlicer(h5f)
+            arrays['event_ranges_{}'.format(location)] = event_slicer.get_index_ranges(
+                    timestamps - delta_t_ms * 1000, timestamps)
+        with h5py.File(str(ev_dir_location / 'rectify_map.h5'), 'r') as h5_rect:
+            np.save(str(manifest_dir / '{}_{}_rectify_map.npy'.format(seq_path.name, location)), h5_rect['rectify_map'][()])
+    np.savez(str(manifest_dir / '{}_dt{}.npz'.format(seq_path.name, delta_t_ms)), **arrays)
+    return {'signature': sequence_signature(seq_path)}
+
+
+class SequenceManifest:
+    """Manifest of one sequence, see build_sequence_manifest"""
+    def __init__(self, seq_path: Path, delta_t_ms: int, manifest_dir: Path):
+        with np.load(str(manifest_dir / '{}_dt{}.npz'.format(seq_path.name, delta_t_ms))) as arrays:
+            self.timestamps = arrays['timestamps']
+            self.file_indices = arrays['file_indices']
+            self.event_ranges = {location: arrays['event_ranges_{}'.format(location)] for location in LOCATIONS}
+        disp_gt_dir = seq_path / 'disparity' / 'event'
+        self.disp_gt_pathstrings = [str(disp_gt_dir / '{:06d}.png'.format(file_index)) for file_index in self.file_indices]
+        self.manifest_dir = manifest_dir
+        self.name = seq_path.name
+
+    def get_rectify_map(self, location: str) -> np.ndarray:
+        # Read-only memory map: the pages are shared by all processes (e.g. DataLoader workers).
+        return np.load(str(self.manifest_dir / '{}_{}_rectify_map.npy'.format(self.name, location)), mmap_mode='r')
+
+
+class DatasetManifest:
+    """Compiled manifest of the sequences of a dataset split, cached in manifest_dir
+    Entries are rebuilt in parallel (num_workers processes) for sequences that are new or
+    whose source files changed in size or mtime since the manifest was written.
+    """
+    def __init__(self, split_path: Path, delta_t_ms: int, manifest_dir: Path, num_workers: int=None):
+        self.split_path = split_path
+        self.delta_t_ms = delta_t_ms
+        self.manifest_dir = manifest_dir / split_path.name
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.manifest_dir / 'manifest_dt{}.json'.format(delta_t_ms)
+
+        entries = dict()
+        if self.manifest_file.is_file():
+            with self.manifest_file.open('rt') as handle:
+                manifest = json.load(handle)
+            if manifest.get('version') == MANIFEST_VERSION:
+                entries = manifest['sequences']
+
+        seq_paths = sorted(child for child in split_path.iterdir() if child.is_dir())
+        stale = [seq_path for seq_path in seq_paths
+                 if seq_path.name not in entries or entries[seq_path.name]['signature'] != sequence_signature(seq_path)]
+        if len(stale) > 0:
+            num_workers = num_workers if num_workers is not None else min(len(stale), os.cpu_count() or 1)
+            if num_workers > 1:
+                with ProcessPoolExecutor(num_workers) as executor:
+                    built = list(executor.map(build_sequence_manifest, stale, [delta_t_ms] * len(stale),
+                                              [self.manifest_dir] * len(stale)))
+            else:
+                built = [build_sequence_manifest(seq_path, delta_t_ms, self.manifest_dir) for seq_path in stale]
+            for seq_path, entry in zip(stale, built):
+                entries[seq_path.name] = entry
+            entries = {seq_path.name: entries[seq_path.name] for seq_path in seq_paths}
+            tmp_file = self.manifest_file.with_suffix('.tmp')
+            with tmp_file.open('wt') as handle:
+                json.dump({'version': MANIFEST_VERSION, 'sequences': entries}, handle, indent=4)
+            tmp_file.replace(self.manifest_file)
+        self.num_rebuilt = len(stale)
+
+    def get(self, seq_path: Path) -> SequenceManifest:
+        return SequenceManifest(seq_path, self.delta_t_ms, self.manifest_dir)
@@ -0,0 +1,155 @@
+import queue
+import threading
+import time
+from typing import Dict
+
+import torch
+
+
+_END = object()
+
+
+class _Error:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _PinnedBuffers:
+    """Reused page-locked host buffers, one per tensor of a batch
+    A buffer keeps its capacity and is grown (doubled) when a batch needs more, so batches
+    of varying size (e.g. compact events) do not allocate pinned memory every step.
+    """
+    def __init__(self):
+        self.buffers: Dict[tuple, torch.Tensor] = dict()
+        # CUDA event recorded after the copies out of the buffers, None while they are free
+        self.copied = None
+
+    def stage(self, key: tuple, tensor: torch.Tensor) -> torch.Tensor:
+        numel = tensor.numel()
+        buffer = self.buffers.get(key)
+        if buffer is None or buffer.dtype != tensor.dtype or buffer.numel() < numel:
+            capacity = max(numel, 2 * buffer.numel() if buffer is not None and buffer.dtype == tensor.dtype else 0)
+            buffer = torch.empty(capacity, dtype=tensor.dtype).pin_memory()
+            self.buffers[key] = buffer
+        staged = buffer[:numel].view(tensor.shape)
+        staged.copy_(tensor)
+        return staged
+
+
+class BatchPrefetcher:
+    """
+    Iterate over a data loader while a background thread stages the next batches on the device
+    On CUDA, the tensors of every batch (nested in dicts, lists and tuples) are copied into
+    reused pinned host buffers, then to the device with non_blocking copies on a separate
+    stream, so the transfer overlaps the compute of the current batch. On other devices, the
+    thread only loads the batches ahead into a bounded queue.
+
+    The time the consumer waits for a batch is accumulated in wait_s: if it is a large part
+    of the epoch, training is input-bound.
+
+    :param loader: Iterable of batches, e.g. a BaseDataLoader. Its attributes are forwarded.
+    :param device: Device of the yielded batches.
+    :param num_batches: Maximum number of batches staged ahead.
+    """
+    def __init__(self, loader, device, num_batches: int=2):
+        assert num_batches >= 1
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_batches = num_batches
+        self.use_cuda = self.device.type == 'cuda' and torch.cuda.is_available()
+        # One more set of buffers than staged batches: a set is refilled only once its copies completed.
+        self.buffer_sets = [_PinnedBuffers() for _ in range(num_batches + 1)] if self.use_cuda else []
+        self.stream = torch.cuda.Stream(self.device) if self.use_cuda else None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.wait_s = 0.0
+        self.num_yielded = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the prefetcher, e.g. n_samples or batch_sampler
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def _to_device(self, data, buffers: _PinnedBuffers, key=()):
+        if isinstance(data, torch.Tensor):
+            if self.use_cuda:
+                return buffers.stage(key, data).to(self.device, non_blocking=True)
+            return data.to(self.device)
+        if isinstance(data, dict):
+            return {k: self._to_device(v, buffers, key + (k,)) for k, v in data.items()}
+        if isinstance(data, (list, tuple)):
+            return type(data)(self._to_device(v, buffers, key + (i,)) for i, v in enumerate(data))
+        return data
+
+    def _stage(self, data, step: int):
+        if not self.use_cuda:
+            return self._to_device(data, None), None
+        buffers = self.buffer_sets[step % len(self.buffer_sets)]
+        if buffers.copied is not None:
+            buffers.copied.synchronize()
+        with torch.cuda.stream(self.stream):
+            data = self._to_device(data, buffers)
+            buffers.copied = torch.cuda.Event()
+            buffers.copied.record(self.stream)
+        return data, buffers.copied
+
+    def _run(self, out_queue: queue.Queue, stop: threading.Event):
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    out_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for step, data in enumerate(self.loader):
+                if not put(self._stage(data, step)):
+                    return
+        except BaseException as error:
+            put(_Error(error))
+            return
+        put(_END)
+
+    @staticmethod
+    def _record_stream(data, stream):
+        # The tensors were allocated on the copy stream and are now used on the current stream
+        if isinstance(data, torch.Tensor):
+            data.record_stream(stream)
+        elif isinstance(data, dict):
+            for v in data.values():
+                BatchPrefetcher._record_stream(v, stream)
+        elif isinstance(data, (list, tuple)):
+            for v in data:
+                BatchPrefetcher._record_stream(v, stream)
+
+    def __iter__(self):
+        out_queue = queue.Queue(maxsize=self.num_batches)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._run, args=(out_queue, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                t_start = time.perf_counter()
+                item = out_queue.get()
+                self.wait_s += time.perf_counter() - t_start
+                if item is _END:
+                    break
+                if isinstance(item, _Error):
+                    raise RuntimeError('batch prefetching failed') from item.error
+                data, copied = item
+                if copied is not None:
+                    current_stream = torch.cuda.current_stream(self.device)
+                    current_stream.wait_event(copied)
+                    self._record_stream(data, current_stream)
+                self.num_yielded += 1
+                yield data
+        finally:
+            stop.set()
+            thread.join()
@@ -1,18 +1,78 @@
 from pathlib import Path
+from typing import Dict, NamedTuple, Tuple
 
 import torch
 
-from dataset.sequence import Sequence
+from dataset.augmentation import EventAugmentation
+from dataset.manifest import DatasetManifest
+from dataset.sequence import Sequence, SequenceOptions
+from dataset.voxel_cache import VoxelCache
+from utils.chunkcache import ChunkCache
+from utils.h5pool import H5FilePool
+
+
+class ProviderOptions(NamedTuple):
+    """Options of the resources a DatasetProvider shares between its sequences"""
+    # LRU of decompressed chunks shared by all sequences. Each DataLoader worker gets its
+    # own copy, hence chunk_cache_nbytes is the budget per worker (0 disables it).
+    chunk_cache_nbytes: int = 0
+    # events.h5 files are opened lazily in each worker, at most max_open_files at once.
+    max_open_files: int = 64
+    # Precomputed voxel grids, see build_voxel_cache.py
+    voxel_cache_dir: str = None
+    voxel_cache_dtype: str = 'float16'
+    # Compiled per-sample index ranges and shared rectify maps, see build_manifest.py
+    manifest_dir: str = None
+    manifest_workers: int = None
+    # Arguments of the EventAugmentation of all sequences, None to disable it
+    augmentation: Dict = None
+
+
+def split_options(options: Dict) -> Tuple[SequenceOptions, ProviderOptions]:
+    """SequenceOptions and ProviderOptions of a flat dict, e.g. the 'dataset' args of a configuration"""
+    unknown = set(options) - set(SequenceOptions._fields) - set(ProviderOptions._fields)
+    if len(unknown) > 0:
+        raise TypeError('unknown dataset options: {}'.format(', '.join(sorted(unknown))))
+    return (SequenceOptions(**{k: v for k, v in options.items() if k in SequenceOptions._fields}),
+            ProviderOptions(**{k: v for k, v in options.items() if k in ProviderOptions._fields}))
+
 
 class DatasetProvider:
-    def __init__(self, dataset_path: Path, delta_t_ms: int=50, num_bins=15):
+    def __init__(self, dataset_path: Path, delta_t_ms: int=50, num_bins=15, **options):
+        """
+        :param options: Fields of SequenceOptions and ProviderOptions, the defaults for the others.
+        """
+        sequence_options, provider_options = split_options(options)
         train_path = dataset_path / 'train'
         assert dataset_path.is_dir(), str(dataset_path)
         assert train_path.is_dir(), str(train_path)
 
+        self.chunk_cache = None
+        if provider_options.chunk_cache_nbytes > 0:
+            self.chunk_cache = ChunkCache(provider_options.chunk_cache_nbytes)
+        self.h5_pool = H5FilePool(provider_options.max_open_files, sequence_options.rdcc_nbytes,
+                                  sequence_options.rdcc_nslots, sequence_options.rdcc_w0)
+        self.voxel_cache = None
+        if provider_options.voxel_cache_dir is not None:
+            self.voxel_cache = VoxelCache(Path(provider_options.voxel_cache_dir), num_bins, delta_t_ms,
+                                          dtype=provider_options.voxel_cache_dtype, h5_pool=self.h5_pool)
+
+        manifest = None
+        if provider_options.manifest_dir is not None:
+            manifest = DatasetManifest(train_path, delta_t_ms, Path(provider_options.manifest_dir),
+                                       provider_options.manifest_workers)
+
+        self.augmentation = None
+        if provider_options.augmentation is not None:
+            self.augmentation = EventAugmentation(**provider_options.augmentation)
+
         train_sequences = list()
-        for child in train_path.iterdir():
-            train_sequences.append(Sequence(child, 'train', delta_t_ms, num_bins))
+        for sequence_id, child in enumerate(sorted(train_path.iterdir())):
+            train_sequences.append(Sequence(child, 'train', delta_t_ms, num_bins, sequence_options,
+                                            sequence_id=sequence_id, chunk_cache=self.chunk_cache,
+                                            h5_pool=self.h5_pool, voxel_cache=self.voxel_cache,
+                                            manifest=manifest.get(child) if manifest is not None else None,
+                                            augmentation=self.augmentation))
 
         self.train_dataset = torch.utils.data.ConcatDataset(train_sequences)
 
@@ -0,0 +1,140 @@
+import math
+
+import numba
+from numba import njit, prange
+import numpy as np
+import torch
+
+
+@njit(parallel=True, cache=True)
+def _rectify_voxelize(x, y, p, t, rectify_lut, partial_grids, num_bins, height, width, normalize):
+    num_chunks = partial_grids.shape[0]
+    grid_size = partial_grids.shape[1]
+    num_events = x.size
+    chunk_size = (num_events + num_chunks - 1) // num_chunks
+    num_invalid = np.zeros(num_chunks, dtype=np.int64)
+    voxel_grid = np.empty(grid_size, dtype=np.float32)
+
+    t_first = t[0] if num_events > 0 else 0
+    t_range = np.float32(t[num_events - 1] - t_first) if num_events > 0 else np.float32(0)
+    bin_max = np.float32(num_bins - 1)
+
+    # Every thread splats a contiguous chunk of events into its own grid.
+    for chunk in prange(num_chunks):
+        grid = partial_grids[chunk]
+        grid[:] = 0
+        for i in range(chunk * chunk_size, min(num_events, (chunk + 1) * chunk_size)):
+            xi = int(x[i])
+            yi = int(y[i])
+            if xi < 0 or xi >= width or yi < 0 or yi >= height:
+                num_invalid[chunk] += 1
+                continue
+            pixel = yi * width + xi
+            x_rect = rectify_lut[pixel, 0]
+            y_rect = rectify_lut[pixel, 1]
+            t_norm = np.float32(0)
+            if t_range > 0:
+                t_norm = bin_max * (np.float32(t[i] - t_first) / t_range)
+            value = np.float32(2) * np.float32(p[i]) - np.float32(1)
+
+            # Same trilinear splat as VoxelGrid.convert, including truncation towards zero.
+            x0 = int(x_rect)
+            y0 = int(y_rect)
+            t0 = int(t_norm)
+            for xl in range(x0, x0 + 2):
+                if xl < 0 or xl >= width:
+                    continue
+                weight_x = value * (np.float32(1) - abs(np.float32(xl) - x_rect))
+                for yl in range(y0, y0 + 2):
+                    if yl < 0 or yl >= height:
+                        continue
+                    weight_xy = weight_x * (np.float32(1) - abs(np.float32(yl) - y_rect))
+                    for tl in range(t0, t0 + 2):
+                        if tl < 0 or tl >= num_bins:
+                            continue
+                        weight = weight_xy * (np.float32(1) - abs(np.float32(tl) - t_norm))
+                        grid[(tl * height + yl) * width + xl] += weight
+
+    # Reduce the partial grids and gather the statistics of the non-zero voxels.
+    num_nonzero = 0
+    total = 0.0
+    for j in prange(grid_size):
+        value = partial_grids[0, j]
+        for chunk in range(1, num_chunks):
+            value += partial_grids[chunk, j]
+        voxel_grid[j] = value
+        if value != 0:
+            num_nonzero += 1
+            total += value
+
+    if normalize and num_nonzero > 0:
+        mean = total / num_nonzero
+        squares = 0.0
+        for j in prange(grid_size):
+            if voxel_grid[j] != 0:
+                squares += (voxel_grid[j] - mean) ** 2
+        std = math.sqrt(squares / (num_nonzero - 1)) if num_nonzero > 1 else 0.0
+        for j in prange(grid_size):
+            if voxel_grid[j] != 0:
+                if std > 0:
+                    voxel_grid[j] = (voxel_grid[j] - mean) / std
+                else:
+                    voxel_grid[j] = voxel_grid[j] - mean
+
+    return voxel_grid, num_invalid.sum()
+
+
+class RectifiedVoxelGrid:
+    """Fused rectification and voxel grid of raw events, on several cores
+    This computes the same grid as rectifying the events with the rectify map and passing
+    them to VoxelGrid.convert (up to the order of the floating point sums), but in a single
+    numba kernel over the raw x, y, p, t arrays of EventSlicer. Every thread splats its part
+    of the events into a private grid and the grids are reduced and normalized at the end.
+
+    Parameters
+    ----------
+    rectify_map : np.ndarray
+        Rectify map of shape (height, width, 2), as stored in rectify_map.h5.
+    channels : int
+        Number of time bins.
+    normalize : bool
+        Normalize the non-zero voxels to zero mean and unit standard deviation.
+    num_threads : int
+        Number of numba threads (and partial grids) per call, capped by NUMBA_NUM_THREADS.
+        0 for all of them, shared between the workers when called in a DataLoader worker.
+    """
+    def __init__(self, rectify_map: np.ndarray, channels: int, normalize: bool=True, num_threads: int=0):
+        assert rectify_map.ndim == 3 and rectify_map.shape[2] == 2, rectify_map.shape
+        self.height, self.width = rectify_map.shape[:2]
+        self.shape = (channels, self.height, self.width)
+        self.normalize = normalize
+        self.num_threads = num_threads
+        # Rectified (x, y) of pixel y * width + x, contiguous so that a lookup is one cache line.
+        self.rectify_lut = np.ascontiguousarray(rectify_map.reshape(-1, 2), dtype='float32')
+        # Allocated on first use, in the process that voxelizes (e.g. the DataLoader worker).
+        self._partial_grids = None
+
+    @staticmethod
+    def _resolve_num_threads(num_threads: int) -> int:
+        max_threads = numba.config.NUMBA_NUM_THREADS
+        if num_threads > 0:
+            return min(num_threads, max_threads)
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is not None:
+            # Every worker would otherwise run on all cores
+            return max(1, max_threads // worker_info.num_workers)
+        return max_threads
+
+    def convert(self, x: np.ndarray, y: np.ndarray, p: np.ndarray, t: np.ndarray) -> torch.Tensor:
+        assert x.shape == y.shape == p.shape == t.shape
+        assert x.ndim == 1
+        if self._partial_grids is None:
+            self.num_threads = self._resolve_num_threads(self.num_threads)
+            self._partial_grids = np.empty((self.num_threads, int(np.prod(self.shape))), dtype='float32')
+
+        numba.set_num_threads(self.num_threads)
+        voxel_grid, num_invalid = _rectify_voxelize(
+                x, y, p, t, self.rectify_lut, self._partial_grids,
+                self.shape[0], self.height, self.width, self.normalize)
+        assert num_invalid == 0, '{} events outside of the {}x{} sensor'.format(num_invalid, self.width, self.height)
+        return torch.from_numpy(voxel_grid).view(*self.shape)
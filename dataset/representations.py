@@ -1,56 +1,305 @@
+from typing import Dict, Optional, Tuple, Union
+
 import torch
 
 
+# Storage formats of voxel grids, see compact_voxel_grid
+voxel_dtypes = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+}
+
+
+def compact_voxel_grid(voxel_grid: torch.Tensor, dtype: str='float32',
+                       sparse: bool=False) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
+    """Voxel grid (C, H, W) in a storage format, to reduce its size in memory and in transfers
+    With sparse, the grid is {'indices': int32 flat indices of its non-zero voxels into
+    C * H * W, 'values': their values}, values in dtype. Such grids are packed by
+    dataset.dataloader.collate_events and densified with VoxelGrid.densify_batch.
+    """
+    voxel_grid = voxel_grid.to(voxel_dtypes[dtype])
+    if not sparse:
+        return voxel_grid
+    flat = voxel_grid.reshape(-1)
+    indices = torch.nonzero(flat).squeeze(1)
+    return {'indices': indices.int(), 'values': flat[indices]}
+
+
+def _pixel_index(xi: torch.Tensor, yi: torch.Tensor, height: int, width: int):
+    """Flat index yi * width + xi of integer pixel coordinates, and whether they are in the image"""
+    mask = (xi < width) & (xi >= 0) & (yi < height) & (yi >= 0)
+    return width * yi.long() + xi.long(), mask
+
+
+def _bilinear_corners(x: torch.Tensor, y: torch.Tensor, value, height: int, width: int):
+    """Bilinear splat of events into an image
+    Returns the flat pixel index, the weight value * (1 - |dx|) * (1 - |dy|) and the in-image
+    mask of the 4 neighbouring pixels of every event, of shape (2, 2, N) with the offsets of
+    the x and y corners along the first two dimensions.
+    """
+    x0 = x.int()
+    y0 = y.int()
+    xlim = torch.stack([x0, x0+1])[:, None, :]
+    ylim = torch.stack([y0, y0+1])[None, :, :]
+    index, mask = _pixel_index(xlim, ylim, height, width)
+    weights = value * (1 - (xlim-x).abs()) * (1 - (ylim-y).abs())
+    return index, weights, mask
+
+
+def _trilinear_corners(x: torch.Tensor, y: torch.Tensor, t_norm: torch.Tensor, value, channels: int,
+                       height: int, width: int):
+    """Trilinear splat of events into a (channels, height, width) grid, t_norm in [0, channels - 1]
+    Returns the flat voxel index, the weight and the in-grid mask of the 8 neighbouring voxels
+    of every event, of shape (2, 2, 2, N) with the offsets of the x, y and t corners along the
+    first three dimensions.
+    """
+    index_xy, weights_xy, mask_xy = _bilinear_corners(x, y, value, height, width)
+    t0 = t_norm.int()
+    tlim = torch.stack([t0, t0+1])[None, None, :, :]
+    index = height * width * tlim.long() + index_xy[:, :, None, :]
+    weights = weights_xy[:, :, None, :] * (1 - (tlim - t_norm).abs())
+    mask = mask_xy[:, :, None, :] & (tlim >= 0) & (tlim < channels)
+    return index, weights, mask
+
+
+def _time_coordinate(time: torch.Tensor, scale: float, time_window: Optional[Tuple[float, float]]=None):
+    """Time of the events scaled to [0, scale] over the first to the last event, or over time_window"""
+    if time_window is None:
+        return scale * (time-time[0]) / (time[-1]-time[0])
+    return scale * (time-time_window[0]) / (time_window[1]-time_window[0])
+
+
+def _splat_(output: torch.Tensor, index: torch.Tensor, weights: torch.Tensor, mask: torch.Tensor):
+    """Add weights into the flat output at index, in one pass
+    Entries outside of mask add zero to element 0 instead of being gathered out.
+    """
+    index = torch.where(mask, index, 0)
+    weights = torch.where(mask, weights, 0)
+    output.index_add_(0, index.flatten(), weights.flatten())
+
+
 class EventRepresentation:
-    def convert(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor):
+    """Dense tensor of shape self.shape computed from the events of a window
+    x and y are (rectified) pixel coordinates, pol is 0 or 1 and time is increasing. All
+    events are converted at once by vectorized kernels that share the bounds and index
+    path above. The number of input channels of the model must be self.shape[0].
+    """
+    shape: Tuple[int, int, int]
+
+    def convert(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor,
+                time_window: Optional[Tuple[float, float]]=None) -> torch.Tensor:
         raise NotImplementedError
 
 
 class VoxelGrid(EventRepresentation):
     def __init__(self, channels: int, height: int, width: int, normalize: bool):
-        self.voxel_grid = torch.zeros((channels, height, width), dtype=torch.float, requires_grad=False)
+        self.shape = (channels, height, width)
         self.nb_channels = channels
         self.normalize = normalize
 
-    def convert(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor):
+    def convert(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor,
+                time_window: Optional[Tuple[float, float]]=None):
+        """
+        By default, the time bins span the first to the last event. With time_window=(t_start, t_end)
+        in the unit of time, they span the window instead, independently of the events it contains.
+        """
         assert x.shape == y.shape == pol.shape == time.shape
         assert x.ndim == 1
 
-        C, H, W = self.voxel_grid.shape
+        C, H, W = self.shape
         with torch.no_grad():
-            self.voxel_grid = self.voxel_grid.to(pol.device)
-            voxel_grid = self.voxel_grid.clone()
+            voxel_grid = torch.zeros(C * H * W, dtype=torch.float, device=pol.device)
+            if x.numel() == 0:
+                return voxel_grid.view(C, H, W)
 
-            t_norm = time
-            t_norm = (C - 1) * (t_norm-t_norm[0]) / (t_norm[-1]-t_norm[0])
+            t_norm = _time_coordinate(time, C - 1, time_window)
+            value = 2*pol-1
+            index, interp_weights, mask = _trilinear_corners(x, y, t_norm, value, C, H, W)
+            _splat_(voxel_grid, index, interp_weights, mask)
 
-            x0 = x.int()
-            y0 = y.int()
-            t0 = t_norm.int()
+            if self.normalize:
+                self._normalize_(voxel_grid)
 
-            value = 2*pol-1
+        return voxel_grid.view(C, H, W)
+
+    def convert_batch(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor,
+                      offsets: torch.Tensor):
+        """Convert the events of B samples at once
+        The events of sample b are [offsets[b], offsets[b + 1]) of x, y, pol and time, as packed
+        by dataset.dataloader.collate_events. Returns a tensor of shape (B, C, H, W) that is
+        identical to stacking convert of every sample.
+        """
+        assert x.shape == y.shape == pol.shape == time.shape
+        assert x.ndim == 1
+        assert offsets.ndim == 1
+
+        C, H, W = self.shape
+        B = offsets.numel() - 1
+        with torch.no_grad():
+            voxel_grid = torch.zeros(B * C * H * W, dtype=torch.float, device=pol.device)
+            if x.numel() > 0:
+                offsets = offsets.to(device=pol.device, dtype=torch.long)
+                counts = offsets[1:] - offsets[:-1]
+                batch_index = torch.repeat_interleave(torch.arange(B, device=pol.device), counts)
+                last = x.numel() - 1
+                t_first = time[offsets[:-1].clamp(max=last)][batch_index]
+                t_last = time[(offsets[1:] - 1).clamp(min=0, max=last)][batch_index]
+
+                t_norm = (C - 1) * (time-t_first) / (t_last-t_first)
+                value = 2*pol-1
+                index, interp_weights, mask = _trilinear_corners(x, y, t_norm, value, C, H, W)
+                _splat_(voxel_grid, C * H * W * batch_index + index, interp_weights, mask)
+
+            voxel_grid = voxel_grid.view(B, C * H * W)
+            if self.normalize:
+                for b in range(B):
+                    self._normalize_(voxel_grid[b])
+
+        return voxel_grid.view(B, C, H, W)
+
+    def densify_batch(self, indices: torch.Tensor, values: torch.Tensor, offsets: torch.Tensor):
+        """Dense float32 (B, C, H, W) voxel grids of B sparse grids (see compact_voxel_grid)
+        The non-zero voxels of sample b are [offsets[b], offsets[b + 1]) of indices and values,
+        as packed by dataset.dataloader.collate_events.
+        """
+        assert indices.shape == values.shape
+        assert indices.ndim == 1
+        assert offsets.ndim == 1
+
+        C, H, W = self.shape
+        B = offsets.numel() - 1
+        with torch.no_grad():
+            voxel_grid = torch.zeros(B * C * H * W, dtype=torch.float, device=values.device)
+            if values.numel() > 0:
+                offsets = offsets.to(device=values.device, dtype=torch.long)
+                # output_size avoids a device to host synchronization
+                batch_index = torch.repeat_interleave(
+                        torch.arange(B, device=values.device), offsets[1:] - offsets[:-1], output_size=values.numel())
+                voxel_grid[C * H * W * batch_index + indices.long()] = values.float()
+        return voxel_grid.view(B, C, H, W)
 
-            for xlim in [x0,x0+1]:
-                for ylim in [y0,y0+1]:
-                    for tlim in [t0,t0+1]:
+    @staticmethod
+    def _normalize_(voxel_grid: torch.Tensor):
+        # Gather the non-zero voxels once and scatter them back once.
+        nonzero = torch.nonzero(voxel_grid).squeeze(1)
+        if nonzero.numel() > 0:
+            values = voxel_grid[nonzero]
+            mean = values.mean()
+            std = values.std()
+            if std > 0:
+                voxel_grid[nonzero] = (values - mean) / std
+            else:
+                voxel_grid[nonzero] = values - mean
 
-                        mask = (xlim < W) & (xlim >= 0) & (ylim < H) & (ylim >= 0) & (tlim >= 0) & (tlim < self.nb_channels)
-                        interp_weights = value * (1 - (xlim-x).abs()) * (1 - (ylim-y).abs()) * (1 - (tlim - t_norm).abs())
 
-                        index = H * W * tlim.long() + \
-                                W * ylim.long() + \
-                                xlim.long()
+class PolarityVoxelGrid(EventRepresentation):
+    """Voxel grid with one set of channels per polarity, shape (2 * channels, H, W)
+    Events are splatted trilinearly as in VoxelGrid but with weight 1, the negative events
+    into channels [0, channels) and the positive events into [channels, 2 * channels), so
+    that events of opposite polarity do not cancel.
+    """
+    def __init__(self, channels: int, height: int, width: int, normalize: bool):
+        self.shape = (2 * channels, height, width)
+        self.nb_channels = channels
+        self.normalize = normalize
+
+    def convert(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor,
+                time_window: Optional[Tuple[float, float]]=None):
+        assert x.shape == y.shape == pol.shape == time.shape
+        assert x.ndim == 1
+
+        C = self.nb_channels
+        _, H, W = self.shape
+        with torch.no_grad():
+            voxel_grid = torch.zeros(2 * C * H * W, dtype=torch.float, device=pol.device)
+            if x.numel() == 0:
+                return voxel_grid.view(self.shape)
 
-                        voxel_grid.put_(index[mask], interp_weights[mask], accumulate=True)
+            t_norm = _time_coordinate(time, C - 1, time_window)
+            index, weights, mask = _trilinear_corners(x, y, t_norm, 1, C, H, W)
+            _splat_(voxel_grid, C * H * W * pol.long() + index, weights, mask)
 
             if self.normalize:
-                mask = torch.nonzero(voxel_grid, as_tuple=True)
-                if mask[0].size()[0] > 0:
-                    mean = voxel_grid[mask].mean()
-                    std = voxel_grid[mask].std()
-                    if std > 0:
-                        voxel_grid[mask] = (voxel_grid[mask] - mean) / std
-                    else:
-                        voxel_grid[mask] = voxel_grid[mask] - mean
+                VoxelGrid._normalize_(voxel_grid)
 
-        return voxel_grid
+        return voxel_grid.view(self.shape)
+
+
+class EventCountHistogram(EventRepresentation):
+    """Number of events per pixel and polarity, shape (2, H, W) with the negative events in channel 0
+    Events are counted at their nearest pixel. The time of the events is not used.
+    """
+    def __init__(self, height: int, width: int, normalize: bool):
+        self.shape = (2, height, width)
+        self.normalize = normalize
+
+    def convert(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor,
+                time_window: Optional[Tuple[float, float]]=None):
+        assert x.shape == y.shape == pol.shape == time.shape
+        assert x.ndim == 1
+
+        _, H, W = self.shape
+        with torch.no_grad():
+            histogram = torch.zeros(2 * H * W, dtype=torch.float, device=pol.device)
+            if x.numel() == 0:
+                return histogram.view(self.shape)
+
+            index, mask = _pixel_index(torch.round(x), torch.round(y), H, W)
+            _splat_(histogram, H * W * pol.long() + index, torch.ones_like(x), mask)
+
+            if self.normalize:
+                VoxelGrid._normalize_(histogram)
+
+        return histogram.view(self.shape)
+
+
+class TimeSurface(EventRepresentation):
+    """Exponentially decaying time surface per polarity, shape (2, H, W) with the negative events in channel 0
+    A pixel holds exp(-(1 - t) / tau), where t is the time of its last event scaled to [0, 1]
+    over the window (the first to the last event, or time_window), and 0 without events.
+    tau is a fraction of the window duration. Events are assigned to their nearest pixel.
+    """
+    def __init__(self, height: int, width: int, tau: float=0.3):
+        assert tau > 0
+        self.shape = (2, height, width)
+        self.tau = tau
+
+    def convert(self, x: torch.Tensor, y: torch.Tensor, pol: torch.Tensor, time: torch.Tensor,
+                time_window: Optional[Tuple[float, float]]=None):
+        assert x.shape == y.shape == pol.shape == time.shape
+        assert x.ndim == 1
+
+        _, H, W = self.shape
+        with torch.no_grad():
+            last_time = torch.full((2 * H * W,), -float('inf'), dtype=torch.float, device=pol.device)
+            if x.numel() == 0:
+                return torch.zeros(self.shape, dtype=torch.float, device=pol.device)
+
+            t_norm = _time_coordinate(time.float(), 1, time_window) if x.numel() > 1 else torch.ones_like(x)
+            index, mask = _pixel_index(torch.round(x), torch.round(y), H, W)
+            # Events outside of the image compete for element 0 with a time of -inf
+            index = torch.where(mask, H * W * pol.long() + index, 0)
+            t_norm = torch.where(mask, t_norm, -float('inf'))
+            last_time.scatter_reduce_(0, index, t_norm, reduce='amax')
+            surface = torch.exp((last_time - 1) / self.tau)
+
+        return surface.view(self.shape)
+
+
+def make_representation(name: str, num_bins: int, height: int, width: int) -> EventRepresentation:
+    """Dense representation selected by name, as configured through SequenceOptions(representation=name)
+    'voxel_grid': VoxelGrid of num_bins channels
+    'polarity_voxel_grid': PolarityVoxelGrid of 2 * num_bins channels
+    'event_count': EventCountHistogram of 2 channels
+    'time_surface': TimeSurface of 2 channels
+    """
+    if name == 'voxel_grid':
+        return VoxelGrid(num_bins, height, width, normalize=True)
+    if name == 'polarity_voxel_grid':
+        return PolarityVoxelGrid(num_bins, height, width, normalize=True)
+    if name == 'event_count':
+        return EventCountHistogram(height, width, normalize=True)
+    if name == 'time_surface':
+        return TimeSurface(height, width)
+    raise ValueError('unknown event representation: {}'.format(name))
@@ -1,5 +1,5 @@
 from pathlib import Path
-import weakref
+from typing import NamedTuple, Sequence as SequenceType
 
 import cv2
 import h5py
@@ -7,11 +7,56 @@ import numpy as np
 import torch
 from torch.utils.data import Dataset
 
-from dataset.representations import VoxelGrid
+from dataset.manifest import SequenceManifest
+from dataset.rectify_voxel import RectifiedVoxelGrid
+from dataset.augmentation import EventAugmentation
+from dataset.representations import compact_voxel_grid, make_representation, voxel_dtypes
+from dataset.voxel_cache import VoxelCache
+from utils.chunkcache import ChunkCache
+from utils.disparitystore import DisparityStack
 from utils.eventslicer import EventSlicer
+from utils.eventstore import MemmapEventSlicer
+from utils.h5pool import H5FilePool
+
+
+class SequenceOptions(NamedTuple):
+    """Options of the samples of a Sequence, shared by all sequences of a DatasetProvider"""
+    # 'h5' reads events.h5, 'memmap' the packed-record files (events_packed.npy, ms_to_idx.npy,
+    # events_packed.json) written next to events.h5 by pack_events.py
+    event_backend: str = 'h5'
+    # HDF5 raw data chunk cache of the private H5FilePool of a Sequence without h5_pool
+    # (the defaults are the ones of h5py)
+    rdcc_nbytes: int = 1024**2
+    rdcc_nslots: int = 521
+    rdcc_w0: float = 0.75
+    # Cameras whose representation is returned, e.g. ['left'] for monocular training
+    locations: SequenceType[str] = ('left', 'right')
+    # With load_gt=False, the disparity PNG is not decoded and 'disparity_gt' is not in the output
+    load_gt: bool = True
+    # 'voxel_grid', another dense representation of dataset.representations.make_representation
+    # ('polarity_voxel_grid', 'event_count' or 'time_surface', with 2 * num_bins, 2 and 2 input
+    # channels), or 'events': the compact rectified events (see Sequence.events_to_compact), packed
+    # by dataset.dataloader.collate_events and voxelized for the whole batch on the training device
+    representation: str = 'voxel_grid'
+    # 'numba' computes voxel grids with the fused rectify and voxelize kernel of RectifiedVoxelGrid,
+    # on voxel_threads cores per process (0 for all cores, shared between the DataLoader workers)
+    voxel_backend: str = 'torch'
+    voxel_threads: int = 1
+    # 'memmap' reads the ground truth from the stacks written by pack_disparity.py
+    gt_backend: str = 'png'
+    # Format of the dense representations of the samples (see compact_voxel_grid), to reduce
+    # their memory in workers, between processes and in host to device copies
+    voxel_dtype: str = 'float32'
+    voxel_sparse: bool = False
+    # Bin over the window [ts_end - delta_t, ts_end) instead of its first to its last event, as
+    # dataset.sliding_voxel_grid.SlidingVoxelGrid does
+    time_window: bool = False
 
 
 class Sequence(Dataset):
+    all_locations = ['left', 'right']
+    representations = ['voxel_grid', 'events', 'polarity_voxel_grid', 'event_count', 'time_surface']
+
     # NOTE: This is just an EXAMPLE class for convenience. Adapt it to your case.
     # In this example, we use the voxel grid representation.
     #
@@ -19,35 +64,75 @@ class Sequence(Dataset):
     #
     # seq_name (e.g. zurich_city_11_a)
     # ├── disparity
-    # │   ├── event
-    # │   │   ├── 000000.png
-    # │   │   └── ...
-    # │   └── timestamps.txt
+    # │   ├── event
+    # │   │   ├── 000000.png
+    # │   │   └── ...
+    # │   └── timestamps.txt
     # └── events
-    #     ├── left
-    #     │   ├── events.h5
-    #     │   └── rectify_map.h5
-    #     └── right
-    #         ├── events.h5
-    #         └── rectify_map.h5
-
-    def __init__(self, seq_path: Path, mode: str='train', delta_t_ms: int=50, num_bins: int=15):
+    #     ├── left
+    #     │   ├── events.h5
+    #     │   └── rectify_map.h5
+    #     └── right
+    #         ├── events.h5
+    #         └── rectify_map.h5
+    #
+    # The output of __getitem__ is declared by the options (see SequenceOptions), so that
+    # unused branches are neither computed nor sent between processes. chunk_cache, h5_pool,
+    # voxel_cache, manifest and augmentation can be shared by all sequences of a process.
+
+    def __init__(self, seq_path: Path, mode: str='train', delta_t_ms: int=50, num_bins: int=15,
+                 options: SequenceOptions=SequenceOptions(), sequence_id: int=0, chunk_cache: ChunkCache=None,
+                 h5_pool: H5FilePool=None, voxel_cache: VoxelCache=None, manifest: SequenceManifest=None,
+                 augmentation: EventAugmentation=None):
         assert num_bins >= 1
+        assert augmentation is None or (voxel_cache is None and options.voxel_backend == 'torch'), \
+            'augmentation requires computing the representations from the events'
+        assert not options.time_window or (options.representation != 'events' and voxel_cache is None
+                                           and options.voxel_backend == 'torch'), \
+            'time_window requires computing dense representations from the events'
+        assert options.voxel_dtype in voxel_dtypes, options.voxel_dtype
+        assert options.gt_backend in ['png', 'memmap'], options.gt_backend
+        assert options.voxel_backend in ['torch', 'numba'], options.voxel_backend
+        assert len(options.locations) > 0 and all(location in self.all_locations for location in options.locations), \
+            options.locations
+        assert options.representation in self.representations, options.representation
+        assert options.event_backend in ['h5', 'memmap'], options.event_backend
         assert delta_t_ms <= 100, 'adapt this code, if duration is higher than 100 ms'
         assert seq_path.is_dir()
 
         # NOTE: Adapt this code according to the present mode (e.g. train, val or test).
         self.mode = mode
+        self.name = seq_path.name
+        self.options = options
+        # Returned with every sample, such that consecutive windows can be recognized
+        self.sequence_id = sequence_id
 
         # Save output dimensions
         self.height = 480
         self.width = 640
         self.num_bins = num_bins
 
-        # Set event representation
-        self.voxel_grid = VoxelGrid(self.num_bins, self.height, self.width, normalize=True)
+        # Set event representation. With augmentation, the rectified events are cropped and
+        # augmented before they are converted, at the size of the crop, and the ground truth maps
+        # are cropped and flipped to match. The parameters of a sample are drawn by the
+        # augmentation from the sequence_id and index of the sample, for all locations at once.
+        self.augmentation = augmentation
+        output_height = augmentation.height if augmentation is not None else self.height
+        output_width = augmentation.width if augmentation is not None else self.width
+        self.event_representation = None
+        if options.representation != 'events':
+            self.event_representation = make_representation(options.representation, self.num_bins, output_height, output_width)
+        self.representation = options.representation
+        self.voxel_backend = options.voxel_backend
+        self.voxel_dtype = options.voxel_dtype
+        self.voxel_sparse = options.voxel_sparse
+        self.time_window = options.time_window
+        # One RectifiedVoxelGrid per location with voxel_backend='numba'
+        self.rectified_voxel_grids = dict()
 
-        self.locations = ['left', 'right']
+        self.locations = list(options.locations)
+        self.load_gt = options.load_gt
+        self.gt_backend = options.gt_backend
 
         # Save delta timestamp in ms
         self.delta_t_us = delta_t_ms * 1000
@@ -55,56 +140,121 @@ class Sequence(Dataset):
         # load disparity timestamps
         disp_dir = seq_path / 'disparity'
         assert disp_dir.is_dir()
-        self.timestamps = np.loadtxt(disp_dir / 'timestamps.txt', dtype='int64')
-
-        # load disparity paths
-        ev_disp_dir = disp_dir / 'event'
-        assert ev_disp_dir.is_dir()
-        disp_gt_pathstrings = list()
-        for entry in ev_disp_dir.iterdir():
-            assert str(entry.name).endswith('.png')
-            disp_gt_pathstrings.append(str(entry))
-        disp_gt_pathstrings.sort()
-        self.disp_gt_pathstrings = disp_gt_pathstrings
-
-        assert len(self.disp_gt_pathstrings) == self.timestamps.size
-
-        # Remove first disparity path and corresponding timestamp.
-        # This is necessary because we do not have events before the first disparity map.
-        assert int(Path(self.disp_gt_pathstrings[0]).stem) == 0
-        self.disp_gt_pathstrings.pop(0)
-        self.timestamps = self.timestamps[1:]
-
-        self.h5f = dict()
+        self.disp_dir = disp_dir
+        # Created lazily by get_disparity_stack
+        self.disparity_stack = None
+        # With manifest (see dataset.manifest), timestamps, ground truth paths and memory-mapped
+        # rectify maps come from the compiled manifest, and the events of a sample are sliced
+        # directly with their precomputed index range.
+        self.manifest = manifest
+        if manifest is not None:
+            self.timestamps = manifest.timestamps
+            self.disp_gt_pathstrings = list(manifest.disp_gt_pathstrings)
+        else:
+            self.timestamps = np.loadtxt(disp_dir / 'timestamps.txt', dtype='int64')
+
+            # load disparity paths
+            ev_disp_dir = disp_dir / 'event'
+            assert ev_disp_dir.is_dir()
+            disp_gt_pathstrings = list()
+            for entry in ev_disp_dir.iterdir():
+                assert str(entry.name).endswith('.png')
+                disp_gt_pathstrings.append(str(entry))
+            disp_gt_pathstrings.sort()
+            self.disp_gt_pathstrings = disp_gt_pathstrings
+
+            assert len(self.disp_gt_pathstrings) == self.timestamps.size
+
+            # Remove first disparity path and corresponding timestamp.
+            # This is necessary because we do not have events before the first disparity map.
+            assert int(Path(self.disp_gt_pathstrings[0]).stem) == 0
+            self.disp_gt_pathstrings.pop(0)
+            self.timestamps = self.timestamps[1:]
+
+        self.event_backend = options.event_backend
+        # Optional LRU of decompressed chunks, see utils.chunkcache
+        self.chunk_cache = chunk_cache
+        # With voxel_cache, voxel grids are read from the cache written by build_voxel_cache.py
+        # and only computed from the events on a cache miss.
+        self.voxel_cache = voxel_cache
+        if voxel_cache is not None:
+            assert voxel_cache.num_bins == num_bins
+            assert voxel_cache.delta_t_ms == delta_t_ms
+        # events.h5 files are opened lazily, on first access in the process that reads them
+        # (e.g. the DataLoader worker), through h5_pool. The pool bounds the number of open files.
+        if h5_pool is None:
+            h5_pool = H5FilePool(len(self.locations), options.rdcc_nbytes, options.rdcc_nslots, options.rdcc_w0)
+        self.h5_pool = h5_pool
+
         self.rectify_ev_maps = dict()
+        self.event_dirs = dict()
+        # Created lazily by get_event_slicer
         self.event_slicers = dict()
 
         ev_dir = seq_path / 'events'
         for location in self.locations:
             ev_dir_location = ev_dir / location
-            ev_data_file = ev_dir_location / 'events.h5'
             ev_rect_file = ev_dir_location / 'rectify_map.h5'
 
-            h5f_location = h5py.File(str(ev_data_file), 'r')
-            self.h5f[location] = h5f_location
-            self.event_slicers[location] = EventSlicer(h5f_location)
-            with h5py.File(str(ev_rect_file), 'r') as h5_rect:
-                self.rectify_ev_maps[location] = h5_rect['rectify_map'][()]
+            self.event_dirs[location] = ev_dir_location
+            if manifest is not None:
+                self.rectify_ev_maps[location] = manifest.get_rectify_map(location)
+            else:
+                with h5py.File(str(ev_rect_file), 'r') as h5_rect:
+                    self.rectify_ev_maps[location] = h5_rect['rectify_map'][()]
+            if self.voxel_backend == 'numba' and self.representation == 'voxel_grid':
+                self.rectified_voxel_grids[location] = RectifiedVoxelGrid(
+                        self.rectify_ev_maps[location], self.num_bins, normalize=True, num_threads=options.voxel_threads)
 
+    def get_event_slicer(self, location: str):
+        event_slicer = self.event_slicers.get(location)
+        if event_slicer is None:
+            ev_dir_location = self.event_dirs[location]
+            if self.event_backend == 'memmap':
+                event_slicer = MemmapEventSlicer(ev_dir_location)
+            else:
+                h5f_location = self.h5_pool.open(ev_dir_location / 'events.h5')
+                event_slicer = EventSlicer(h5f_location, self.chunk_cache)
+            self.event_slicers[location] = event_slicer
+        return event_slicer
 
-        self._finalizer = weakref.finalize(self, self.close_callback, self.h5f)
+    def get_disparity_stack(self) -> DisparityStack:
+        if self.disparity_stack is None:
+            self.disparity_stack = DisparityStack(self.disp_dir)
+            assert len(self.disparity_stack) == len(self) + 1
+        return self.disparity_stack
 
-    def events_to_voxel_grid(self, x, y, p, t, device: str='cpu'):
-        t = (t - t[0]).astype('float32')
-        t = (t/t[-1])
+    def events_to_representation(self, x, y, p, t, device: str='cpu', time_window=None):
+        # time_window=(t_start, t_end) in the unit of t bins over the window instead of the events
+        if time_window is not None:
+            t = ((t - time_window[0]) / (time_window[1] - time_window[0])).astype('float32')
+            time_window = (0, 1)
+        elif t.size > 0:
+            t = (t - t[0]).astype('float32')
+            t = (t/t[-1])
         x = x.astype('float32')
         y = y.astype('float32')
         pol = p.astype('float32')
-        return self.voxel_grid.convert(
+        return self.event_representation.convert(
                 torch.from_numpy(x),
                 torch.from_numpy(y),
                 torch.from_numpy(pol),
-                torch.from_numpy(t))
+                torch.from_numpy(t),
+                time_window=time_window)
+
+    @staticmethod
+    def events_to_compact(x, y, p, t):
+        # Same preprocessing as events_to_representation, but polarity is kept as uint8.
+        # That is 13 bytes per event instead of a dense float32 grid.
+        if t.size > 0:
+            t = (t - t[0]).astype('float32')
+            t = (t/t[-1])
+        return {
+            'x': torch.from_numpy(np.ascontiguousarray(x, dtype='float32')),
+            'y': torch.from_numpy(np.ascontiguousarray(y, dtype='float32')),
+            'p': torch.from_numpy(np.ascontiguousarray(p, dtype='uint8')),
+            't': torch.from_numpy(np.ascontiguousarray(t, dtype='float32')),
+        }
 
     def getHeightAndWidth(self):
         return self.height, self.width
@@ -119,11 +269,6 @@ class Sequence(Dataset):
         # disp_float = cv2.GaussianBlur(disp_float,(9,9), cv2.BORDER_DEFAULT)
         return disp_float
 
-    @staticmethod
-    def close_callback(h5f_dict):
-        for k, h5f in h5f_dict.items():
-            h5f.close()
-
     def __len__(self):
         return len(self.disp_gt_pathstrings)
 
@@ -136,30 +281,75 @@ class Sequence(Dataset):
         assert y.max() < self.height
         return rectify_map[y, x]
 
-    def __getitem__(self, index):
+    def get_file_index(self, index):
+        return int(Path(self.disp_gt_pathstrings[index]).stem)
+
+    def set_epoch(self, epoch: int, training: bool=True):
+        # Epoch and mode of the random augmentation, called by the trainer before iterating
+        if self.augmentation is not None:
+            self.augmentation.set_epoch(epoch, training)
+
+    def get_event_representation(self, index, location: str, params: dict=None):
+        """Representation of the events of a sample, params are its augmentation parameters"""
+        event_representation = self.compute_event_representation(index, location, params)
+        if self.representation != 'events':
+            return compact_voxel_grid(event_representation, self.voxel_dtype, self.voxel_sparse)
+        return event_representation
+
+    def compute_event_representation(self, index, location: str, params: dict=None):
+        file_index = self.get_file_index(index)
+        if self.voxel_cache is not None and self.representation == 'voxel_grid':
+            event_representation = self.voxel_cache.get(
+                    self.name, location, file_index, self.event_dirs[location] / 'events.h5')
+            if event_representation is not None:
+                return event_representation
+
         ts_end = self.timestamps[index]
         # ts_start should be fine (within the window as we removed the first disparity map)
         ts_start = ts_end - self.delta_t_us
+        if self.manifest is not None:
+            idx_start, idx_end = self.manifest.event_ranges[location][index]
+            assert idx_start >= 0, 'events of sample {} of {} cannot be retrieved'.format(index, self.name)
+            event_data = self.get_event_slicer(location).get_events_by_index(idx_start, idx_end)
+        else:
+            event_data = self.get_event_slicer(location).get_events(ts_start, ts_end)
+        time_window = (ts_start, ts_end) if self.time_window else None
+
+        p = event_data['p']
+        t = event_data['t']
+        x = event_data['x']
+        y = event_data['y']
 
+        if self.representation == 'voxel_grid' and self.voxel_backend == 'numba':
+            return self.rectified_voxel_grids[location].convert(x, y, p, t)
+
+        xy_rect = self.rectify_events(x, y, location)
+        x_rect = xy_rect[:, 0]
+        y_rect = xy_rect[:, 1]
+        if params is not None:
+            x_rect, y_rect, p, t = self.augmentation.apply_events(x_rect, y_rect, p, t, params, time_window)
+
+        if self.representation == 'events':
+            return self.events_to_compact(x_rect, y_rect, p, t)
+        return self.events_to_representation(x_rect, y_rect, p, t, time_window=time_window)
+
+    def __getitem__(self, index):
         disp_gt_path = Path(self.disp_gt_pathstrings[index])
         file_index = int(disp_gt_path.stem)
         output = {
-            'disparity_gt': self.get_disparity_map(disp_gt_path),
             'file_index': file_index,
+            'sequence_id': self.sequence_id,
+            'index': index,
         }
+        params = self.augmentation.sample(self.sequence_id, index) if self.augmentation is not None else None
+        if self.load_gt and self.gt_backend == 'memmap':
+            output['disparity_gt'] = self.get_disparity_stack().get_disparity_map(file_index)
+        elif self.load_gt:
+            output['disparity_gt'] = self.get_disparity_map(disp_gt_path)
+        if params is not None and 'disparity_gt' in output:
+            output['disparity_gt'] = self.augmentation.apply_map(output['disparity_gt'], params)
         for location in self.locations:
-            event_data = self.event_slicers[location].get_events(ts_start, ts_end)
-
-            p = event_data['p']
-            t = event_data['t']
-            x = event_data['x']
-            y = event_data['y']
-
-            xy_rect = self.rectify_events(x, y, location)
-            x_rect = xy_rect[:, 0]
-            y_rect = xy_rect[:, 1]
-
-            event_representation = self.events_to_voxel_grid(x_rect, y_rect, p, t)
+            event_representation = self.get_event_representation(index, location, params)
             if 'representation' not in output:
                 output['representation'] = dict()
             output['representation'][location] = event_representation
@@ -0,0 +1,202 @@
+import math
+from typing import Optional
+
+import numpy as np
+import torch
+
+from dataset.representations import VoxelGrid
+
+
+class SlidingVoxelGrid:
+    """Voxel grids of overlapping windows [t_end - delta_t_us, t_end), built incrementally
+    Windows start stride_us apart and have channels - 1 bins of width delta_t_us / (channels - 1).
+    The time axis is cut into sub-intervals of width u = gcd(stride, bin width), starting at
+    the first window, such that every bin boundary of every window is a sub-interval
+    boundary. With 15 bins, 50 ms windows and a 10 ms stride, u is a fifth of a bin.
+
+    Within a window, an event of sub-interval g lies in the bin cell m = (g - g0) // K of
+    the window starting at sub-interval g0, K being the number of sub-intervals per bin, at
+    the fractional position k / K + d with k = (g - g0) % K and d its offset into the
+    sub-interval (in bins). It splats (1 - k / K - d) of its weight into bin m and
+    (k / K + d) into bin m + 1. Hence every sub-interval keeps two planes, S0 (the spatial
+    splats) and S1 (the spatial splats times d), in a ring buffer of the sub-intervals of a
+    window, and the grid of any window is a linear combination of them. Moving the window
+    only requires the events of the new sub-intervals: planes of expired sub-intervals are
+    dropped, nothing is re-splatted. Windows that do not start on a sub-interval boundary
+    restart from scratch.
+
+    The output equals VoxelGrid.convert of the (rectified) events of the window with
+    time_window=(t_end - delta_t_us, t_end), up to the order of the floating point sums,
+    hence the voxel grids of a Sequence with time_window=True. By default, Sequence and
+    WindowVoxelizer bin over the first to the last event of the window instead.
+
+    Parameters
+    ----------
+    event_slicer : EventSlicer or MemmapEventSlicer
+        Source of the events.
+    channels : int
+        Number of time bins, at least 2.
+    height, width : int
+        Size of the grid.
+    delta_t_us : int
+        Duration of a window in microseconds.
+    stride_us : int
+        Time between the starts of consecutive windows in microseconds, delta_t_us by default.
+    normalize : bool
+        Normalize the non-zero voxels, as VoxelGrid does.
+    rectify_map : np.ndarray, optional
+        Rectify map of shape (height, width, 2) applied to the events.
+    device : str
+        Device of the planes and of the output.
+    max_subintervals : int
+        Maximum number of sub-intervals per window. The planes take 2 * 4 * height * width
+        bytes per sub-interval, e.g. 172 MB for 15 bins of 640x480 with a 10 ms stride.
+    """
+    def __init__(self, event_slicer, channels: int, height: int, width: int, delta_t_us: int,
+                 stride_us: Optional[int]=None, normalize: bool=True, rectify_map: Optional[np.ndarray]=None,
+                 device: str='cpu', max_subintervals: int=256):
+        assert channels >= 2
+        assert rectify_map is None or rectify_map.shape == (height, width, 2), rectify_map.shape
+        self.event_slicer = event_slicer
+        self.shape = (channels, height, width)
+        self.delta_t_us = int(delta_t_us)
+        self.stride_us = int(stride_us) if stride_us is not None else self.delta_t_us
+        assert self.stride_us > 0
+        self.normalize = normalize
+        self.rectify_map = rectify_map
+        self.device = device
+
+        self.num_bins = channels - 1
+        # Times are scaled by num_bins, such that a bin is delta_t_us long and a sub-interval
+        # subinterval_scaled long, both integers.
+        self.subinterval_scaled = math.gcd(self.stride_us * self.num_bins, self.delta_t_us)
+        self.subintervals_per_bin = self.delta_t_us // self.subinterval_scaled
+        self.num_subintervals = self.num_bins * self.subintervals_per_bin
+        assert self.num_subintervals <= max_subintervals, \
+            '{} sub-intervals per window for {} bins of {} us and a stride of {} us, see max_subintervals'.format(
+                self.num_subintervals, self.num_bins, self.delta_t_us // self.num_bins, self.stride_us)
+
+        # planes[0] holds S0 and planes[1] holds S1 of sub-interval g in slot g % num_subintervals.
+        self.planes = torch.zeros((2, self.num_subintervals, height * width), dtype=torch.float, device=device)
+        # Weights of S0 and S1 of the k-th sub-interval of a cell into its bins m (row 0) and m + 1 (row 1)
+        k = torch.arange(self.subintervals_per_bin, dtype=torch.float, device=device) / self.subintervals_per_bin
+        self.cell_weights = (torch.stack([1 - k, k]), torch.stack([-torch.ones_like(k), torch.ones_like(k)]))
+        # Start time (us) of sub-interval 0 and range [first, last) of the sub-intervals in the ring buffer
+        self.origin = None
+        self.first = 0
+        self.last = 0
+        self.num_events_splatted = 0
+
+    def subinterval_start_us(self, subinterval: int) -> int:
+        # First integer timestamp of the sub-interval, computed exactly in integers
+        numerator = self.origin * self.num_bins + subinterval * self.subinterval_scaled
+        return -((-numerator) // self.num_bins)
+
+    def reset(self):
+        self.origin = None
+        self.first = 0
+        self.last = 0
+
+    def get(self, t_end_us: int) -> Optional[torch.Tensor]:
+        """Voxel grid (C, H, W) of the events in [t_end_us - delta_t_us, t_end_us)
+        Returns None if the event slicer cannot provide the window.
+        """
+        t_start_us = int(t_end_us) - self.delta_t_us
+        C, H, W = self.shape
+        G = self.num_subintervals
+
+        aligned = False
+        if self.origin is not None:
+            scaled_offset = (t_start_us - self.origin) * self.num_bins
+            aligned = scaled_offset % self.subinterval_scaled == 0
+        g_start = scaled_offset // self.subinterval_scaled if aligned else 0
+        if not aligned or g_start < self.first:
+            self.origin = t_start_us
+            self.first = self.last = g_start = 0
+        g_end = g_start + G
+
+        if self.last < g_end:
+            g_new = max(self.last, g_start)
+            if not self._add_subintervals(g_new, g_end):
+                self.reset()
+                return None
+            self.first = max(self.first, g_end - G)
+            self.last = g_end
+
+        with torch.no_grad():
+            voxel_grid = torch.zeros((C, H * W), dtype=torch.float, device=self.device)
+            self._assemble_(voxel_grid, g_start)
+            voxel_grid = voxel_grid.view(-1)
+            if self.normalize:
+                VoxelGrid._normalize_(voxel_grid)
+        return voxel_grid.view(C, H, W)
+
+    def _assemble_(self, voxel_grid: torch.Tensor, g_start: int):
+        """Add the planes of the window starting at sub-interval g_start into voxel_grid (C, H * W)"""
+        K = self.subintervals_per_bin
+        G = self.num_subintervals
+        weights_s0, weights_s1 = self.cell_weights
+        S0, S1 = self.planes
+        for m in range(self.num_bins):
+            # The slots of a cell are contiguous, except where the ring buffer wraps around
+            k = 0
+            while k < K:
+                slot = (g_start + m * K + k) % G
+                k_end = min(K, k + G - slot)
+                bins = voxel_grid[m:m + 2]
+                bins.addmm_(weights_s0[:, k:k_end], S0[slot:slot + k_end - k])
+                bins.addmm_(weights_s1[:, k:k_end], S1[slot:slot + k_end - k])
+                k = k_end
+
+    def _add_subintervals(self, g_first: int, g_end: int) -> bool:
+        """Splat the events of sub-intervals [g_first, g_end) into their (cleared) slots"""
+        C, H, W = self.shape
+        G = self.num_subintervals
+        for g in range(g_first, g_end):
+            self.planes[:, g % G].zero_()
+
+        t_first_us = self.subinterval_start_us(g_first)
+        t_end_us = self.subinterval_start_us(g_end)
+        if t_end_us <= t_first_us:
+            return True
+        events = self.event_slicer.get_events(t_first_us, t_end_us)
+        if events is None:
+            return False
+        if events['t'].size == 0:
+            return True
+
+        x = events['x']
+        y = events['y']
+        if self.rectify_map is not None:
+            xy_rect = self.rectify_map[y, x]
+            x = xy_rect[:, 0]
+            y = xy_rect[:, 1]
+
+        # Sub-interval and offset into it (in bins) of every event, exact in integers
+        scaled_t = (np.asarray(events['t'], dtype='int64') - self.origin) * self.num_bins
+        subinterval = scaled_t // self.subinterval_scaled
+        offset = (scaled_t - subinterval * self.subinterval_scaled) / self.delta_t_us
+
+        with torch.no_grad():
+            x = torch.from_numpy(np.ascontiguousarray(x, dtype='float32')).to(self.device)
+            y = torch.from_numpy(np.ascontiguousarray(y, dtype='float32')).to(self.device)
+            value = 2*torch.from_numpy(np.asarray(events['p'], dtype='float32')).to(self.device)-1
+            offset = torch.from_numpy(offset.astype('float32')).to(self.device)
+            slot = torch.from_numpy(subinterval % G).to(self.device)
+
+            x0 = x.int()
+            y0 = y.int()
+            # Spatial corners (2, 2, N) and the factors of S0 and S1 (2, 1, 1, N)
+            xlim = torch.stack([x0, x0+1])[:, None, :]
+            ylim = torch.stack([y0, y0+1])[None, :, :]
+            mask = (xlim < W) & (xlim >= 0) & (ylim < H) & (ylim >= 0)
+            weights_xy = value * (1 - (xlim-x).abs()) * (1 - (ylim-y).abs())
+            weights = weights_xy[None] * torch.stack([torch.ones_like(offset), offset])[:, None, None, :]
+
+            index = W * ylim.long() + xlim.long()
+            index = (torch.arange(2, device=self.device)[:, None, None, None] * G + slot) * (H * W) + index[None]
+            index = torch.where(mask[None], index, 0)
+            weights = torch.where(mask[None], weights, 0)
+            self.planes.view(-1).index_add_(0, index.flatten(), weights.flatten())
+        self.num_events_splatted += int(x.numel())
+        return True
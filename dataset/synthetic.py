@@ -0,0 +1,195 @@
+from pathlib import Path
+from typing import Dict, Sequence as SequenceType
+
+import cv2
+import hdf5plugin
+import h5py
+import numpy as np
+
+
+# Compression of the event datasets, as keyword arguments of h5py create_dataset.
+# DSEC compresses events.h5 with zstd.
+CODECS = {
+    'blosc-zstd': lambda: dict(hdf5plugin.Blosc(cname='zstd', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE)),
+    'blosc-lz4': lambda: dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE)),
+    'zstd': lambda: dict(hdf5plugin.Zstd()),
+    'gzip': lambda: dict(compression='gzip', compression_opts=4),
+    'none': lambda: dict(),
+}
+EVENT_DTYPES = {'p': 'uint8', 'x': 'uint16', 'y': 'uint16', 't': 'uint32'}
+
+
+class EventRateProfile:
+    """Expected number of events per millisecond of a synthetic sequence
+    rate: mean event rate in events/s, modulated by a sine of relative amplitude modulation
+        and period modulation_period_ms (e.g. the camera speeding up and slowing down).
+    Bursts of burst_events events (e.g. several millions for a flickering light or a fast
+        turn) are spread uniformly over burst_length_ms, every burst_period_ms from
+        burst_start_ms on. burst_events=0 disables them.
+    """
+    def __init__(self, rate: float=2e6, modulation: float=0.0, modulation_period_ms: int=1000,
+                 burst_events: float=0, burst_length_ms: int=50, burst_period_ms: int=1000, burst_start_ms: int=0):
+        assert rate >= 0 and 0 <= modulation <= 1
+        assert modulation_period_ms > 0
+        assert burst_events >= 0 and 0 < burst_length_ms <= burst_period_ms and burst_start_ms >= 0
+        self.rate = rate
+        self.modulation = modulation
+        self.modulation_period_ms = modulation_period_ms
+        self.burst_events = burst_events
+        self.burst_length_ms = burst_length_ms
+        self.burst_period_ms = burst_period_ms
+        self.burst_start_ms = burst_start_ms
+
+    def expected_counts(self, ms_start: int, ms_end: int) -> np.ndarray:
+        """Expected number of events in each millisecond of [ms_start, ms_end)"""
+        ms = np.arange(ms_start, ms_end, dtype='float64')
+        counts = self.rate / 1000 * (1 + self.modulation * np.sin(2 * np.pi * ms / self.modulation_period_ms))
+        if self.burst_events > 0:
+            phase = (ms - self.burst_start_ms) % self.burst_period_ms
+            in_burst = (ms >= self.burst_start_ms) & (phase < self.burst_length_ms)
+            counts += in_burst * (self.burst_events / self.burst_length_ms)
+        return counts
+
+
+class _EventWriter:
+    """Append events to the resizable datasets of an events.h5 file
+    Events are written by whole chunks, so every chunk is compressed once. The remainder is
+    kept until the next append, and written by close.
+    """
+    def __init__(self, h5f: h5py.File, codec: str, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.datasets = {key: h5f.create_dataset('events/{}'.format(key), shape=(0,), maxshape=(None,), dtype=dtype,
+                                                 chunks=(chunk_size,), **CODECS[codec]())
+                         for key, dtype in EVENT_DTYPES.items()}
+        self.pending = {key: np.zeros(0, dtype=dtype) for key, dtype in EVENT_DTYPES.items()}
+        self.num_events = 0
+
+    def _write(self, events: Dict[str, np.ndarray]):
+        size = events['t'].size
+        for key, dset in self.datasets.items():
+            dset.resize((self.num_events + size,))
+            dset[self.num_events:] = events[key]
+        self.num_events += size
+
+    def append(self, events: Dict[str, np.ndarray]):
+        events = {key: np.concatenate([self.pending[key], events[key].astype(EVENT_DTYPES[key], copy=False)])
+                  for key in EVENT_DTYPES}
+        size = events['t'].size // self.chunk_size * self.chunk_size
+        if size > 0:
+            self._write({key: value[:size] for key, value in events.items()})
+        self.pending = {key: value[size:] for key, value in events.items()}
+
+    def close(self):
+        if self.pending['t'].size > 0:
+            self._write(self.pending)
+        self.pending = {key: value[:0] for key, value in self.pending.items()}
+
+
+def generate_events(counts: np.ndarray, ms_start: int, rng: np.random.Generator, height: int, width: int,
+                    edges: np.ndarray, noise: float) -> Dict[str, np.ndarray]:
+    """Events of the milliseconds [ms_start, ms_start + counts.size), with counts[i] events in millisecond i
+    A fraction noise of the events is uniform over the frame, the others lie along vertical
+    edges, the rows (x0 [px], velocity [px/s]) of edges, moving horizontally and wrapping
+    around the frame. Polarity is the sign of the velocity, except for noise.
+    t is in microseconds relative to t_offset and sorted.
+    """
+    num_events = int(counts.sum())
+    t = np.repeat(np.arange(ms_start, ms_start + counts.size, dtype='int64') * 1000, counts)
+    # Sorting the whole block sorts the events within each millisecond
+    t = np.sort(t + rng.integers(0, 1000, num_events))
+
+    x = rng.uniform(0, width, num_events)
+    y = rng.integers(0, height, num_events)
+    p = rng.integers(0, 2, num_events)
+    on_edge = rng.random(num_events) >= noise
+    num_on_edge = int(on_edge.sum())
+    if num_on_edge > 0 and edges.shape[0] > 0:
+        edge = edges[rng.integers(0, edges.shape[0], num_on_edge)]
+        x[on_edge] = edge[:, 0] + edge[:, 1] * t[on_edge] * 1e-6 + rng.normal(0, 1.5, num_on_edge)
+        p[on_edge] = edge[:, 1] > 0
+    x = np.floor(x).astype('int64') % width
+    return {'p': p, 'x': x, 'y': y, 't': t}
+
+
+def write_event_file(h5_path: Path, duration_ms: int, profile: EventRateProfile, t_offset: int,
+                     rng: np.random.Generator, height: int=480, width: int=640, codec: str='blosc-zstd',
+                     chunk_size: int=16384, block_ms: int=50, num_edges: int=8, noise: float=0.2) -> int:
+    """Write an events.h5 file of duration_ms milliseconds, block_ms at a time
+    The layout is the one of DSEC, read by EventSlicer: events/{p,x,y,t} with t in
+    microseconds relative to the int64 t_offset, and ms_to_idx with ms_to_idx[ms] the index of
+    the first event at or after ms milliseconds, for ms in [0, duration_ms].
+    Returns the number of events.
+    """
+    assert codec in CODECS, codec
+    assert duration_ms > 0 and block_ms > 0
+    # t is stored as uint32
+    assert duration_ms * 1000 < 2**32
+    edges = np.stack([rng.uniform(0, width, num_edges), rng.choice([-1, 1], num_edges) * rng.uniform(50, 500, num_edges)], axis=-1)
+
+    with h5py.File(str(h5_path), 'w') as h5f:
+        writer = _EventWriter(h5f, codec, chunk_size)
+        ms_to_idx = h5f.create_dataset('ms_to_idx', shape=(duration_ms + 1,), dtype='uint64')
+        for ms_start in range(0, duration_ms, block_ms):
+            ms_end = min(ms_start + block_ms, duration_ms)
+            counts = rng.poisson(profile.expected_counts(ms_start, ms_end))
+            ms_to_idx[ms_start:ms_end] = writer.num_events + writer.pending['t'].size + np.cumsum(counts) - counts
+            writer.append(generate_events(counts, ms_start, rng, height, width, edges, noise))
+        writer.close()
+        ms_to_idx[duration_ms] = writer.num_events
+        h5f.create_dataset('t_offset', data=np.int64(t_offset))
+        return writer.num_events
+
+
+def write_rectify_map(h5_path: Path, height: int=480, width: int=640, distortion: float=0.5):
+    """Write a rectify_map.h5 file: a smooth distortion of up to distortion pixels"""
+    x, y = np.meshgrid(np.arange(width, dtype='float32'), np.arange(height, dtype='float32'))
+    u, v = 2 * x / (width - 1) - 1, 2 * y / (height - 1) - 1
+    r2 = (u ** 2 + v ** 2) / 2
+    rectify_map = np.stack([x + distortion * r2 * u, y + distortion * r2 * v], axis=-1).astype('float32')
+    with h5py.File(str(h5_path), 'w') as h5f:
+        h5f.create_dataset('rectify_map', data=rectify_map)
+
+
+def disparity_map(index: int, rng: np.random.Generator, height: int=480, width: int=640, density: float=0.3,
+                  max_disparity: float=60.0) -> np.ndarray:
+    """16-bit disparity (disparity * 256, 0 where invalid) of a ground plane and a moving bump
+    A fraction density of the pixels is valid.
+    """
+    x, y = np.meshgrid(np.linspace(0, 1, width), np.linspace(0, 1, height))
+    center = 0.5 + 0.3 * np.sin(0.1 * index)
+    disparity = 2 + (max_disparity - 2) * (0.5 * y + 0.5 * np.exp(-((x - center) ** 2 + (y - 0.5) ** 2) / 0.02))
+    disparity_16bit = np.round(disparity * 256).astype('uint16')
+    disparity_16bit[rng.random((height, width)) >= density] = 0
+    return disparity_16bit
+
+
+def write_sequence(seq_path: Path, duration_ms: int, profile: EventRateProfile, seed: int=0,
+                   t_offset: int=1_600_000_000_000_000, height: int=480, width: int=640, codec: str='blosc-zstd',
+                   chunk_size: int=16384, block_ms: int=50, gt_density: float=0.3, gt_period_ms: int=100,
+                   locations: SequenceType[str]=('left', 'right')) -> Dict[str, int]:
+    """Write a synthetic sequence in the layout of a DSEC train sequence (see dataset.sequence)
+    Events of every location are written by write_event_file, with a rectify map. Ground
+    truth disparity is written every gt_period_ms from t_offset on, as the PNGs 000000.png,
+    000002.png, ... (DSEC numbers them by the 20 Hz images) with their timestamps.txt.
+    Sequence drops the first ground truth, so gt_period_ms should be at least delta_t_ms.
+    Returns the number of events of every location.
+    """
+    assert 0 < gt_density <= 1 and 0 < gt_period_ms <= duration_ms
+    num_events = dict()
+    for location_id, location in enumerate(locations):
+        ev_dir = seq_path / 'events' / location
+        ev_dir.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng([seed, location_id])
+        num_events[location] = write_event_file(ev_dir / 'events.h5', duration_ms, profile, t_offset, rng, height,
+                                                width, codec, chunk_size, block_ms)
+        write_rectify_map(ev_dir / 'rectify_map.h5', height, width)
+
+    disp_dir = seq_path / 'disparity'
+    (disp_dir / 'event').mkdir(parents=True, exist_ok=True)
+    timestamps = t_offset + np.arange(0, duration_ms + 1, gt_period_ms, dtype='int64') * 1000
+    np.savetxt(str(disp_dir / 'timestamps.txt'), timestamps, fmt='%d')
+    rng = np.random.default_rng([seed, len(locations)])
+    for index in range(timestamps.size):
+        path = disp_dir / 'event' / '{:06d}.png'.format(2 * index)
+        assert cv2.imwrite(str(path), disparity_map(index, rng, height, width, gt_density)), str(path)
+    return num_events
@@ -0,0 +1,120 @@
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import hdf5plugin
+import h5py
+import numpy as np
+import torch
+
+from utils.h5pool import H5FilePool
+
+
+def content_hash(filepath: Path, num_samples: int=64, sample_size: int=64 * 1024) -> str:
+    """Hash of the file size and of num_samples evenly spaced blocks of its content
+    Sampling keeps this cheap for multi-GB events.h5 files while still detecting
+    re-exported or re-downloaded files.
+    """
+    size = filepath.stat().st_size
+    sha = hashlib.sha1(str(size).encode())
+    with filepath.open('rb') as handle:
+        for offset in np.linspace(0, max(size - sample_size, 0), num_samples, dtype='int64'):
+            handle.seek(int(offset))
+            sha.update(handle.read(sample_size))
+    return sha.hexdigest()
+
+
+class VoxelCache:
+    """On-disk cache of voxel grids, written by build_voxel_cache.py
+    There is one shard per (sequence, location) and set of representation parameters:
+    cache_dir/seq_name/location_b{num_bins}_dt{delta_t_ms}_n{normalize}_{dtype}.h5
+    Each shard holds the voxel grids of all samples as (N, C, H, W) in blosc compressed
+    chunks of one grid, their file_index, and the content hash of the source events.h5.
+    With dtype 'int8', grids are quantized symmetrically with one scale per grid.
+    Shards whose content hash does not match the current events.h5 are ignored.
+    """
+    dtypes = ['float16', 'int8']
+
+    def __init__(self, cache_dir: Path, num_bins: int, delta_t_ms: int, normalize: bool=True,
+                 dtype: str='float16', height: int=480, width: int=640, h5_pool: H5FilePool=None):
+        assert dtype in self.dtypes, dtype
+        self.cache_dir = Path(cache_dir)
+        self.num_bins = num_bins
+        self.height = height
+        self.width = width
+        self.delta_t_ms = delta_t_ms
+        self.normalize = normalize
+        self.dtype = dtype
+        self.h5_pool = h5_pool if h5_pool is not None else H5FilePool()
+        self.hits = 0
+        self.misses = 0
+        # shard path -> {file_index: row} or None if the shard is missing or stale
+        self._shard_rows = dict()
+
+    def shard_path(self, seq_name: str, location: str) -> Path:
+        name = '{}_b{}_dt{}_n{}_{}.h5'.format(
+                location, self.num_bins, self.delta_t_ms, int(self.normalize), self.dtype)
+        return self.cache_dir / seq_name / name
+
+    def _get_rows(self, shard_path: Path, source_file: Path) -> Optional[Dict[int, int]]:
+        if shard_path not in self._shard_rows:
+            rows = None
+            if shard_path.is_file():
+                h5f = self.h5_pool.get(str(shard_path))
+                if h5f.attrs['source_hash'] == content_hash(source_file):
+                    rows = {int(file_index): row for row, file_index in enumerate(h5f['file_index'][()])}
+            self._shard_rows[shard_path] = rows
+        return self._shard_rows[shard_path]
+
+    def get(self, seq_name: str, location: str, file_index: int, source_file: Path) -> Optional[torch.Tensor]:
+        """Cached voxel grid as float32 tensor of shape (C, H, W), or None on a cache miss"""
+        shard_path = self.shard_path(seq_name, location)
+        rows = self._get_rows(shard_path, source_file)
+        if rows is None or file_index not in rows:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        h5f = self.h5_pool.get(str(shard_path))
+        row = rows[file_index]
+        grid = torch.from_numpy(h5f['voxel_grid'][row].astype('float32'))
+        if self.dtype == 'int8':
+            grid *= float(h5f['scale'][row])
+        return grid
+
+    def write_shard(self, seq_name: str, location: str, file_indices: np.ndarray,
+                    grids: Iterable[torch.Tensor], source_file: Path):
+        """Write the shard of a sequence and location
+        grids are consumed one at a time, in the order of file_indices.
+        """
+        shard_path = self.shard_path(seq_name, location)
+        shard_path.parent.mkdir(parents=True, exist_ok=True)
+        num_samples = len(file_indices)
+        shape = (self.num_bins, self.height, self.width)
+
+        tmp_path = shard_path.with_suffix('.tmp')
+        with h5py.File(str(tmp_path), 'w') as h5f:
+            h5f.attrs['source_hash'] = content_hash(source_file)
+            h5f.create_dataset('file_index', data=np.asarray(file_indices, dtype='int64'))
+            dset = h5f.create_dataset('voxel_grid', shape=(num_samples,) + shape, dtype=self.dtype,
+                                      chunks=(1,) + shape, **hdf5plugin.Blosc(cname='zstd', clevel=5))
+            if self.dtype == 'int8':
+                scales = h5f.create_dataset('scale', shape=(num_samples,), dtype='float32')
+            num_written = 0
+            for row, grid in enumerate(grids):
+                grid = grid.numpy()
+                assert grid.shape == shape, grid.shape
+                if self.dtype == 'int8':
+                    max_abs = float(np.abs(grid).max())
+                    scale = max_abs / 127 if max_abs > 0 else 1.0
+                    scales[row] = scale
+                    dset[row] = np.round(grid / scale).astype('int8')
+                else:
+                    dset[row] = grid.astype('float16')
+                num_written += 1
+            assert num_written == num_samples, (num_written, num_samples)
+        tmp_path.replace(shard_path)
+        self._shard_rows.pop(shard_path, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
@@ -51,6 +51,11 @@ class TensorboardWriter():
             self.add_scalar('steps_per_sec', 1 / duration.total_seconds())
             self.timer = datetime.now()
 
+    def add_scalar_at(self, tag, value, step, mode):
+        """add_scalar at a given step and mode, e.g. of a value logged with a delay"""
+        if self.writer is not None:
+            self.writer.add_scalar('{}/{}'.format(tag, mode), value, step)
+
     def __getattr__(self, name):
         """
         If visualization is configured to use:
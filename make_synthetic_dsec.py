@@ -0,0 +1,52 @@
+"""
+Write a synthetic DSEC directory, e.g. to test or benchmark the data pipeline without DSEC.
+
+<output_dir>/<split>/synthetic_<i>_a is a sequence in the layout of DSEC (see
+dataset.synthetic.write_sequence), loaded as is by DatasetProvider, EventSlicer and
+EventReader. Events are generated and written block_ms at a time, so the memory use does not
+depend on the duration. Example of 60 s sequences at 2 Mev/s with a burst of 3 M events in
+50 ms every second:
+    python make_synthetic_dsec.py --output_dir /tmp/DSEC_synthetic --duration_s 60 \
+        --rate 2e6 --burst_events 3e6 --burst_length_ms 50 --burst_period_ms 1000
+"""
+from pathlib import Path
+
+from tqdm import tqdm
+
+from dataset.synthetic import CODECS, EventRateProfile, write_sequence
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_dir', required=True, help='Path of the synthetic dataset directory')
+    parser.add_argument('--split', default="train", help='Subdirectory containing the sequences')
+    parser.add_argument('--num_sequences', type=int, default=2)
+    parser.add_argument('--duration_s', type=float, default=10.0, help='Duration of every sequence')
+    parser.add_argument('--rate', type=float, default=2e6, help='Mean event rate [events/s]')
+    parser.add_argument('--modulation', type=float, default=0.5, help='Relative amplitude of the rate modulation')
+    parser.add_argument('--modulation_period_ms', type=int, default=2000)
+    parser.add_argument('--burst_events', type=float, default=0, help='Number of events of a burst, 0 for none')
+    parser.add_argument('--burst_length_ms', type=int, default=50)
+    parser.add_argument('--burst_period_ms', type=int, default=1000)
+    parser.add_argument('--burst_start_ms', type=int, default=500)
+    parser.add_argument('--codec', default='blosc-zstd', choices=list(CODECS), help='Compression of the events')
+    parser.add_argument('--chunk_size', type=int, default=16384, help='Number of events per HDF5 chunk')
+    parser.add_argument('--block_ms', type=int, default=50, help='Duration of the events generated at once')
+    parser.add_argument('--gt_density', type=float, default=0.3, help='Fraction of pixels with ground truth')
+    parser.add_argument('--gt_period_ms', type=int, default=100, help='Period of the ground truth disparity')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    split_dir = Path(args.output_dir) / args.split
+    profile = EventRateProfile(args.rate, args.modulation, args.modulation_period_ms, args.burst_events,
+                               args.burst_length_ms, args.burst_period_ms, args.burst_start_ms)
+    duration_ms = int(round(args.duration_s * 1000))
+    for seq_id in tqdm(range(args.num_sequences)):
+        seq_path = split_dir / 'synthetic_{:02d}_a'.format(seq_id)
+        num_events = write_sequence(seq_path, duration_ms, profile, seed=args.seed + seq_id, codec=args.codec,
+                                    chunk_size=args.chunk_size, block_ms=args.block_ms, gt_density=args.gt_density,
+                                    gt_period_ms=args.gt_period_ms)
+        tqdm.write('{}: {}'.format(seq_path.name, ', '.join(
+            '{} {} events'.format(location, num) for location, num in num_events.items())))
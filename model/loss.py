@@ -1,9 +1,10 @@
+from typing import NamedTuple
+
 import numpy as np
 # from import_proj_matl import extract_projmat
 import torch
 import torch.nn.functional as F
-import torch
-import model.pytorch_ssim
+from model.pytorch_ssim import SeparableSSIM
 
 def get_projectmat():
     Q_np = np.array(
@@ -18,6 +19,35 @@ def get_projectmat():
     return Q
 
 
+class DepthTargets(NamedTuple):
+    """
+    Targets of a batch of disparity ground truth, built once by depth_targets and shared by
+    the criterion and the metrics (see model.metric) instead of being derived by each of them.
+    disparity: (B, H, W) disparity, 0 where there is no ground truth.
+    valid: disparity != 0.
+    valid_num: number of valid pixels of the batch.
+    depth: metric depth, clamped to [0, Dmax], 0 on the invalid pixels.
+    normalized_depth: depth scaled so that the maximum of every sample is Dmax, 0 on the invalid pixels.
+    log_depth: normalized log depth (see get_log_depth_gt), the target of the output of the model.
+    """
+    disparity: torch.Tensor
+    valid: torch.Tensor
+    valid_num: torch.Tensor
+    depth: torch.Tensor
+    normalized_depth: torch.Tensor
+    log_depth: torch.Tensor
+
+
+def depth_targets(disparity: torch.Tensor, Q: torch.Tensor, Dmax: float=80.0, alpha: float=3.7) -> DepthTargets:
+    """DepthTargets of a (B, H, W) disparity batch, Q of get_projectmat on the device of the batch"""
+    valid = disparity != 0
+    depth = Q[2, 3] / ((disparity - Q[3, 3]) * Q[3, 2])
+    depth = torch.where(valid, torch.clamp(depth, 0, Dmax), 0.0)
+    normalized_depth = torch.where(valid, depth / torch.amax(depth, dim=(1, 2), keepdim=True) * Dmax, 0.0)
+    log_depth = torch.where(valid, torch.log(normalized_depth / Dmax) / alpha + 1, 0.0)
+    return DepthTargets(disparity, valid, torch.count_nonzero(valid), depth, normalized_depth, log_depth)
+
+
 def photometric_loss_l1(input, target, weight=None):
     """
     photometric loss
@@ -27,65 +57,82 @@ def photometric_loss_l1(input, target, weight=None):
     return torch.mean(weight * torch.abs(input - target))
 
 
+# DepthLoss of loss, built once per device
+_depth_losses = dict()
+
+
 def loss(output, target):
-    # Q=extract_projmat(path='cam_to_cam.yaml')
-    Q = get_projectmat()
-    if torch.cuda.is_available() and Q.device.type == "cpu":
-        Q = Q.cuda()
-    # output = output.reshape(target.shape)
-    valid_idx = target != 0
-    valid_num = torch.count_nonzero(valid_idx)
-    depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-    log_depth_target = get_log_depth_gt(depth_target, valid_idx)
-    depth_output = output.reshape(log_depth_target.shape)
-
-    target_s1 = target[:, ::2, ::2]
-    valid_idx_s1 = target_s1 != 0
-    valid_num_s1 = torch.count_nonzero(valid_idx_s1)
-    output_s1 = depth_output[:, ::2, ::2]
-    depth_target_s1 = Q[2, 3] / ((target_s1 - Q[3, 3])*Q[3,2])
-
-    target_s2 = target_s1[:, ::2, ::2]
-    valid_idx_s2 = target_s2 != 0
-    valid_num_s2 = torch.count_nonzero(valid_idx_s2)
-    output_s2 = output_s1[:, ::2, ::2]
-    depth_target_s2 = Q[2, 3] / ((target_s2 - Q[3, 3])*Q[3,2])
-
-    target_s3 = target_s2[:, ::2, ::2]
-    valid_idx_s3 = target_s3 != 0
-    valid_num_s3 = torch.count_nonzero(valid_idx_s3)
-    output_s3 = output_s2[:, ::2, ::2]
-    depth_target_s3 = Q[2, 3] / ((target_s3 - Q[3, 3])*Q[3,2])
+    """
+    Loss of the log depth output of the model, see DepthLoss
+    target is the DepthTargets of the batch, whose fields are used as they are, or its disparity.
+    The DepthLoss of the device of output keeps Q and the SSIM window between the calls.
+    """
+    depth_loss = _depth_losses.get(output.device)
+    if depth_loss is None:
+        depth_loss = _depth_losses[output.device] = DepthLoss().to(output.device)
+    return depth_loss(output, target)
 
-    if torch.cuda.is_available():
-        R_k = torch.zeros(target.shape).cuda()
-        ssim_target = torch.zeros(target.shape).cuda()
-        ssim_output = torch.zeros(target.shape).cuda()
-    else:
-        R_k = torch.zeros(target.shape)
-        ssim_target = torch.zeros(target.shape)
-        ssim_output = torch.zeros(target.shape)
-    ssim_target[valid_idx] = log_depth_target[valid_idx]
-    ssim_output[valid_idx] = depth_output[valid_idx]
-    ssim_val = get_ssim_loss(ssim_target.unsqueeze(0),ssim_output.unsqueeze(0))
-    R_k[valid_idx] = log_depth_target[valid_idx] - depth_output[valid_idx]
-    loss_invar = ((1 / valid_num) * torch.sum(R_k ** 2)) - (
-        ((1 / valid_num) ** 2) * (torch.sum(R_k) ** 2)
-    )
-    grad_loss = multi_grad_loss(depth_output, depth_target, valid_idx, valid_num)
-    grad_loss_s1 = multi_grad_loss(output_s1, depth_target_s1, valid_idx_s1, valid_num_s1)
-    grad_loss_s2 = multi_grad_loss(output_s2, depth_target_s2, valid_idx_s2, valid_num_s2)
-    grad_loss_s3 = multi_grad_loss(output_s3, depth_target_s3, valid_idx_s3, valid_num_s3)
-    # print(Q.device)
-    # print(output.device)
-    # print(valid_idx.device)
-    # print(valid_num.device)
-    # print(depth_output.device)
-    # print(depth_target.device)
-    # print(R_k.device)
-    # print(loss_val.device)
-    loss_val = loss_invar + 0.5 * (grad_loss + grad_loss_s1 + grad_loss_s2 + grad_loss_s3) + 0.05*ssim_val
-    return loss_val
+
+class DepthLoss(torch.nn.Module):
+    """
+    Loss of the log depth predicted by MonoDepthNet:
+    scale-invariant error + grad_weight * gradient matching at num_scales scales
+    + ssim_weight * (1 - SSIM) of the log depth on the valid pixels.
+    Q and the SSIM window are buffers, so the module is moved to the device once with .to().
+    The log depth target is computed once per batch, the coarser scales take every 2**s-th
+    pixel of it. multi_grad_loss of get_log_depth_gt normalizes each scale by its own maximum
+    depth instead, which only offsets the log depth of a sample by a constant that the
+    gradient terms cancel: both give the same value.
+    The module can be compiled with torch.jit.script or torch.compile. A scripted module only
+    takes DepthTargets, built from the disparity with its targets method.
+
+    :param output: (B, 1, H, W) or (B, H, W) log depth.
+    :param target: DepthTargets of the batch, or its (B, H, W) disparity, 0 where there is no ground truth.
+    """
+    def __init__(self, num_scales: int=4, grad_weight: float=0.5, ssim_weight: float=0.05,
+                 window_size: int=11, Dmax: float=80, alpha: float=3.7):
+        super().__init__()
+        self.num_scales = num_scales
+        self.grad_weight = grad_weight
+        self.ssim_weight = ssim_weight
+        self.Dmax = float(Dmax)
+        self.alpha = float(alpha)
+        self.register_buffer('Q', get_projectmat().float())
+        self.ssim = SeparableSSIM(window_size)
+
+    @torch.jit.export
+    def targets(self, disparity: torch.Tensor) -> DepthTargets:
+        return depth_targets(disparity, self.Q, self.Dmax, self.alpha)
+
+    def forward(self, output: torch.Tensor, target: DepthTargets) -> torch.Tensor:
+        # A disparity tensor is accepted in eager mode, the annotation is for TorchScript.
+        if isinstance(target, torch.Tensor):
+            targets = self.targets(target)
+        else:
+            targets = target
+        valid = targets.valid
+        log_target = targets.log_depth
+        log_output = output.reshape(log_target.shape)
+
+        # Residual of the valid pixels, 0 elsewhere (R_k of loss)
+        residual = torch.where(valid, log_target - log_output, 0.0)
+        valid_num = targets.valid_num
+        loss_invar = ((1 / valid_num) * torch.sum(residual ** 2)) - (
+            ((1 / valid_num) ** 2) * (torch.sum(residual) ** 2)
+        )
+
+        grad_loss = torch.zeros_like(loss_invar)
+        for scale in range(self.num_scales):
+            step = 1 << scale
+            residual_s = residual[:, ::step, ::step]
+            valid_s = valid[:, ::step, ::step]
+            v_gradient = torch.abs(residual_s[:, 0:-2, :] - residual_s[:, 2:, :]) * (valid_s[:, 0:-2, :] & valid_s[:, 2:, :])
+            h_gradient = torch.abs(residual_s[:, :, 0:-2] - residual_s[:, :, 2:]) * (valid_s[:, :, 0:-2] & valid_s[:, :, 2:])
+            grad_loss = grad_loss + (torch.sum(h_gradient) + torch.sum(v_gradient)) / torch.count_nonzero(valid_s)
+
+        # The log depth target is already 0 on the invalid pixels
+        ssim_val = 1 - self.ssim(log_target.unsqueeze(1), log_output.unsqueeze(1), valid.unsqueeze(1))
+        return loss_invar + self.grad_weight * grad_loss + self.ssim_weight * ssim_val
 
 
 def get_log_depth_gt(depth_target, valid_idx, Dmax=80, alpha=3.7):
@@ -123,7 +170,10 @@ def multi_grad_loss(log_depth_output, depth_target, valid_idx, valid_num):
 def from_log_to_depth(input_log_image,Dmax=80, alpha=3.7):
     depth_image=Dmax*torch.exp(-alpha*(1-input_log_image))
     return depth_image
-def get_ssim_loss(img1,img2):
-    ssim_loss = model.pytorch_ssim.SSIM()
-    ssim_val = 1-ssim_loss(img1, img2)
+# Shared by all calls, SeparableSSIM caches its window per device and dtype
+_ssim_loss = SeparableSSIM()
+
+def get_ssim_loss(img1, img2, mask=None):
+    """1 - SSIM of two (B, C, H, W) images, with pixels outside of mask set to 0 in both"""
+    ssim_val = 1-_ssim_loss(img1, img2, mask)
     return ssim_val
\ No newline at end of file
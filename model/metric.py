@@ -1,16 +1,7 @@
-import torch
 import math
-from model.loss import *
-
-def lg10(x):
-    return torch.div(torch.log(x), math.log(10))
-
-def maxOfTwo(x, y):
-    z = x.clone()
-    maskYLarger = torch.lt(x, y)
-    z[maskYLarger.detach()] = y[maskYLarger.detach()]
-    return z
 
+import torch
+from model.loss import *
 
 def accuracy(output, target):
     with torch.no_grad():
@@ -31,155 +22,148 @@ def top_k_acc(output, target, k=3):
     return correct / len(target)
 
 
-def mean_square_error(output, target):
-    with torch.no_grad():
-        Q=get_projectmat()
-        if torch.cuda.is_available() and Q.device.type == "cpu":
-            Q = Q.cuda()
-        valid_idx = target != 0
-        valid_num = torch.count_nonzero(valid_idx)
-        invalid_idx = target == 0
-        depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-        depth_target = torch.clamp(depth_target,0,80)
-        depth_target[invalid_idx] = 0
-        depth_target = depth_target/torch.amax(torch.amax(depth_target,1,keepdims=True),2,keepdims=True)
-        depth_target *= 80
-        depth_output = from_log_to_depth(output.reshape(depth_target.shape))
-        diffMatrix = torch.abs(depth_output - depth_target)
-        diffMatrix[invalid_idx]=0
-        return torch.sum(torch.pow(diffMatrix, 2)) / valid_num
-
-
-def mean_absolute_error(output, target):
-    with torch.no_grad():
-        Q=get_projectmat()
-        if torch.cuda.is_available() and Q.device.type == "cpu":
-            Q = Q.cuda()
-        valid_idx = target != 0
-        valid_num = torch.count_nonzero(valid_idx)
-        invalid_idx = target == 0
-        depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-        depth_target = torch.clamp(depth_target,0,80)
-        depth_target[invalid_idx] = 0
-        depth_target = depth_target/torch.amax(torch.amax(depth_target,1,keepdims=True),2,keepdims=True)
-        depth_target *= 80
-        depth_output = from_log_to_depth(output.reshape(depth_target.shape))
-        diffMatrix = torch.abs(depth_output - depth_target)
-        diffMatrix[invalid_idx]=0
-        return torch.sum(diffMatrix) / valid_num
-
-
-def abs_rel_error(output, target):
-    with torch.no_grad():
-        diffMatrix = torch.abs(output - target)
-        realMatrix = torch.div(diffMatrix, target)
-        return torch.sum(realMatrix) / realMatrix.numel()
+def as_depth_targets(target):
+    """DepthTargets of a batch, built from the disparity if the trainer did not pass them"""
+    if isinstance(target, DepthTargets):
+        return target
+    return depth_targets(target, get_projectmat().float().to(target.device))
 
-def lg10_error(output, target):
-    with torch.no_grad():
-        LG10Matrix = torch.abs(lg10(output) - lg10(target))
-        return torch.sum(LG10Matrix) / LG10Matrix.numel()
-    
-def delta1_error(output, target):
-    with torch.no_grad():
-        yOverZ = torch.div(output, target)
-        zOverY = torch.div(target, output)
-        maxRatio = maxOfTwo(yOverZ, zOverY)
 
-        return torch.sum(torch.le(maxRatio, 1.25).float()) / maxRatio.numel()
+# Max depths of the mae_<d> and rmse_<d> errors of depth_error_table, used by mean_absolute_error_<d>
+MAX_DEPTHS = (10, 20, 30)
+ERROR_COLUMNS = ['abs', 'sq', 'abs_rel', 'sq_rel', 'log10', 'delta1', 'delta2', 'delta3', 'count']
+
 
-def delta2_error(output, target):
+def depth_error_table(output, target, max_depths=MAX_DEPTHS):
+    """
+    Errors of the depth of the valid pixels of a batch, all computed in a single pass
+    The per-pixel errors (ERROR_COLUMNS) of the normalized depth are summed into a table with
+    one row per max depth, over the pixels of metric depth at most max_depth, and a last row
+    over all valid pixels, by one product of the pixel masks with the errors.
+    abs_rel, sq_rel, log10 and the deltas compare depths over the valid pixels, where the first
+    release compared the raw output with the disparity over all pixels (inf or nan wherever the
+    disparity is 0).
+    :return: Dict of 0-dim tensors: mae, mse, rmse, abs_rel, sq_rel, log10, delta1, delta2 and
+        delta3 (fraction of max(pred / gt, gt / pred) <= 1.25**n) over all valid pixels, and
+        mae_<d>, rmse_<d> over the valid pixels of metric depth at most d, for d in max_depths.
+    """
     with torch.no_grad():
-        yOverZ = torch.div(output, target)
-        zOverY = torch.div(target, output)
-        maxRatio = maxOfTwo(yOverZ, zOverY)
+        targets = as_depth_targets(target)
+        # Flat indices of the valid pixels, gathered once for every map
+        index = targets.valid.reshape(-1).nonzero().squeeze(1)
+        gt = targets.normalized_depth.reshape(-1).index_select(0, index)
+        pred = from_log_to_depth(output.reshape(-1).index_select(0, index))
+        diff = torch.abs(pred - gt)
+        rel = diff / gt
+        # |log(pred / gt)| gives the log10 error and, as log(max(pred / gt, gt / pred)), the deltas
+        log_ratio = torch.abs(torch.log(pred / gt))
+        errors = torch.stack([
+            diff, diff * diff, rel, diff * rel, log_ratio / math.log(10),
+            log_ratio <= math.log(1.25), log_ratio <= 2 * math.log(1.25), log_ratio <= 3 * math.log(1.25),
+            torch.ones_like(diff)])
 
-        return torch.sum(torch.le(maxRatio, math.pow(1.25, 2)).float()) / maxRatio.numel()
+        # Sums within every max depth, and over all pixels, as a product with the masks of the
+        # pixels: unlike index_add_ on few rows, no atomics on the GPU, and a blocked
+        # accumulation that keeps float32 sums accurate.
+        depth = targets.depth.reshape(-1).index_select(0, index)
+        masks = torch.stack([depth <= max_depth for max_depth in max_depths] + [torch.ones_like(depth, dtype=torch.bool)])
+        table = masks.to(errors.dtype) @ errors.t()
 
+        sums = dict(zip(ERROR_COLUMNS, table[-1]))
+        result = {'mae': sums['abs'] / sums['count'], 'mse': sums['sq'] / sums['count']}
+        result['rmse'] = torch.sqrt(result['mse'])
+        for key in ERROR_COLUMNS[2:-1]:
+            result[key] = sums[key] / sums['count']
+        for max_depth, row in zip(max_depths, table):
+            sums = dict(zip(ERROR_COLUMNS, row))
+            result['mae_{}'.format(max_depth)] = sums['abs'] / sums['count']
+            result['rmse_{}'.format(max_depth)] = torch.sqrt(sums['sq'] / sums['count'])
+        return result
+
+
+# Key in depth_error_table of the metrics read from it. The trainer computes the table once per
+# step and passes it to all of them as table=, they compute it themselves otherwise.
+ERROR_TABLE_KEYS = {
+    'mean_square_error': 'mse',
+    'mean_absolute_error': 'mae',
+    'root_mean_square_error': 'rmse',
+    'abs_rel_error': 'abs_rel',
+    'sq_rel_error': 'sq_rel',
+    'lg10_error': 'log10',
+    'delta1_error': 'delta1',
+    'delta2_error': 'delta2',
+    'delta3_error': 'delta3',
+    'mean_absolute_error_10': 'mae_10',
+    'mean_absolute_error_20': 'mae_20',
+    'mean_absolute_error_30': 'mae_30',
+}
+
+
+def _error(output, target, key, table=None):
+    if table is None:
+        table = depth_error_table(output, target)
+    return table[key]
+
+
+def mean_square_error(output, target, table=None):
+    return _error(output, target, 'mse', table)
+
+
+def mean_absolute_error(output, target, table=None):
+    return _error(output, target, 'mae', table)
+
+
+def root_mean_square_error(output, target, table=None):
+    return _error(output, target, 'rmse', table)
+
+
+def abs_rel_error(output, target, table=None):
+    return _error(output, target, 'abs_rel', table)
+
+
+def sq_rel_error(output, target, table=None):
+    return _error(output, target, 'sq_rel', table)
+
+
+def lg10_error(output, target, table=None):
+    return _error(output, target, 'log10', table)
+
+
+def delta1_error(output, target, table=None):
+    return _error(output, target, 'delta1', table)
+
+
+def delta2_error(output, target, table=None):
+    return _error(output, target, 'delta2', table)
+
+
+def delta3_error(output, target, table=None):
+    return _error(output, target, 'delta3', table)
+
+
+def mean_absolute_error_10(output, target, table=None):
+    return _error(output, target, 'mae_10', table)
+
+
+def mean_absolute_error_20(output, target, table=None):
+    return _error(output, target, 'mae_20', table)
+
+
+def mean_absolute_error_30(output, target, table=None):
+    return _error(output, target, 'mae_30', table)
 
-def delta3_error(output, target):
-    with torch.no_grad():
-        yOverZ = torch.div(output, target)
-        zOverY = torch.div(target, output)
-        maxRatio = maxOfTwo(yOverZ, zOverY)
 
-        return torch.sum(torch.le(maxRatio, math.pow(1.25, 3)).float()) / maxRatio.numel()
-def mean_absolute_error_10(output, target):
-    with torch.no_grad():
-        Q=get_projectmat()
-        if torch.cuda.is_available() and Q.device.type == "cpu":
-            Q = Q.cuda()
-        invalid_idx = target == 0
-        depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-        depth_target = torch.clamp(depth_target,0,80)
-        depth_target[invalid_idx] = 0
-        invalid_idx=invalid_idx+(depth_target>10)
-        valid_num = torch.count_nonzero(~invalid_idx)
-        depth_target = depth_target/torch.amax(torch.amax(depth_target,1,keepdims=True),2,keepdims=True)
-        depth_target *= 80
-        depth_output = from_log_to_depth(output.reshape(depth_target.shape))
-        diffMatrix = torch.abs(depth_output - depth_target)
-        diffMatrix[invalid_idx]=0
-        return torch.sum(diffMatrix) / valid_num 
-def mean_absolute_error_20(output, target):
-    with torch.no_grad():
-        Q=get_projectmat()
-        if torch.cuda.is_available() and Q.device.type == "cpu":
-            Q = Q.cuda()
-        invalid_idx = target == 0
-        depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-        depth_target = torch.clamp(depth_target,0,80)
-        depth_target[invalid_idx] = 0
-        invalid_idx=invalid_idx+(depth_target>20)
-        valid_num = torch.count_nonzero(~invalid_idx)
-        depth_target = depth_target/torch.amax(torch.amax(depth_target,1,keepdims=True),2,keepdims=True)
-        depth_target *= 80
-        depth_output = from_log_to_depth(output.reshape(depth_target.shape))
-        diffMatrix = torch.abs(depth_output - depth_target)
-        diffMatrix[invalid_idx]=0
-        return torch.sum(diffMatrix) / valid_num
-def mean_absolute_error_30(output, target):
-    with torch.no_grad():
-        Q=get_projectmat()
-        if torch.cuda.is_available() and Q.device.type == "cpu":
-            Q = Q.cuda()
-        invalid_idx = target == 0
-        depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-        depth_target = torch.clamp(depth_target,0,80)
-        depth_target[invalid_idx] = 0
-        invalid_idx=invalid_idx+(depth_target>30)
-        valid_num = torch.count_nonzero(~invalid_idx)
-        depth_target = depth_target/torch.amax(torch.amax(depth_target,1,keepdims=True),2,keepdims=True)
-        depth_target *= 80
-        depth_output = from_log_to_depth(output.reshape(depth_target.shape))
-        diffMatrix = torch.abs(depth_output - depth_target)
-        diffMatrix[invalid_idx]=0
-        return torch.sum(diffMatrix) / valid_num
 def log_ssim_error(output, target):
     with torch.no_grad():
-        Q=get_projectmat()
-        if torch.cuda.is_available() and Q.device.type == "cpu":
-            Q = Q.cuda()
-        invalid_idx = target == 0
-        depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-        valid_idx=~invalid_idx
-        log_depth_target = get_log_depth_gt(depth_target, valid_idx)
-        log_depth_output = output.reshape(log_depth_target.shape).clone()
-        log_depth_output[invalid_idx]=0
-        ssim_val = get_ssim_loss(log_depth_target.unsqueeze(0),log_depth_output.unsqueeze(0))
+        targets = as_depth_targets(target)
+        log_depth_output = output.reshape(targets.log_depth.shape)
+        ssim_val = get_ssim_loss(targets.log_depth.unsqueeze(0), log_depth_output.unsqueeze(0), targets.valid.unsqueeze(0))
         return ssim_val
+
+
 def ssim_error(output, target):
     with torch.no_grad():
-        Q=get_projectmat()
-        if torch.cuda.is_available() and Q.device.type == "cpu":
-            Q = Q.cuda()
-        invalid_idx = target == 0
-        depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
-        depth_target = torch.clamp(depth_target,0,80)
-        depth_target[invalid_idx] = 0
-        depth_target = depth_target/torch.amax(torch.amax(depth_target,1,keepdims=True),2,keepdims=True)
-        depth_target *= 80
-        depth_output = from_log_to_depth(output.reshape(depth_target.shape)).clone()
-        depth_output[invalid_idx]=0
-        ssim_val = get_ssim_loss(depth_target.unsqueeze(0),depth_output.unsqueeze(0))
-        return ssim_val
\ No newline at end of file
+        targets = as_depth_targets(target)
+        depth_output = from_log_to_depth(output.reshape(targets.normalized_depth.shape))
+        ssim_val = get_ssim_loss(targets.normalized_depth.unsqueeze(0), depth_output.unsqueeze(0), targets.valid.unsqueeze(0))
+        return ssim_val
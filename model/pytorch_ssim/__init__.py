@@ -1,3 +1,5 @@
+from typing import Optional
+
 import torch
 import torch.nn.functional as F
 from torch.autograd import Variable
@@ -62,6 +64,76 @@ class SSIM(torch.nn.Module):
 
         return _ssim(img1, img2, window, self.window_size, channel, self.size_average)
 
+class SeparableSSIM(torch.nn.Module):
+    """
+    SSIM with the Gaussian window of SSIM, applied as two separable 1-D convolutions
+    The five maps of the SSIM statistics (x, y, x * x, y * y, x * y) of every channel are
+    stacked channels last and filtered by a single grouped convolution per direction. With
+    zero padding, this equals _ssim with the 2-D window up to rounding.
+    The window is a buffer; copies for inputs of another device or dtype are cached.
+
+    :param mask: Optional valid pixels, broadcastable to the images: both images are set to 0
+        outside, as the loss and metrics do for pixels without ground truth. With
+        masked_average, the SSIM map is averaged over the valid pixels only.
+    """
+    def __init__(self, window_size: int=11, size_average: bool=True, masked_average: bool=False):
+        super().__init__()
+        self.window_size = window_size
+        self.size_average = size_average
+        self.masked_average = masked_average
+        window = gaussian(window_size, 1.5)
+        self.register_buffer('window', window.view(1, 1, 1, window_size).repeat(5, 1, 1, 1))
+        self._windows = dict()
+
+    @torch.jit.unused
+    def _cached_window(self, device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+        if self.window.device == device and self.window.dtype == dtype:
+            return self.window
+        window = self._windows.get((device, dtype))
+        if window is None:
+            window = self.window.to(device=device, dtype=dtype)
+            self._windows[(device, dtype)] = window
+        return window
+
+    def forward(self, img1: torch.Tensor, img2: torch.Tensor, mask: Optional[torch.Tensor]=None) -> torch.Tensor:
+        if torch.jit.is_scripting():
+            window = self.window.to(device=img1.device, dtype=img1.dtype)
+        else:
+            window = self._cached_window(img1.device, img1.dtype)
+        if mask is not None:
+            img1 = torch.where(mask, img1, 0.0)
+            img2 = torch.where(mask, img2, 0.0)
+        batch_size = img1.shape[0]
+        height, width = img1.shape[-2], img1.shape[-1]
+        # Channels are filtered independently, as images of a larger batch
+        x = img1.reshape(-1, height, width)
+        y = img2.reshape(-1, height, width)
+        maps = torch.stack([x, y, x * x, y * y, x * y], dim=-1).permute(0, 3, 1, 2)
+        padding = self.window_size // 2
+        stats = F.conv2d(maps, window, padding=(0, padding), groups=5)
+        stats = F.conv2d(stats, window.view(5, 1, self.window_size, 1), padding=(padding, 0), groups=5)
+
+        mu1, mu2 = stats[:, 0], stats[:, 1]
+        mu1_sq = mu1.pow(2)
+        mu2_sq = mu2.pow(2)
+        mu1_mu2 = mu1 * mu2
+        sigma1_sq = stats[:, 2] - mu1_sq
+        sigma2_sq = stats[:, 3] - mu2_sq
+        sigma12 = stats[:, 4] - mu1_mu2
+        C1 = 0.01**2
+        C2 = 0.03**2
+        ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
+
+        ssim_map = ssim_map.reshape(batch_size, -1)
+        if mask is not None and self.masked_average:
+            weight = mask.expand(img1.shape).reshape(batch_size, -1).to(ssim_map.dtype)
+            if self.size_average:
+                return torch.sum(ssim_map * weight) / torch.sum(weight)
+            return torch.sum(ssim_map * weight, 1) / torch.sum(weight, 1)
+        if self.size_average:
+            return ssim_map.mean()
+        return ssim_map.mean(1)
+
 def ssim(img1, img2, window_size = 11, size_average = True):
     (_, channel, _, _) = img1.size()
     window = create_window(window_size, channel)
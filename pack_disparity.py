@@ -0,0 +1,31 @@
+"""
+Decode the disparity ground truth of a DSEC directory into memory-mapped stacks.
+
+For every sequence, disparity/event/*.png is decoded once into disparity_event.npy
+in the disparity directory. These files are read by utils.disparitystore.DisparityStack,
+which is used by Sequence/DatasetProvider with gt_backend='memmap'.
+"""
+from pathlib import Path
+
+from tqdm import tqdm
+
+from utils.disparitystore import pack_disparity_dir, DISPARITY_META_FILE
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsec_dir', default="/home/lxz/DSEC/", help='Path to DSEC dataset directory')
+    parser.add_argument('--split', default="train", help='Subdirectory containing the sequences')
+    parser.add_argument('--overwrite', action='store_true', help='Convert sequences that have already been converted')
+    args = parser.parse_args()
+
+    split_dir = Path(args.dsec_dir) / args.split
+    assert split_dir.is_dir(), str(split_dir)
+
+    disp_dirs = sorted(split_dir.glob('*/disparity'))
+    for disp_dir in tqdm(disp_dirs):
+        if not args.overwrite and (disp_dir / DISPARITY_META_FILE).is_file():
+            continue
+        pack_disparity_dir(disp_dir)
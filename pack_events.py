@@ -0,0 +1,37 @@
+"""
+Convert the events of a DSEC directory into uncompressed packed-record files.
+
+For every sequence, events/{left,right}/events.h5 is converted into
+events_packed.npy, ms_to_idx.npy and events_packed.json in the same directory.
+These files are read by utils.eventstore.MemmapEventSlicer, which is used by
+Sequence/DatasetProvider with event_backend='memmap'.
+"""
+from pathlib import Path
+
+from tqdm import tqdm
+
+from utils.eventstore import pack_event_file, PACKED_META_FILE
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsec_dir', default="/home/lxz/DSEC/", help='Path to DSEC dataset directory')
+    parser.add_argument('--split', default="train", help='Subdirectory containing the sequences')
+    parser.add_argument('--t_encoding', default="int64", choices=['int64', 'delta'], help='Timestamp encoding of the records')
+    parser.add_argument('--overwrite', action='store_true', help='Convert files that have already been converted')
+    args = parser.parse_args()
+
+    split_dir = Path(args.dsec_dir) / args.split
+    assert split_dir.is_dir(), str(split_dir)
+
+    event_files = sorted(split_dir.glob('*/events/*/events.h5'))
+    for event_file in tqdm(event_files):
+        if not args.overwrite and (event_file.parent / PACKED_META_FILE).is_file():
+            continue
+        try:
+            pack_event_file(event_file, event_file.parent, args.t_encoding)
+        except ValueError as error:
+            tqdm.write('{}\nfalling back to t_encoding=int64'.format(error))
+            pack_event_file(event_file, event_file.parent, 'int64')
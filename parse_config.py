@@ -5,7 +5,7 @@ from functools import reduce, partial
 from operator import getitem
 from datetime import datetime
 from logger.logger import setup_logging
-from utils.util import read_json, write_json
+from utils.util import read_config, write_json
 
 
 class ConfigParser:
@@ -68,10 +68,10 @@ class ConfigParser:
             resume = None
             cfg_fname = Path(args.config)
         
-        config = read_json(cfg_fname)
+        config = read_config(cfg_fname)
         if args.config and resume:
             # update new config for fine-tuning
-            config.update(read_json(args.config))
+            config.update(read_config(args.config))
 
         # parse custom cli options into dictionary
         modification = {opt.target : getattr(args, _get_opt_name(opt.flags)) for opt in options}
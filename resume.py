@@ -10,8 +10,7 @@ from trainer import Trainer, LSTMTrainer
 from utils import prepare_device
 from torch.utils.tensorboard import SummaryWriter
 
-from dataset.provider import DatasetProvider
-from dataset.dataloader import BaseDataLoader
+from dataset.dataloader import build_data_loaders
 from pathlib import Path
 
 # fix random seeds for reproducibility
@@ -25,18 +24,7 @@ def main(config):#,writer_tensbd):
     logger = config.get_logger('train')
 
     # setup data_loader instances
-    dataset_provider = DatasetProvider(Path(config['dsec_dir']))
-    train_dataset = dataset_provider.get_train_dataset()
-
-    data_loader = BaseDataLoader(  # could have bugs
-        dataset=train_dataset,
-        batch_size=config["data_loader"]["args"]["batch_size"],
-        shuffle=config["data_loader"]["args"]["shuffle"],
-        validation_split=config["data_loader"]["args"]["validation_split"],
-        num_workers=config["data_loader"]["args"]["num_workers"],
-        drop_last=True,
-    )
-    valid_data_loader = data_loader.split_validation()
+    data_loader, valid_data_loader = build_data_loaders(config)
 
     # build model architecture, then print to console
     model = config.init_obj('arch', module_arch)
@@ -51,6 +39,9 @@ def main(config):#,writer_tensbd):
 
     # get function handles of loss and metrics
     criterion = getattr(module_loss, config['loss'])
+    if isinstance(criterion, type):
+        # Loss modules (e.g. DepthLoss) hold buffers on the training device
+        criterion = criterion().to(device)
     metrics = [getattr(module_metric, met) for met in config['metrics']]
 
     # build optimizer, learning rate scheduler. delete every lines containing lr_scheduler for disabling scheduler
@@ -0,0 +1,141 @@
+"""
+Streaming depth inference over the events of one camera of a DSEC sequence.
+
+Windows of delta_t_ms are read with EventReader and go through a pipeline of threads:
+read -> voxelize (rectify and voxel grid) -> model (MonoDepthNet, with the ConvLSTM
+state carried from window to window) -> write (optional 16-bit PNGs of depth * 256).
+Stages are connected by bounded queues, so a slow stage throttles the reader. At the end,
+the mean and max latency of every stage and the throughput are reported against the
+window rate of 1000 / delta_t_ms Hz.
+
+With --stride_ms below delta_t_ms, windows overlap and start every stride_ms, e.g. 50 ms
+windows at 100 Hz. Their voxel grids are built incrementally by SlidingVoxelGrid in the read
+stage. Its bins span the window instead of its first to its last event, as the samples of
+a Sequence with time_window=True. Models trained with time_window use SlidingVoxelGrid for
+non-overlapping windows as well.
+
+Example:
+    python stream_inference.py --checkpoint saved/models/EventDepth_UNet/<run>/model_best.pth \
+        --sequence_dir /home/lxz/DSEC/train/zurich_city_00_a --output_dir depth/zurich_city_00_a
+"""
+import itertools
+from pathlib import Path
+
+import cv2
+import h5py
+import numpy as np
+import torch
+
+from dataset.sliding_voxel_grid import SlidingVoxelGrid
+from model.loss import from_log_to_depth
+from utils.inference import dataset_args as get_dataset_args, load_model, WindowVoxelizer
+from utils.eventslicer import EventSlicer
+from utils.pipeline import ThreadedPipeline
+from visualization.eventreader import EventReader
+
+
+def sliding_voxel_grids(sliding: SlidingVoxelGrid, t_start_us: int, t_final_us: int):
+    """Voxel grids of the windows ending every sliding.stride_us, until the events run out"""
+    t_end_us = t_start_us + sliding.delta_t_us
+    while t_end_us <= t_final_us:
+        voxel_grid = sliding.get(t_end_us)
+        if voxel_grid is None:
+            return
+        yield voxel_grid
+        t_end_us += sliding.stride_us
+
+
+class RecurrentDepth:
+    """Depth of consecutive windows with MonoDepthNet, carrying the ConvLSTM state"""
+    def __init__(self, model: torch.nn.Module, device: torch.device):
+        self.model = model
+        self.device = device
+        self.state = None
+
+    def __call__(self, window):
+        index, voxel_grid = window
+        with torch.no_grad():
+            log_depth, self.state = self.model(voxel_grid[None].to(self.device), self.state)
+            depth = from_log_to_depth(log_depth)[0, 0]
+        return index, depth.cpu().numpy()
+
+
+class DepthWriter:
+    def __init__(self, output_dir: Path=None):
+        self.output_dir = output_dir
+        if output_dir is not None:
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, window):
+        index, depth = window
+        if self.output_dir is not None:
+            depth_16bit = np.clip(np.round(depth * 256), 0, 2**16 - 1).astype('uint16')
+            cv2.imwrite(str(self.output_dir / '{:06d}.png'.format(index)), depth_16bit)
+        return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True, help='Checkpoint saved by the trainer')
+    parser.add_argument('--config', default=None, help='Configuration (default: config.json next to the checkpoint)')
+    parser.add_argument('--sequence_dir', required=True, help='DSEC sequence directory')
+    parser.add_argument('--location', default='left', choices=['left', 'right'])
+    parser.add_argument('--output_dir', default=None, help='Directory for the depth PNGs (default: not written)')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--queue_size', type=int, default=2, help='Maximum number of windows waiting per stage')
+    parser.add_argument('--max_windows', type=int, default=None)
+    parser.add_argument('--voxel_backend', default='torch', choices=['torch', 'numba'])
+    parser.add_argument('--voxel_threads', type=int, default=0)
+    parser.add_argument('--stride_ms', type=int, default=None,
+                        help='Time between overlapping windows (default: delta_t_ms, no overlap)')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    config = None
+    if args.config is not None:
+        from utils.util import read_config
+        config = read_config(args.config)
+    model, config = load_model(Path(args.checkpoint), device, config)
+    dataset_args = get_dataset_args(config)
+    delta_t_ms = dataset_args['delta_t_ms']
+
+    ev_dir = Path(args.sequence_dir) / 'events' / args.location
+    with h5py.File(str(ev_dir / 'rectify_map.h5'), 'r') as h5_rect:
+        rectify_map = h5_rect['rectify_map'][()]
+
+    model_stages = [
+        ('model', RecurrentDepth(model, device)),
+        ('write', DepthWriter(Path(args.output_dir) if args.output_dir is not None else None)),
+    ]
+    stride_ms = args.stride_ms if args.stride_ms is not None else delta_t_ms
+    if stride_ms == delta_t_ms and not dataset_args.get('time_window', False):
+        voxelizer = WindowVoxelizer(rectify_map, dataset_args['num_bins'], args.voxel_backend, args.voxel_threads)
+        with EventReader(ev_dir / 'events.h5', delta_t_ms) as reader:
+            source = enumerate(itertools.islice(reader, args.max_windows))
+            pipeline = ThreadedPipeline(source, [
+                ('voxelize', lambda window: (window[0], voxelizer(window[1]))),
+            ] + model_stages, queue_size=args.queue_size)
+            for _ in pipeline:
+                pass
+        window_rate = 1000 / delta_t_ms
+    else:
+        height, width = rectify_map.shape[:2]
+        with h5py.File(str(ev_dir / 'events.h5'), 'r') as h5f:
+            event_slicer = EventSlicer(h5f)
+            sliding = SlidingVoxelGrid(event_slicer, dataset_args['num_bins'], height, width, delta_t_ms * 1000,
+                                       stride_ms * 1000, rectify_map=rectify_map)
+            voxel_grids = sliding_voxel_grids(sliding, event_slicer.get_start_time_us(), event_slicer.get_final_time_us())
+            source = enumerate(itertools.islice(voxel_grids, args.max_windows))
+            pipeline = ThreadedPipeline(source, model_stages, queue_size=args.queue_size)
+            for _ in pipeline:
+                pass
+        window_rate = 1000 / stride_ms
+
+    print('{:>12s} {:>10s} {:>10s}'.format('stage', 'mean [ms]', 'max [ms]'))
+    for name, latency in pipeline.summary().items():
+        print('{:>12s} {:>10.2f} {:>10.2f}'.format(name, latency['mean_ms'], latency['max_ms']))
+    print('{} windows in {:.2f} s: {:.2f} windows/s for a window rate of {:.2f} Hz ({})'.format(
+        pipeline.num_items, pipeline.wall_time_s, pipeline.fps, window_rate,
+        'keeps up' if pipeline.fps >= window_rate else 'too slow'))
@@ -1,81 +1,200 @@
+"""
+Disparity prediction of the DSEC test sequences, in the layout of check_disparity_submission.py.
+
+The windows of a sequence are [t - delta_t_ms, t) for the timestamps t of
+<timestamps_dir>/<sequence>.csv (lines "timestamp_us, file_index"). They are predicted in
+time order, with the ConvLSTM state carried from one window to the next as in training.
+Up to batch_size sequences are processed at once, one per lane of the batch: when a
+sequence ends, its lane continues with the next sequence and a zero state. Events are read
+and voxelized by a thread pool one step ahead of the model, and the 16-bit disparity PNGs
+(disparity * 256) are written by another thread pool. The model predicts depth normalized to
+the farthest pixel of a frame, which is taken to be at --max_depth meters (80, the clamp of
+the training targets, by default; see utils.inference.depth_to_disparity_16bit).
+
+<output_dir>/<sequence>/<file_index:06d>.png is written through a temporary file, hence a
+sequence is finished iff all of its PNGs exist. Finished sequences are skipped, so an
+interrupted run resumes where it stopped; unfinished sequences are predicted again from
+their start, since the recurrent state depends on all previous windows.
+
+Example:
+    python test.py -r saved/models/EventDepth_UNet/<run>/model_best.pth \
+        --test_dir /home/lxz/DSEC/test --timestamps_dir /home/lxz/DSEC/test_disparity_timestamps \
+        --output_dir submission
+"""
 import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+import cv2
+import hdf5plugin
+import h5py
+import numpy as np
 import torch
 from tqdm import tqdm
-import data_loader.data_loaders as module_data
-import model.loss as module_loss
-import model.metric as module_metric
-import model.model as module_arch
-from parse_config import ConfigParser
-
-
-def main(config):
-    logger = config.get_logger('test')
-
-    # setup data_loader instances
-    data_loader = getattr(module_data, config['data_loader']['type'])(
-        config['data_loader']['args']['data_dir'],
-        batch_size=512,
-        shuffle=False,
-        validation_split=0.0,
-        training=False,
-        num_workers=2
-    )
-
-    # build model architecture
-    model = config.init_obj('arch', module_arch)
-    logger.info(model)
-
-    # get function handles of loss and metrics
-    loss_fn = getattr(module_loss, config['loss'])
-    metric_fns = [getattr(module_metric, met) for met in config['metrics']]
-
-    logger.info('Loading checkpoint: {} ...'.format(config.resume))
-    checkpoint = torch.load(config.resume)
-    state_dict = checkpoint['state_dict']
-    if config['n_gpu'] > 1:
-        model = torch.nn.DataParallel(model)
-    model.load_state_dict(state_dict)
-
-    # prepare model for testing
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = model.to(device)
-    model.eval()
-
-    total_loss = 0.0
-    total_metrics = torch.zeros(len(metric_fns))
-
-    with torch.no_grad():
-        for i, (data, target) in enumerate(tqdm(data_loader)):
-            data, target = data.to(device), target.to(device)
-            output = model(data)
-
-            #
-            # save sample images, or do something with output here
-            #
-
-            # computing loss, metrics on test set
-            loss = loss_fn(output, target)
-            batch_size = data.shape[0]
-            total_loss += loss.item() * batch_size
-            for i, metric in enumerate(metric_fns):
-                total_metrics[i] += metric(output, target) * batch_size
-
-    n_samples = len(data_loader.sampler)
-    log = {'loss': total_loss / n_samples}
-    log.update({
-        met.__name__: total_metrics[i].item() / n_samples for i, met in enumerate(metric_fns)
-    })
-    logger.info(log)
+
+from model.loss import get_projectmat
+from utils.eventslicer import EventSlicer
+from utils.inference import dataset_args as get_dataset_args, depth_to_disparity_16bit, load_model, WindowVoxelizer
+from utils.util import read_config
+
+
+def read_timestamps(timestamps_file: Path) -> np.ndarray:
+    """(N, 2) timestamps and file indices of a DSEC timestamps csv"""
+    return np.loadtxt(str(timestamps_file), dtype='int64', delimiter=',', comments='#').reshape(-1, 2)
+
+
+class TestSequence:
+    """Windows of a test sequence, read in any order by a thread pool"""
+    def __init__(self, seq_path: Path, timestamps_file: Path, delta_t_ms: int, num_bins: int,
+                 location: str='left', voxel_backend: str='torch', voxel_threads: int=0):
+        data = read_timestamps(timestamps_file)
+        self.timestamps = data[:, 0]
+        self.file_indices = data[:, 1]
+        self.name = seq_path.name
+        self.delta_t_us = delta_t_ms * 1000
+
+        ev_dir = seq_path / 'events' / location
+        with h5py.File(str(ev_dir / 'rectify_map.h5'), 'r') as h5_rect:
+            rectify_map = h5_rect['rectify_map'][()]
+        self.voxelizer = WindowVoxelizer(rectify_map, num_bins, voxel_backend, voxel_threads)
+        self.h5f = h5py.File(str(ev_dir / 'events.h5'), 'r')
+        self.event_slicer = EventSlicer(self.h5f)
+
+    def __len__(self):
+        return self.timestamps.size
+
+    def get_voxel_grid(self, index: int) -> torch.Tensor:
+        t_end = self.timestamps[index]
+        return self.voxelizer(self.event_slicer.get_events(t_end - self.delta_t_us, t_end))
+
+    def close(self):
+        self.h5f.close()
+
+
+def png_path(output_dir: Path, seq_name: str, file_index: int) -> Path:
+    return output_dir / seq_name / '{:06d}.png'.format(file_index)
+
+
+def is_finished(output_dir: Path, seq_name: str, file_indices: np.ndarray) -> bool:
+    return all(png_path(output_dir, seq_name, file_index).is_file() for file_index in file_indices)
+
+
+def write_png(path: Path, disparity_16bit: np.ndarray):
+    # The PNG only appears under its name once complete. The temporary name keeps the
+    # .png extension, which selects the encoder of cv2.imwrite.
+    tmp_path = path.with_name('.tmp_' + path.name)
+    assert cv2.imwrite(str(tmp_path), disparity_16bit), str(tmp_path)
+    os.replace(str(tmp_path), str(path))
+
+
+def main(args):
+    device = torch.device(args.device)
+    config = read_config(args.config) if args.config is not None else None
+    model, config = load_model(Path(args.resume), device, config)
+    dataset_args = get_dataset_args(config)
+    Q = get_projectmat().float().to(device)
+
+    test_dir = Path(args.test_dir)
+    timestamps_dir = Path(args.timestamps_dir)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    pending = deque()
+    num_windows = 0
+    for timestamps_file in sorted(timestamps_dir.glob('*.csv')):
+        seq_name = timestamps_file.stem
+        file_indices = read_timestamps(timestamps_file)[:, 1]
+        if is_finished(output_dir, seq_name, file_indices):
+            print('{}: finished, skipped'.format(seq_name))
+            continue
+        seq_output_dir = output_dir / seq_name
+        seq_output_dir.mkdir(exist_ok=True)
+        # Leftovers of an interrupted run, the sequence is predicted again from its start
+        for path in seq_output_dir.glob('*.png'):
+            path.unlink()
+        pending.append(seq_name)
+        num_windows += file_indices.size
+
+    def open_sequence(seq_name):
+        return TestSequence(test_dir / seq_name, timestamps_dir / '{}.csv'.format(seq_name), dataset_args['delta_t_ms'],
+                            dataset_args['num_bins'], args.location, args.voxel_backend, args.voxel_threads)
+
+    # A lane is (sequence, index of its next window)
+    lanes = []
+    while len(lanes) < args.batch_size and len(pending) > 0:
+        lanes.append((open_sequence(pending.popleft()), 0))
+
+    state = None
+    writes = set()
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max(len(lanes), 1)) as readers, ThreadPoolExecutor(args.num_writers) as writers, \
+            tqdm(total=num_windows, unit='window') as progress:
+        loads = [readers.submit(sequence.get_voxel_grid, index) for sequence, index in lanes]
+        while len(lanes) > 0:
+            voxel_grids = torch.stack([load.result() for load in loads])
+
+            # Lanes of the next step: continuing lanes keep their order (and their state), the
+            # lanes of finished sequences are given to new sequences, appended with a zero state.
+            keep = [i for i, (sequence, index) in enumerate(lanes) if index + 1 < len(sequence)]
+            next_lanes = [(lanes[i][0], lanes[i][1] + 1) for i in keep]
+            for sequence, index in lanes:
+                if index + 1 == len(sequence):
+                    sequence.close()
+                    if len(pending) > 0:
+                        next_lanes.append((open_sequence(pending.popleft()), 0))
+            loads = [readers.submit(sequence.get_voxel_grid, index) for sequence, index in next_lanes]
+
+            with torch.no_grad():
+                log_depth, state = model(voxel_grids.to(device), state)
+                disparity_16bit = depth_to_disparity_16bit(log_depth[:, 0], Q, args.max_depth)
+
+            for (sequence, index), disparity in zip(lanes, disparity_16bit):
+                path = png_path(output_dir, sequence.name, sequence.file_indices[index])
+                writes.add(writers.submit(write_png, path, disparity))
+            # Backpressure: at most a few PNGs per writer are queued
+            while len(writes) > 4 * args.num_writers:
+                done, writes = wait(writes, return_when=FIRST_COMPLETED)
+                for write in done:
+                    write.result()
+            progress.update(len(lanes))
+
+            num_new = len(next_lanes) - len(keep)
+            if len(keep) == 0:
+                state = None
+            else:
+                keep_index = torch.tensor(keep, device=device)
+                state = [(h[keep_index], c[keep_index]) for h, c in state]
+                if num_new > 0:
+                    state = [(torch.cat([h, h.new_zeros((num_new,) + h.shape[1:])]),
+                              torch.cat([c, c.new_zeros((num_new,) + c.shape[1:])])) for h, c in state]
+            lanes = next_lanes
+        for write in writes:
+            write.result()
+
+    wall_time_s = time.perf_counter() - t_start
+    print('{} windows in {:.2f} s: {:.2f} windows/s'.format(
+        num_windows, wall_time_s, num_windows / wall_time_s if wall_time_s > 0 else 0.0))
 
 
 if __name__ == '__main__':
-    args = argparse.ArgumentParser(description='PyTorch Template')
-    args.add_argument('-c', '--config', default=None, type=str,
-                      help='config file path (default: None)')
-    args.add_argument('-r', '--resume', default=None, type=str,
-                      help='path to latest checkpoint (default: None)')
-    args.add_argument('-d', '--device', default=None, type=str,
-                      help='indices of GPUs to enable (default: all)')
-
-    config = ConfigParser.from_args(args)
-    main(config)
+    parser = argparse.ArgumentParser(description='DSEC disparity submission')
+    parser.add_argument('-r', '--resume', required=True, type=str,
+                        help='checkpoint saved by the trainer')
+    parser.add_argument('-c', '--config', default=None, type=str,
+                        help='config file path (default: config.json next to the checkpoint)')
+    parser.add_argument('-d', '--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument('--test_dir', required=True, help='DSEC test split, containing one directory per sequence')
+    parser.add_argument('--timestamps_dir', required=True, help='Directory of the <sequence>.csv disparity timestamps')
+    parser.add_argument('--output_dir', required=True, help='Submission directory')
+    parser.add_argument('--location', default='left', choices=['left', 'right'])
+    parser.add_argument('--batch_size', type=int, default=4, help='Number of sequences predicted at once')
+    parser.add_argument('--num_writers', type=int, default=4, help='Number of threads writing PNGs')
+    parser.add_argument('--voxel_backend', default='torch', choices=['torch', 'numba'])
+    parser.add_argument('--voxel_threads', type=int, default=0)
+    parser.add_argument('--max_depth', type=float, default=80.0,
+                        help='Depth of the farthest pixel of a frame in meters, at most 80 '
+                             '(see utils.inference.depth_to_disparity_16bit)')
+    main(parser.parse_args())
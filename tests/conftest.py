@@ -0,0 +1,77 @@
+import cv2
+import h5py
+import numpy as np
+import pytest
+
+
+def write_event_file(h5_path, t, x, y, p, t_offset=0, num_ms=None, chunk_size=None):
+    """Write events (t in microseconds relative to t_offset) in the layout of DSEC events.h5
+    ms_to_idx covers num_ms milliseconds, by default up to the last event.
+    """
+    t = np.asarray(t, dtype='int64')
+    if num_ms is None:
+        num_ms = int(t[-1]) // 1000 + 2 if t.size > 0 else 1
+    ms_to_idx = np.searchsorted(t, np.arange(num_ms, dtype='int64') * 1000, side='left')
+    chunks = dict(chunks=(chunk_size,)) if chunk_size is not None else dict()
+    with h5py.File(str(h5_path), 'w') as h5f:
+        h5f.create_dataset('events/t', data=t.astype('uint32'), **chunks)
+        h5f.create_dataset('events/x', data=np.asarray(x, dtype='uint16'), **chunks)
+        h5f.create_dataset('events/y', data=np.asarray(y, dtype='uint16'), **chunks)
+        h5f.create_dataset('events/p', data=np.asarray(p, dtype='uint8'), **chunks)
+        h5f.create_dataset('ms_to_idx', data=ms_to_idx.astype('uint64'))
+        h5f.create_dataset('t_offset', data=np.int64(t_offset))
+    return ms_to_idx
+
+
+def random_events(rng, num_events, duration_us, height=480, width=640):
+    """Sorted random events (t, x, y, p) of duration_us microseconds, with bursts of equal timestamps"""
+    t = np.sort(rng.integers(0, duration_us, num_events))
+    t[num_events // 2:num_events // 2 + 50] = t[num_events // 2]
+    return t, rng.integers(0, width, num_events), rng.integers(0, height, num_events), rng.integers(0, 2, num_events)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def event_file(tmp_path, rng):
+    """events.h5 of 20k random events over 200 ms, and its events (t relative to t_offset)"""
+    t_offset = 1_600_000_000_000_000
+    t, x, y, p = random_events(rng, 20_000, 200_000)
+    h5_path = tmp_path / 'events.h5'
+    write_event_file(h5_path, t, x, y, p, t_offset, chunk_size=1024)
+    return h5_path, {'t': t + t_offset, 'x': x, 'y': y, 'p': p}, t_offset
+
+
+def write_sequence(seq_path, rng, num_gt=6, gt_period_ms=100, events_per_ms=40, t_offset=1_600_000_000_000_000):
+    """DSEC-like sequence of 480x640 events of both locations and num_gt ground truth disparity maps"""
+    duration_us = (num_gt - 1) * gt_period_ms * 1000 + 1000
+    for location in ['left', 'right']:
+        ev_dir = seq_path / 'events' / location
+        ev_dir.mkdir(parents=True)
+        t, x, y, p = random_events(rng, events_per_ms * duration_us // 1000, duration_us)
+        write_event_file(ev_dir / 'events.h5', t, x, y, p, t_offset)
+        xx, yy = np.meshgrid(np.arange(640, dtype='float32'), np.arange(480, dtype='float32'))
+        rectify_map = np.stack([xx + 0.3 * np.sin(yy / 50), yy + 0.2 * np.cos(xx / 70)], axis=-1).astype('float32')
+        with h5py.File(str(ev_dir / 'rectify_map.h5'), 'w') as h5f:
+            h5f.create_dataset('rectify_map', data=rectify_map)
+
+    disp_dir = seq_path / 'disparity' / 'event'
+    disp_dir.mkdir(parents=True)
+    timestamps = t_offset + np.arange(num_gt, dtype='int64') * gt_period_ms * 1000
+    np.savetxt(str(seq_path / 'disparity' / 'timestamps.txt'), timestamps, fmt='%d')
+    for index in range(num_gt):
+        disparity = rng.integers(256, 60 * 256, (480, 640)).astype('uint16')
+        disparity[rng.random((480, 640)) < 0.7] = 0
+        cv2.imwrite(str(disp_dir / '{:06d}.png'.format(2 * index)), disparity)
+    return seq_path
+
+
+@pytest.fixture
+def dsec_dir(tmp_path, rng):
+    """DSEC directory with two training sequences"""
+    for name in ['seq_a', 'seq_b']:
+        write_sequence(tmp_path / 'dsec' / 'train' / name, rng)
+    return tmp_path / 'dsec'
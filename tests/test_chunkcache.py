@@ -0,0 +1,34 @@
+import h5py
+import numpy as np
+
+from test_eventslicer import assert_same_events, random_windows
+from utils.chunkcache import ChunkCache
+from utils.eventslicer import EventSlicer
+
+
+def test_slicer_with_chunk_cache_matches_direct_reads(event_file, rng):
+    h5_path, _, t_offset = event_file
+    chunk_cache = ChunkCache(64 * 1024)
+    t_starts, t_ends = random_windows(rng, t_offset, 100, 250_000)
+    with h5py.File(str(h5_path), 'r') as h5f:
+        slicer = EventSlicer(h5f)
+        cached_slicer = EventSlicer(h5f, chunk_cache)
+        for t_start, t_end in zip(t_starts, t_ends):
+            expected = slicer.get_events(t_start, t_end)
+            if expected is not None:
+                assert_same_events(cached_slicer.get_events(t_start, t_end), expected)
+        events, offsets = cached_slicer.get_events_batch(t_starts, t_ends)
+        expected_events, expected_offsets = slicer.get_events_batch(t_starts, t_ends)
+        np.testing.assert_array_equal(offsets, expected_offsets)
+        assert_same_events(events, expected_events)
+    assert chunk_cache.hits > 0
+    assert chunk_cache.nbytes <= chunk_cache.max_nbytes
+
+
+def test_chunk_cache_evicts_least_recently_used():
+    chunk_cache = ChunkCache(3 * 8)
+    for key in [0, 1, 2, 0, 3]:
+        chunk_cache.get(key, lambda: np.full(1, key, dtype='int64'))
+    assert chunk_cache.misses == 4 and chunk_cache.hits == 1
+    # 1 was the least recently used chunk when 3 was added
+    assert list(chunk_cache._chunks) == [2, 0, 3]
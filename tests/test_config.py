@@ -0,0 +1,28 @@
+import json
+from pathlib import Path
+
+from utils.util import read_config, read_json
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_read_config_merges_the_keys_of_its_base(tmp_path):
+    (tmp_path / 'base.json').write_text(json.dumps(
+        {'name': 'base', 'dataset': {'args': {'num_bins': 15, 'augmentation': None}}, 'metrics': ['a', 'b']}))
+    (tmp_path / 'configs').mkdir()
+    (tmp_path / 'configs' / 'child.json').write_text(json.dumps(
+        {'base': '../base.json', 'dataset': {'args': {'augmentation': {'hflip': 0.5}}}, 'metrics': ['c']}))
+    config = read_config(tmp_path / 'configs' / 'child.json')
+    assert config == {'name': 'base', 'dataset': {'args': {'num_bins': 15, 'augmentation': {'hflip': 0.5}}},
+                      'metrics': ['c']}
+    assert read_config(tmp_path / 'base.json') == read_json(tmp_path / 'base.json')
+
+
+def test_augmentation_config_only_overrides_the_augmentation():
+    base = json.loads(json.dumps(read_config(ROOT / 'config.json')))
+    config = json.loads(json.dumps(read_config(ROOT / 'config_augmentation.json')))
+    assert config['dataset']['args'].pop('augmentation') is not None
+    assert config['data_loader']['args'].pop('sequence_lanes')
+    del base['dataset']['args']['augmentation'], base['data_loader']['args']['sequence_lanes']
+    config['name'] = base['name']
+    assert config == base
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import ConcatDataset
+
+from dataset.dataloader import (BaseDataLoader, SequenceLaneBatchSampler, build_data_loaders, collate_events,
+                                sequence_chunks, sequence_starts)
+from dataset.representations import VoxelGrid, compact_voxel_grid
+from dataset.sequence import Sequence
+from parse_config import ConfigParser
+
+
+def compact_events(rng, num_events, height, width):
+    x = rng.uniform(-1, width, num_events).astype('float32')
+    y = rng.uniform(-1, height, num_events).astype('float32')
+    p = rng.integers(0, 2, num_events)
+    t = np.sort(rng.integers(0, 50_000, num_events))
+    return Sequence.events_to_compact(x, y, p, t)
+
+
+def test_collate_events_and_convert_batch_match_convert(rng):
+    height, width = 24, 32
+    voxel_grid = VoxelGrid(5, height, width, normalize=True)
+    samples = [compact_events(rng, num_events, height, width) for num_events in [300, 2, 0, 1000]]
+    batch = collate_events([{'index': i, 'representation': {'left': events}} for i, events in enumerate(samples)])
+
+    packed = batch['representation']['left']
+    assert packed['offsets'].tolist() == [0, 300, 302, 302, 1302]
+    assert batch['index'].tolist() == [0, 1, 2, 3]
+    grids = voxel_grid.convert_batch(packed['x'], packed['y'], packed['p'].float(), packed['t'], packed['offsets'])
+    for events, grid in zip(samples, grids):
+        expected = voxel_grid.convert(events['x'], events['y'], events['p'].float(), events['t'])
+        assert torch.equal(grid, expected)
+
+
+def test_build_data_loaders_of_configs_without_dataset_section(dsec_dir, tmp_path):
+    config = ConfigParser({
+        'name': 'test',
+        'dsec_dir': str(dsec_dir),
+        'data_loader': {'args': {'batch_size': 2, 'shuffle': True, 'validation_split': 0.2, 'num_workers': 0}},
+        'trainer': {'save_dir': str(tmp_path / 'saved')},
+    }, run_id='run')
+    data_loader, valid_data_loader = build_data_loaders(config)
+    # 2 sequences of 5 samples
+    assert data_loader.n_samples == 8 and len(valid_data_loader.sampler) == 2
+    batch = next(iter(data_loader))
+    assert batch['representation']['left'].shape == (2, 15, 480, 640)
+    assert batch['disparity_gt'].shape == (2, 480, 640)
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_sparse_grids_densify_to_the_dense_grids(rng, dtype):
+    height, width = 24, 32
+    voxel_grid = VoxelGrid(5, height, width, normalize=True)
+    grids = [voxel_grid.convert(*(events[k].float() for k in ['x', 'y', 'p', 't']))
+             for events in (compact_events(rng, num_events, height, width) for num_events in [300, 0, 1000])]
+    batch = collate_events([{'index': i, 'representation': {'left': compact_voxel_grid(grid, dtype, sparse=True)}}
+                            for i, grid in enumerate(grids)])
+
+    packed = batch['representation']['left']
+    dense = voxel_grid.densify_batch(packed['indices'], packed['values'], packed['offsets'])
+    for grid, dense_grid in zip(grids, dense):
+        assert torch.equal(dense_grid, compact_voxel_grid(grid, dtype).float())
+
+
+class Windows:
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return index
+
+
+def test_sequence_lanes_read_chunks_aligned_to_the_sequences(rng):
+    dataset = ConcatDataset([Windows(73), Windows(120), Windows(37)])
+    starts = sequence_starts(dataset)
+    indices = np.sort(rng.choice(len(dataset), 180, replace=False))
+    sampler = SequenceLaneBatchSampler(dataset, indices, 4, chunk_length=50)
+    assert np.array_equal(np.concatenate(sampler.chunks), indices)
+    for chunk in sampler.chunks:
+        seq_ids = np.searchsorted(starts, chunk, side='right') - 1
+        assert (np.diff(chunk) == 1).all() and (seq_ids == seq_ids[0]).all()
+        assert len(set((chunk - starts[seq_ids]) // 50)) == 1
+
+    batches = list(sampler)
+    assert len(batches) == 180 // 4 and all(len(batch) == 4 for batch in batches)
+    lanes = np.array(batches).T
+    assert sorted(lanes.flatten().tolist()) == sorted(set(lanes.flatten().tolist()))
+    # A lane only jumps between chunks
+    chunk_of = {index: i for i, chunk in enumerate(sampler.chunks) for index in chunk}
+    for lane in lanes:
+        jumps = np.flatnonzero(np.diff(lane) != 1)
+        assert all(chunk_of[lane[j]] != chunk_of[lane[j + 1]] for j in jumps)
+
+
+def test_lane_validation_split_keeps_chunks_together():
+    dataset = ConcatDataset([Windows(73), Windows(120), Windows(37)])
+    loader = BaseDataLoader(dataset, 4, True, 0.2, 0, True, sequence_lanes=True, lane_chunk_length=50)
+    train_idx = np.concatenate(loader.batch_sampler.chunks)
+    valid_idx = loader.valid_sampler.indices
+    assert len(set(train_idx) & set(valid_idx)) == 0 and len(train_idx) + len(valid_idx) == len(dataset)
+    chunks = sequence_chunks(dataset, 50)
+    for chunk in chunks:
+        assert set(chunk) <= set(train_idx) or set(chunk) <= set(valid_idx)
@@ -0,0 +1,13 @@
+import numpy as np
+
+from dataset.sequence import Sequence, SequenceOptions
+from utils.disparitystore import pack_disparity_dir
+
+
+def test_memmap_ground_truth_matches_png(dsec_dir):
+    seq_path = dsec_dir / 'train' / 'seq_a'
+    pack_disparity_dir(seq_path / 'disparity')
+    png_sequence = Sequence(seq_path, options=SequenceOptions(locations=['left']))
+    memmap_sequence = Sequence(seq_path, options=SequenceOptions(locations=['left'], gt_backend='memmap'))
+    for index in range(len(png_sequence)):
+        np.testing.assert_array_equal(memmap_sequence[index]['disparity_gt'], png_sequence[index]['disparity_gt'])
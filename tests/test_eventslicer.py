@@ -0,0 +1,41 @@
+import h5py
+import numpy as np
+
+from utils.eventslicer import EventSlicer
+
+
+def random_windows(rng, t_offset, num_windows, duration_us, max_length_us=30_000):
+    t_starts = t_offset + rng.integers(0, duration_us, num_windows)
+    t_ends = t_starts + rng.integers(1, max_length_us, num_windows)
+    return t_starts, t_ends
+
+
+def assert_same_events(events, expected):
+    for key in ['p', 'x', 'y', 't']:
+        np.testing.assert_array_equal(np.asarray(events[key], dtype='int64'), np.asarray(expected[key], dtype='int64'))
+
+
+def test_get_events_matches_timestamps(event_file, rng):
+    h5_path, events, t_offset = event_file
+    with h5py.File(str(h5_path), 'r') as h5f:
+        slicer = EventSlicer(h5f)
+        for t_start, t_end in zip(*random_windows(rng, t_offset, 50, 150_000)):
+            window = slicer.get_events(t_start, t_end)
+            mask = (events['t'] >= t_start) & (events['t'] < t_end)
+            assert_same_events(window, {key: value[mask] for key, value in events.items()})
+
+
+def test_get_events_batch_matches_get_events(event_file, rng):
+    h5_path, _, t_offset = event_file
+    t_starts, t_ends = random_windows(rng, t_offset, 200, 250_000)
+    with h5py.File(str(h5_path), 'r') as h5f:
+        slicer = EventSlicer(h5f)
+        events, offsets = slicer.get_events_batch(t_starts, t_ends)
+        assert offsets.shape == (t_starts.size, 2)
+        for i, (t_start, t_end) in enumerate(zip(t_starts, t_ends)):
+            expected = slicer.get_events(t_start, t_end)
+            if expected is None:
+                assert tuple(offsets[i]) == (-1, -1)
+                continue
+            start, end = offsets[i]
+            assert_same_events({key: value[start:end] for key, value in events.items()}, expected)
@@ -0,0 +1,68 @@
+import h5py
+import numpy as np
+import pytest
+
+from conftest import random_events, write_event_file
+from test_eventslicer import assert_same_events, random_windows
+from utils.eventslicer import EventSlicer, merge_window_ranges
+from utils.eventstore import MemmapEventSlicer, pack_event_file
+
+
+def test_merge_window_ranges(rng):
+    ms_to_idx = np.searchsorted(np.sort(rng.integers(0, 100_000, 5000)), np.arange(101) * 1000)
+    t_starts = rng.integers(0, 110_000, 300)
+    t_ends = t_starts + rng.integers(1, 5000, 300)
+    merged = merge_window_ranges(ms_to_idx, t_starts, t_ends)
+
+    # Windows ending after the last millisecond are dropped
+    retrievable = -(-t_ends // 1000) < ms_to_idx.size
+    np.testing.assert_array_equal(np.sort(merged.window_ids), np.flatnonzero(retrievable))
+    # Merged ranges are sorted, disjoint and not adjacent, and read one after the other
+    assert np.all(merged.starts[1:] > merged.ends[:-1])
+    np.testing.assert_array_equal(merged.buffer_starts, np.cumsum(merged.ends - merged.starts) - (merged.ends - merged.starts))
+    assert merged.num_events == int((merged.ends - merged.starts).sum())
+    # The conservative range of every window lies within its merged range
+    lo = ms_to_idx[t_starts[merged.window_ids] // 1000]
+    hi = ms_to_idx[-(-t_ends[merged.window_ids] // 1000)]
+    assert np.all(merged.starts[merged.window_ranges] <= lo)
+    assert np.all(hi <= merged.ends[merged.window_ranges])
+
+
+@pytest.mark.parametrize('t_encoding', ['int64', 'delta'])
+def test_memmap_slicer_matches_event_slicer(event_file, rng, t_encoding):
+    h5_path, _, t_offset = event_file
+    pack_event_file(h5_path, h5_path.parent, t_encoding, chunk_size=3000)
+    memmap_slicer = MemmapEventSlicer(h5_path.parent)
+    t_starts, t_ends = random_windows(rng, t_offset, 100, 250_000)
+    with h5py.File(str(h5_path), 'r') as h5f:
+        slicer = EventSlicer(h5f)
+        assert memmap_slicer.get_start_time_us() == slicer.get_start_time_us()
+        assert memmap_slicer.get_final_time_us() == slicer.get_final_time_us()
+        events, offsets = memmap_slicer.get_events_batch(t_starts, t_ends)
+        for i, (t_start, t_end) in enumerate(zip(t_starts, t_ends)):
+            expected = slicer.get_events(t_start, t_end)
+            window = memmap_slicer.get_events(t_start, t_end)
+            if expected is None:
+                assert window is None and tuple(offsets[i]) == (-1, -1)
+                continue
+            assert_same_events(window, expected)
+            start, end = offsets[i]
+            assert_same_events({key: value[start:end] for key, value in events.items()}, expected)
+        assert_same_events(memmap_slicer.get_events_by_index(100, 15_000), slicer.get_events_by_index(100, 15_000))
+
+
+def test_delta_encoding_after_last_millisecond(tmp_path, rng):
+    t, x, y, p = random_events(rng, 5000, 50_000)
+    # ms_to_idx stops 20 ms before the last events
+    write_event_file(tmp_path / 'events.h5', t, x, y, p, t_offset=7, num_ms=30)
+    pack_event_file(tmp_path / 'events.h5', tmp_path, 'delta', chunk_size=1000)
+    slicer = MemmapEventSlicer(tmp_path)
+    np.testing.assert_array_equal(slicer.get_events_by_index(0, t.size)['t'], t + 7)
+    assert slicer.get_final_time_us() == t[-1] + 7
+
+
+def test_delta_encoding_out_of_range(tmp_path, rng):
+    t, x, y, p = random_events(rng, 5000, 200_000)
+    write_event_file(tmp_path / 'events.h5', t, x, y, p, num_ms=50)
+    with pytest.raises(ValueError, match='int64'):
+        pack_event_file(tmp_path / 'events.h5', tmp_path, 'delta')
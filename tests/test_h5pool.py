@@ -0,0 +1,37 @@
+import h5py
+
+from test_eventslicer import assert_same_events
+from utils.eventslicer import EventSlicer
+from utils.h5pool import H5FilePool
+
+
+def test_pool_bounds_open_files(event_file, tmp_path):
+    h5_path, events, t_offset = event_file
+    other_path = tmp_path / 'other.h5'
+    with h5py.File(str(other_path), 'w') as h5f:
+        h5f.create_dataset('data', data=[1, 2, 3])
+
+    pool = H5FilePool(max_open_files=1)
+    slicer = EventSlicer(pool.open(h5_path))
+    other = pool.open(other_path)
+    for _ in range(3):
+        # Every access to the other file evicts the events file, which is reopened on demand
+        assert other['data'][()].tolist() == [1, 2, 3]
+        window = slicer.get_events(t_offset + 10_000, t_offset + 20_000)
+        mask = (events['t'] >= t_offset + 10_000) & (events['t'] < t_offset + 20_000)
+        assert_same_events(window, {key: value[mask] for key, value in events.items()})
+        assert len(pool._files) == 1
+    assert pool.num_opened == 7
+    pool.close()
+
+
+def test_pool_reopens_files_after_fork(event_file):
+    h5_path = event_file[0]
+    pool = H5FilePool()
+    h5f = pool.get(str(h5_path))
+    # As seen from a forked process: inherited handles are dropped, not closed
+    pool._pid = -1
+    assert pool.get(str(h5_path)) is not h5f
+    assert h5f.id.valid
+    h5f.close()
+    pool.close()
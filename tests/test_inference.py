@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import torch
+
+from model.loss import depth_targets, from_log_to_depth, get_projectmat
+from utils.inference import dataset_args, depth_to_disparity_16bit
+
+
+def disparity_of_depth(depth, Q):
+    """Disparity of depth, rounded to the 1/256 steps of DSEC PNGs"""
+    disparity = Q[2, 3] / (depth * Q[3, 2]) + Q[3, 3]
+    return torch.round(disparity * 256) / 256
+
+
+@pytest.mark.parametrize('far_depth', [30.0, 120.0])
+def test_depth_to_disparity_16bit_inverts_depth_targets(rng, far_depth):
+    Q = get_projectmat().float()
+    depth = torch.from_numpy(rng.uniform(4, 25, (2, 16, 20)).astype('float32'))
+    depth[:, 0, 0] = far_depth
+    disparity = disparity_of_depth(depth, Q)
+    disparity[:, 5:8, 5:8] = 0
+    targets = depth_targets(disparity, Q)
+    max_depth = torch.amax(targets.depth, dim=(1, 2), keepdim=True)
+
+    disparity_16bit = depth_to_disparity_16bit(targets.log_depth, Q, max_depth)
+    # Depth is clamped at 80 m, farther pixels cannot be recovered
+    check = targets.valid & (targets.depth < 80)
+    expected = torch.round(disparity * 256).numpy()
+    assert np.abs(disparity_16bit[check.numpy()].astype('int64') - expected[check.numpy()]).max() <= 1
+    if far_depth > 80:
+        assert np.array_equal(depth_to_disparity_16bit(targets.log_depth, Q), disparity_16bit)
+    else:
+        # The prediction is depth relative to the farthest pixel, not metric depth
+        wrong = Q[2, 3] / (from_log_to_depth(targets.log_depth) * Q[3, 2]) + Q[3, 3]
+        assert not np.allclose(torch.round(wrong * 256).numpy()[check.numpy()], expected[check.numpy()], atol=1)
+
+
+def test_dataset_args_of_configs_without_dataset_section():
+    config = {'data_loader': {'args': {'batch_size': 2}}}
+    assert dataset_args(config)['delta_t_ms'] == 50
+    assert dataset_args(config)['num_bins'] == 15
+    assert dataset_args({'dataset': {'args': {'delta_t_ms': 20, 'num_bins': 5}}})['num_bins'] == 5
+
+
+def test_load_model_of_checkpoints_without_dataset_section(tmp_path):
+    import model.unet as module_arch
+    from utils.inference import load_model
+
+    config = {'arch': {'type': 'MonoDepthNet', 'args': {'n_channels': 15}},
+              'data_loader': {'args': {'batch_size': 2}}}
+    model = module_arch.MonoDepthNet(n_channels=15)
+    state_dict = {'module.' + k: v for k, v in model.state_dict().items()}
+    torch.save({'arch': 'MonoDepthNet', 'state_dict': state_dict, 'config': config}, str(tmp_path / 'model_best.pth'))
+
+    loaded, loaded_config = load_model(tmp_path / 'model_best.pth', 'cpu', config)
+    assert not loaded.training
+    assert all(torch.equal(v, model.state_dict()[k]) for k, v in loaded.state_dict().items())
+    assert dataset_args(loaded_config)['num_bins'] == 15
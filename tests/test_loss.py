@@ -0,0 +1,72 @@
+import pytest
+import torch
+
+import model.loss
+from model.loss import DepthLoss, depth_targets, get_log_depth_gt, get_projectmat, loss, multi_grad_loss
+from model.pytorch_ssim import SSIM
+
+
+def baseline_loss(output, target):
+    """loss of the first release (on the CPU), with its per-call Q, buffers and per-scale targets"""
+    Q = get_projectmat()
+    valid_idx = target != 0
+    valid_num = torch.count_nonzero(valid_idx)
+    depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
+    log_depth_target = get_log_depth_gt(depth_target, valid_idx)
+    depth_output = output.reshape(log_depth_target.shape)
+
+    grad_loss = multi_grad_loss(depth_output, depth_target, valid_idx, valid_num)
+    target_s, output_s = target, depth_output
+    for _ in range(3):
+        target_s, output_s = target_s[:, ::2, ::2], output_s[:, ::2, ::2]
+        valid_idx_s = target_s != 0
+        depth_target_s = Q[2, 3] / ((target_s - Q[3, 3])*Q[3,2])
+        grad_loss = grad_loss + multi_grad_loss(output_s, depth_target_s, valid_idx_s, torch.count_nonzero(valid_idx_s))
+
+    R_k = torch.zeros(target.shape)
+    ssim_target = torch.zeros(target.shape)
+    ssim_output = torch.zeros(target.shape)
+    ssim_target[valid_idx] = log_depth_target[valid_idx]
+    ssim_output[valid_idx] = depth_output[valid_idx]
+    ssim_val = 1 - SSIM()(ssim_target.unsqueeze(0), ssim_output.unsqueeze(0))
+    R_k[valid_idx] = log_depth_target[valid_idx] - depth_output[valid_idx]
+    loss_invar = ((1 / valid_num) * torch.sum(R_k ** 2)) - (
+        ((1 / valid_num) ** 2) * (torch.sum(R_k) ** 2)
+    )
+    return loss_invar + 0.5 * grad_loss + 0.05*ssim_val
+
+
+def disparity_batch(rng, batch_size=2, height=60, width=80):
+    disparity = torch.from_numpy(rng.uniform(1, 60, (batch_size, height, width)).astype('float32'))
+    disparity[torch.from_numpy(rng.random((batch_size, height, width)) < 0.6)] = 0
+    return disparity
+
+
+@pytest.mark.parametrize('criterion', [loss, DepthLoss()])
+def test_loss_matches_the_baseline_loss(rng, criterion):
+    disparity = disparity_batch(rng)
+    output = torch.from_numpy(rng.uniform(0, 1, (2, 1, 60, 80)).astype('float32'))
+    expected = baseline_loss(output, disparity)
+    assert torch.allclose(criterion(output, disparity), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_loss_gradient_matches_the_baseline_loss(rng):
+    disparity = disparity_batch(rng)
+    output = torch.from_numpy(rng.uniform(0, 1, (2, 1, 60, 80)).astype('float32')).requires_grad_()
+    baseline_output = output.detach().clone().requires_grad_()
+    loss(output, disparity).backward()
+    baseline_loss(baseline_output, disparity).backward()
+    assert torch.allclose(output.grad, baseline_output.grad, rtol=1e-3, atol=1e-7)
+
+
+def test_loss_uses_the_fields_of_depth_targets(rng, monkeypatch):
+    disparity = disparity_batch(rng)
+    output = torch.from_numpy(rng.uniform(0, 1, (2, 1, 60, 80)).astype('float32'))
+    targets = depth_targets(disparity, get_projectmat().float())
+    expected = loss(output, disparity)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the targets are derived again')
+
+    monkeypatch.setattr(model.loss, 'depth_targets', fail)
+    assert torch.allclose(loss(output, targets), expected)
@@ -0,0 +1,19 @@
+import torch
+
+from dataset.manifest import DatasetManifest
+from dataset.sequence import Sequence
+
+
+def test_manifest_samples_match_sequence_samples(dsec_dir, tmp_path):
+    train_path = dsec_dir / 'train'
+    manifest = DatasetManifest(train_path, 50, tmp_path / 'manifest', num_workers=0)
+    for seq_path in sorted(train_path.iterdir()):
+        sequence = Sequence(seq_path)
+        manifest_sequence = Sequence(seq_path, manifest=manifest.get(seq_path))
+        assert len(manifest_sequence) == len(sequence)
+        for index in range(len(sequence)):
+            sample, manifest_sample = sequence[index], manifest_sequence[index]
+            assert manifest_sample['file_index'] == sample['file_index']
+            assert (manifest_sample['disparity_gt'] == sample['disparity_gt']).all()
+            for location in ['left', 'right']:
+                assert torch.equal(manifest_sample['representation'][location], sample['representation'][location])
@@ -0,0 +1,104 @@
+import math
+
+import pytest
+import torch
+
+from model import metric
+from model.loss import depth_targets, from_log_to_depth, get_log_depth_gt, get_projectmat
+from model.pytorch_ssim import SSIM
+
+
+def baseline_normalized_depth(target, max_depth=None):
+    """Normalized depth of the first release's metrics, and the pixels they are computed on"""
+    Q = get_projectmat()
+    invalid_idx = target == 0
+    depth_target = Q[2, 3] / ((target - Q[3, 3])*Q[3,2])
+    depth_target = torch.clamp(depth_target,0,80)
+    depth_target[invalid_idx] = 0
+    if max_depth is not None:
+        invalid_idx = invalid_idx + (depth_target > max_depth)
+    depth_target = depth_target/torch.amax(torch.amax(depth_target,1,keepdims=True),2,keepdims=True)
+    depth_target *= 80
+    return depth_target, ~invalid_idx
+
+
+def baseline_mean_error(output, target, power, max_depth=None):
+    """mean_square_error, mean_absolute_error and mean_absolute_error_<d> of the first release"""
+    depth_target, valid_idx = baseline_normalized_depth(target, max_depth)
+    depth_output = from_log_to_depth(output.reshape(depth_target.shape))
+    diffMatrix = torch.abs(depth_output - depth_target)
+    diffMatrix[~valid_idx]=0
+    return torch.sum(torch.pow(diffMatrix, power)) / torch.count_nonzero(valid_idx)
+
+
+def baseline_ssim(output, target, log):
+    """log_ssim_error and ssim_error of the first release"""
+    depth_target, valid_idx = baseline_normalized_depth(target)
+    if log:
+        Q = get_projectmat()
+        depth_target = get_log_depth_gt(Q[2, 3] / ((target - Q[3, 3])*Q[3,2]), valid_idx)
+        depth_output = output.reshape(depth_target.shape).clone()
+    else:
+        depth_output = from_log_to_depth(output.reshape(depth_target.shape)).clone()
+    depth_output[~valid_idx]=0
+    return 1 - SSIM()(depth_target.unsqueeze(0), depth_output.unsqueeze(0))
+
+
+def reference_errors(output, target):
+    """Every entry of depth_error_table, one metric at a time over the valid pixels"""
+    targets = depth_targets(target, get_projectmat().float())
+    gt = targets.normalized_depth[targets.valid].double()
+    pred = from_log_to_depth(output.reshape(target.shape)[targets.valid]).double()
+    ratio = torch.maximum(pred / gt, gt / pred)
+    errors = {
+        'mae': torch.mean(torch.abs(pred - gt)),
+        'mse': torch.mean((pred - gt) ** 2),
+        'rmse': torch.sqrt(torch.mean((pred - gt) ** 2)),
+        'abs_rel': torch.mean(torch.abs(pred - gt) / gt),
+        'sq_rel': torch.mean((pred - gt) ** 2 / gt),
+        'log10': torch.mean(torch.abs(torch.log10(pred) - torch.log10(gt))),
+    }
+    for n in [1, 2, 3]:
+        errors['delta{}'.format(n)] = torch.mean((ratio <= 1.25 ** n).double())
+    depth = targets.depth[targets.valid].double()
+    for max_depth in metric.MAX_DEPTHS:
+        near = depth <= max_depth
+        errors['mae_{}'.format(max_depth)] = torch.mean(torch.abs(pred - gt)[near])
+        errors['rmse_{}'.format(max_depth)] = torch.sqrt(torch.mean(((pred - gt) ** 2)[near]))
+    return errors
+
+
+@pytest.fixture
+def batch(rng):
+    disparity = torch.from_numpy(rng.uniform(2, 60, (2, 60, 80)).astype('float32'))
+    disparity[torch.from_numpy(rng.random((2, 60, 80)) < 0.5)] = 0
+    output = torch.from_numpy(rng.uniform(0.3, 1, (2, 1, 60, 80)).astype('float32'))
+    return output, disparity
+
+
+def test_depth_error_table_matches_each_metric(batch):
+    output, disparity = batch
+    table = metric.depth_error_table(output, disparity)
+    expected = reference_errors(output, disparity)
+    assert set(table) == set(expected)
+    for key, value in expected.items():
+        assert math.isclose(float(table[key]), float(value), rel_tol=1e-4, abs_tol=1e-6), key
+
+
+def test_metrics_match_the_first_release(batch):
+    output, disparity = batch
+    targets = depth_targets(disparity, get_projectmat().float())
+    assert torch.allclose(metric.mean_square_error(output, targets), baseline_mean_error(output, disparity, 2), rtol=1e-4)
+    assert torch.allclose(metric.mean_absolute_error(output, targets), baseline_mean_error(output, disparity, 1), rtol=1e-4)
+    for max_depth in metric.MAX_DEPTHS:
+        error = getattr(metric, 'mean_absolute_error_{}'.format(max_depth))(output, targets)
+        assert torch.allclose(error, baseline_mean_error(output, disparity, 1, max_depth), rtol=1e-4)
+    assert torch.allclose(metric.log_ssim_error(output, targets), baseline_ssim(output, disparity, log=True), atol=1e-5)
+    assert torch.allclose(metric.ssim_error(output, targets), baseline_ssim(output, disparity, log=False), atol=1e-5)
+
+
+def test_metrics_read_the_shared_table(batch):
+    output, disparity = batch
+    table = metric.depth_error_table(output, disparity)
+    for name, key in metric.ERROR_TABLE_KEYS.items():
+        assert getattr(metric, name)(output, disparity, table=table) is table[key]
@@ -0,0 +1,32 @@
+import torch
+
+from utils import MetricTracker
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.step = 0
+        self.mode = 'train'
+        self.scalars = []
+
+    def add_scalar_at(self, key, value, step, mode):
+        self.scalars.append((key, value, step, mode))
+
+
+def test_metric_tracker_averages_and_writes_every_update_in_batches():
+    writer = RecordingWriter()
+    tracker = MetricTracker('loss', 'mae', writer=writer, flush_steps=3)
+    expected = []
+    for step in range(5):
+        writer.step = step
+        tracker.update('loss', torch.tensor(float(step)))
+        tracker.update('mae', 2.0 * step, n=2)
+        expected += [('loss', float(step), step, 'train'), ('mae', 2.0 * step, step, 'train')]
+        # Nothing is written before flush_steps steps
+        assert len(writer.scalars) == (6 if step >= 2 else 0)
+    assert tracker.result() == {'loss': 2.0, 'mae': 4.0}
+    assert writer.scalars == expected
+    assert tracker.avg('mae') == 4.0
+
+    tracker.reset()
+    assert tracker.result() == {'loss': 0.0, 'mae': 0.0}
@@ -0,0 +1,18 @@
+import pytest
+
+from dataset.provider import DatasetProvider
+
+
+def test_dataset_provider_passes_the_options_to_its_sequences(dsec_dir):
+    dataset = DatasetProvider(dsec_dir, locations=['left'], load_gt=False, voxel_sparse=True).get_train_dataset()
+    assert len(dataset) == 10
+    sample = dataset[7]
+    assert 'disparity_gt' not in sample
+    assert list(sample['representation']) == ['left']
+    assert set(sample['representation']['left']) == {'indices', 'values'}
+    assert [sequence.sequence_id for sequence in dataset.datasets] == [0, 1]
+
+
+def test_dataset_provider_rejects_unknown_options(dsec_dir):
+    with pytest.raises(TypeError, match='voxel_backnd'):
+        DatasetProvider(dsec_dir, voxel_backnd='numba')
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import torch
+
+from dataset.rectify_voxel import RectifiedVoxelGrid
+from dataset.representations import VoxelGrid
+from dataset.sequence import Sequence, SequenceOptions
+
+
+@pytest.mark.parametrize('num_threads', [1, 2])
+@pytest.mark.parametrize('normalize', [True, False])
+def test_rectified_voxel_grid_matches_rectify_and_convert(rng, num_threads, normalize):
+    height, width, num_bins = 24, 32, 5
+    xx, yy = np.meshgrid(np.arange(width, dtype='float32'), np.arange(height, dtype='float32'))
+    rectify_map = np.stack([xx + rng.uniform(-1.5, 1.5, xx.shape), yy + rng.uniform(-1.5, 1.5, yy.shape)], axis=-1)
+    x = rng.integers(0, width, 5000).astype('uint16')
+    y = rng.integers(0, height, 5000).astype('uint16')
+    p = rng.integers(0, 2, 5000).astype('uint8')
+    t = np.sort(rng.integers(0, 50_000, 5000)).astype('int64') + 1_600_000_000_000_000
+
+    grid = RectifiedVoxelGrid(rectify_map, num_bins, normalize=normalize, num_threads=num_threads).convert(x, y, p, t)
+
+    xy_rect = rectify_map.astype('float32')[y, x]
+    t_norm = (t - t[0]).astype('float32')
+    t_norm = t_norm / t_norm[-1]
+    expected = VoxelGrid(num_bins, height, width, normalize=normalize).convert(
+            torch.from_numpy(xy_rect[:, 0]), torch.from_numpy(xy_rect[:, 1]),
+            torch.from_numpy(p.astype('float32')), torch.from_numpy(t_norm))
+    assert torch.allclose(grid, expected, atol=1e-4, rtol=1e-4)
+
+
+def test_sequence_numba_backend_matches_torch(dsec_dir):
+    seq_path = dsec_dir / 'train' / 'seq_a'
+    torch_sample = Sequence(seq_path, options=SequenceOptions(locations=['left'], load_gt=False))[1]
+    numba_sample = Sequence(seq_path, options=SequenceOptions(
+            locations=['left'], load_gt=False, voxel_backend='numba'))[1]
+    assert torch.allclose(numba_sample['representation']['left'], torch_sample['representation']['left'], atol=1e-4)
@@ -0,0 +1,20 @@
+import torch
+
+from benchmarks.voxel_grid import random_events, reference_convert
+from dataset.representations import VoxelGrid
+
+
+def test_voxel_grid_convert_is_bit_identical_to_reference():
+    height, width, num_bins = 48, 64, 5
+    representation = VoxelGrid(num_bins, height, width, normalize=True)
+    template = torch.zeros((num_bins, height, width), dtype=torch.float)
+    for num_events in [2, 1000, 20_000]:
+        events = random_events(num_events, height, width, seed=num_events)
+        assert torch.equal(representation.convert(*events), reference_convert(template, True, *events))
+        unnormalized = VoxelGrid(num_bins, height, width, normalize=False).convert(*events)
+        assert torch.equal(unnormalized, reference_convert(template, False, *events))
+
+
+def test_voxel_grid_convert_without_events():
+    voxel_grid = VoxelGrid(5, 4, 6, normalize=True).convert(*[torch.zeros(0)] * 4)
+    assert voxel_grid.shape == (5, 4, 6) and not voxel_grid.any()
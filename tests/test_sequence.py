@@ -0,0 +1,19 @@
+import numpy as np
+import torch
+
+from dataset.sequence import Sequence, SequenceOptions
+
+
+def test_sequence_outputs_are_declared(dsec_dir):
+    seq_path = dsec_dir / 'train' / 'seq_a'
+    sample = Sequence(seq_path)[2]
+    assert sorted(sample['representation']) == ['left', 'right']
+    assert sample['representation']['left'].shape == (15, 480, 640)
+    assert sample['disparity_gt'].shape == (480, 640)
+
+    sequence = Sequence(seq_path, options=SequenceOptions(locations=['left'], load_gt=False))
+    left_only = sequence[2]
+    assert 'disparity_gt' not in left_only
+    assert list(left_only['representation']) == ['left']
+    assert torch.equal(left_only['representation']['left'], sample['representation']['left'])
+    assert left_only['file_index'] == sample['file_index'] == 6
@@ -0,0 +1,64 @@
+import h5py
+import numpy as np
+import pytest
+import torch
+
+from conftest import random_events, write_event_file
+from dataset.representations import VoxelGrid
+from dataset.sequence import Sequence, SequenceOptions
+from dataset.sliding_voxel_grid import SlidingVoxelGrid
+from utils.eventslicer import EventSlicer
+
+HEIGHT, WIDTH = 24, 32
+T_OFFSET = 1_600_000_000_000_000
+
+
+def window_voxel_grid(events, rectify_map, num_bins, t_start_us, t_end_us, normalize):
+    """VoxelGrid.convert of the rectified events of [t_start_us, t_end_us), binned over the window"""
+    mask = (events['t'] >= t_start_us) & (events['t'] < t_end_us)
+    x, y, p, t = (events[key][mask] for key in ['x', 'y', 'p', 't'])
+    xy_rect = rectify_map[y, x]
+    return VoxelGrid(num_bins, HEIGHT, WIDTH, normalize=normalize).convert(
+            torch.from_numpy(np.ascontiguousarray(xy_rect[:, 0])),
+            torch.from_numpy(np.ascontiguousarray(xy_rect[:, 1])),
+            torch.from_numpy(p.astype('float32')),
+            torch.from_numpy((t - t_start_us).astype('float32')),
+            time_window=(0, t_end_us - t_start_us))
+
+
+@pytest.fixture
+def small_events(tmp_path, rng):
+    t, x, y, p = random_events(rng, 30_000, 300_000, HEIGHT, WIDTH)
+    h5_path = tmp_path / 'events.h5'
+    write_event_file(h5_path, t, x, y, p, T_OFFSET)
+    xx, yy = np.meshgrid(np.arange(WIDTH, dtype='float32'), np.arange(HEIGHT, dtype='float32'))
+    rectify_map = np.stack([xx + rng.uniform(-1.5, 1.5, xx.shape), yy + rng.uniform(-1.5, 1.5, yy.shape)], axis=-1)
+    return h5_path, {'t': t + T_OFFSET, 'x': x, 'y': y, 'p': p}, rectify_map.astype('float32')
+
+
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('stride_us', [10_000, 50_000, 25_000])
+def test_sliding_voxel_grid_matches_convert_of_every_window(small_events, normalize, stride_us):
+    h5_path, events, rectify_map = small_events
+    num_bins, delta_t_us = 15, 50_000
+    with h5py.File(str(h5_path), 'r') as h5f:
+        sliding = SlidingVoxelGrid(EventSlicer(h5f), num_bins, HEIGHT, WIDTH, delta_t_us, stride_us,
+                                   normalize=normalize, rectify_map=rectify_map)
+        # Overlapping windows, then a window off the sub-interval grid that restarts
+        t_ends = [T_OFFSET + delta_t_us + i * stride_us for i in range(5)] + [T_OFFSET + 123_457]
+        for t_end in t_ends:
+            expected = window_voxel_grid(events, rectify_map, num_bins, t_end - delta_t_us, t_end, normalize)
+            assert torch.allclose(sliding.get(t_end), expected, atol=1e-4, rtol=1e-4), t_end
+
+
+def test_sequence_time_window_matches_sliding_voxel_grid(dsec_dir):
+    seq_path = dsec_dir / 'train' / 'seq_a'
+    sequence = Sequence(seq_path, options=SequenceOptions(locations=['left'], load_gt=False, time_window=True))
+    default_grid = Sequence(seq_path, options=SequenceOptions(locations=['left'], load_gt=False))[2]['representation']['left']
+    with h5py.File(str(seq_path / 'events' / 'left' / 'events.h5'), 'r') as h5f:
+        sliding = SlidingVoxelGrid(EventSlicer(h5f), 15, 480, 640, sequence.delta_t_us,
+                                   rectify_map=sequence.rectify_ev_maps['left'])
+        for index in [1, 2]:
+            grid = sequence[index]['representation']['left']
+            assert torch.allclose(grid, sliding.get(sequence.timestamps[index]), atol=1e-4, rtol=1e-4)
+    assert not torch.allclose(grid, default_grid, atol=1e-4, rtol=1e-4)
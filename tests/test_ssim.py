@@ -0,0 +1,58 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from model.pytorch_ssim import SSIM, SeparableSSIM, create_window, ssim
+
+
+def reference_ssim_map(img1, img2, window_size=11):
+    """SSIM map of _ssim, with the 2-D Gaussian window"""
+    channel = img1.shape[1]
+    window = create_window(window_size, channel)
+
+    def filtered(image):
+        return F.conv2d(image, window, padding=window_size // 2, groups=channel)
+
+    mu1, mu2 = filtered(img1), filtered(img2)
+    sigma1_sq = filtered(img1 * img1) - mu1 ** 2
+    sigma2_sq = filtered(img2 * img2) - mu2 ** 2
+    sigma12 = filtered(img1 * img2) - mu1 * mu2
+    C1 = 0.01**2
+    C2 = 0.03**2
+    return ((2 * mu1 * mu2 + C1) * (2 * sigma12 + C2)) / ((mu1 ** 2 + mu2 ** 2 + C1) * (sigma1_sq + sigma2_sq + C2))
+
+
+def images(rng, shape):
+    img1 = torch.from_numpy(rng.uniform(0, 1, shape).astype('float32'))
+    img2 = (img1 + torch.from_numpy(rng.normal(0, 0.1, shape).astype('float32'))).clamp(0, 1)
+    return img1, img2
+
+
+@pytest.mark.parametrize('shape', [(1, 1, 40, 50), (2, 3, 33, 21), (1, 2, 8, 8)])
+@pytest.mark.parametrize('window_size', [11, 7])
+def test_separable_ssim_matches_the_2d_window(rng, shape, window_size):
+    img1, img2 = images(rng, shape)
+    expected = ssim(img1, img2, window_size)
+    assert torch.allclose(SeparableSSIM(window_size)(img1, img2), expected, atol=1e-5)
+    per_image = SeparableSSIM(window_size, size_average=False)(img1, img2)
+    assert torch.allclose(per_image, ssim(img1, img2, window_size, size_average=False), atol=1e-5)
+
+
+def test_separable_ssim_masks_like_zeroed_images(rng):
+    img1, img2 = images(rng, (2, 1, 40, 50))
+    mask = torch.from_numpy(rng.random((2, 1, 40, 50)) < 0.6)
+    expected = SSIM()(torch.where(mask, img1, 0.0), torch.where(mask, img2, 0.0))
+    assert torch.allclose(SeparableSSIM()(img1, img2, mask), expected, atol=1e-5)
+
+    ssim_map = reference_ssim_map(torch.where(mask, img1, 0.0), torch.where(mask, img2, 0.0))
+    assert torch.allclose(SeparableSSIM(masked_average=True)(img1, img2, mask), ssim_map[mask].mean(), atol=1e-5)
+
+
+def test_separable_ssim_caches_its_window_per_dtype(rng):
+    img1, img2 = images(rng, (1, 1, 20, 20))
+    module = SeparableSSIM()
+    expected = module(img1, img2)
+    assert torch.allclose(module(img1.double(), img2.double()), expected.double(), atol=1e-6)
+    assert len(module._windows) == 1
+    module(img1.double(), img2.double())
+    assert len(module._windows) == 1
@@ -0,0 +1,38 @@
+import h5py
+import numpy as np
+import pytest
+
+from dataset.sequence import Sequence, SequenceOptions
+from dataset.synthetic import EventRateProfile, write_sequence
+from utils.eventslicer import EventSlicer
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'none'])
+def test_synthetic_sequence_has_the_dsec_layout(tmp_path, codec):
+    profile = EventRateProfile(rate=2e5, modulation=0.5, modulation_period_ms=100,
+                               burst_events=40_000, burst_length_ms=20, burst_period_ms=150, burst_start_ms=60)
+    seq_path = tmp_path / 'train' / 'synthetic_00_a'
+    num_events = write_sequence(seq_path, 300, profile, codec=codec, chunk_size=4096, block_ms=40)
+
+    with h5py.File(str(seq_path / 'events' / 'left' / 'events.h5'), 'r') as h5f:
+        t = h5f['events/t'][()].astype('int64')
+        ms_to_idx = h5f['ms_to_idx'][()]
+        assert t.size == num_events['left'] == h5f['events/x'].size == h5f['events/p'].size
+        assert (np.diff(t) >= 0).all() and t[-1] < 300_000
+        assert np.array_equal(ms_to_idx, np.searchsorted(t, np.arange(301) * 1000, side='left'))
+        # Poisson draws around the profile, bursts included
+        expected = profile.expected_counts(0, 300)
+        counts = np.diff(ms_to_idx)
+        assert abs(counts.sum() - expected.sum()) < 5 * np.sqrt(expected.sum())
+        assert counts[60:80].mean() > 5 * counts[20:40].mean()
+
+        slicer = EventSlicer(h5f)
+        events = slicer.get_events(slicer.get_start_time_us() + 100_000, slicer.get_start_time_us() + 150_000)
+        assert events['t'].size == ms_to_idx[150] - ms_to_idx[100]
+
+    sequence = Sequence(seq_path, options=SequenceOptions(locations=['left']))
+    assert len(sequence) == 3
+    sample = sequence[0]
+    assert sample['file_index'] == 2
+    assert sample['representation']['left'].shape == (15, 480, 640)
+    assert 0.2 < (sample['disparity_gt'] > 0).mean() < 0.4
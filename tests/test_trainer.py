@@ -0,0 +1,78 @@
+import torch
+from torch.utils.data import DataLoader
+
+from parse_config import ConfigParser
+from trainer.base_trainer import BaseTrainer
+
+
+def baseline_config(tmp_path):
+    """Configuration of a run started before the dataset section and n_channels existed"""
+    return {
+        'name': 'test',
+        'arch': {'type': 'MonoDepthNet', 'args': {}},
+        'trainer': {'epochs': 1, 'save_dir': str(tmp_path), 'save_period': 1, 'verbosity': 0,
+                    'monitor': 'off', 'tensorboard': False},
+    }
+
+
+def test_base_trainer_defaults_of_older_configs(tmp_path):
+    config = ConfigParser(baseline_config(tmp_path), run_id='run')
+    model = torch.nn.Linear(1, 1)
+    trainer = BaseTrainer(model, None, [], torch.optim.SGD(model.parameters(), lr=0.1), config)
+    assert trainer.voxel_grid.shape == (15, 480, 640)
+
+
+class StateRecorder(torch.nn.Module):
+    """Recurrent stand-in that records the state it is given and returns a nonzero one"""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.ones(1))
+        self.states = []
+
+    def forward(self, inputs, state=None):
+        self.states.append(state)
+        batch_size = inputs.shape[0]
+        h = torch.ones(batch_size, 1, 2, 2) * self.weight
+        return inputs[:, :1] * self.weight, [(h, h)]
+
+
+def lane_samples(num_samples):
+    return [{
+        'representation': {'left': torch.zeros(2, 8, 48)},
+        'disparity_gt': torch.ones(8, 48),
+        'sequence_id': torch.tensor(0),
+        'index': torch.tensor(index),
+    } for index in range(num_samples)]
+
+
+def test_lstm_trainer_carries_state_over_shuffled_batches(tmp_path):
+    from trainer.trainer import LSTMTrainer
+
+    config = ConfigParser(baseline_config(tmp_path), run_id='run')
+    model = StateRecorder()
+    # Consecutive samples never continue each other's windows in a batch of 2
+    loader = DataLoader(lane_samples(6)[::-1], batch_size=2)
+    trainer = LSTMTrainer(model, lambda output, target: output.mean() + model.weight.sum(), [],
+                          torch.optim.SGD(model.parameters(), lr=0.1), config, 'cpu', loader,
+                          valid_data_loader=loader)
+    trainer._train_epoch(1)
+    train_states, valid_states = model.states[:3], model.states[3:]
+    assert train_states[0] is None
+    assert all(state is not None and not state[0][0].requires_grad for state in train_states[1:])
+    assert valid_states == [None] * 3
+
+
+def test_reset_lanes_zeroes_the_lanes_that_do_not_continue():
+    from trainer.trainer import LSTMTrainer
+
+    state = [(torch.ones(2, 1, 2, 2), torch.ones(2, 1, 2, 2))]
+    keys = torch.tensor([[0, 3], [1, 7]])
+    data = {'sequence_id': torch.tensor([0, 1]), 'index': torch.tensor([4, 2])}
+    new_state, new_keys = LSTMTrainer._reset_lanes(state, keys, data)
+    assert torch.equal(new_keys, torch.tensor([[0, 4], [1, 2]]))
+    assert torch.equal(new_state[0][0][:, 0, 0, 0], torch.tensor([1., 0.]))
+    assert LSTMTrainer._reset_lanes(state, keys, {'sequence_id': torch.tensor([0, 1]),
+                                                  'index': torch.tensor([4, 8])})[0] is state
+    assert LSTMTrainer._reset_lanes(state, keys, {'sequence_id': torch.tensor([1, 0]),
+                                                  'index': torch.tensor([4, 8])})[0] is None
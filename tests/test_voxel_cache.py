@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import torch
+
+from dataset.voxel_cache import VoxelCache
+
+
+@pytest.mark.parametrize('dtype, atol', [('float16', 1e-3), ('int8', 1 / 127)])
+def test_voxel_cache_round_trip(tmp_path, rng, dtype, atol):
+    source_file = tmp_path / 'events.h5'
+    source_file.write_bytes(rng.bytes(100_000))
+    grids = [torch.from_numpy(rng.normal(size=(3, 8, 10)).astype('float32')) for _ in range(4)]
+    cache = VoxelCache(tmp_path / 'cache', num_bins=3, delta_t_ms=50, dtype=dtype, height=8, width=10)
+    cache.write_shard('seq', 'left', [2, 4, 6, 8], iter(grids), source_file)
+
+    for file_index, grid in zip([2, 4, 6, 8], grids):
+        cached = cache.get('seq', 'left', file_index, source_file)
+        scale = grid.abs().max().item() if dtype == 'int8' else 1.0
+        assert torch.allclose(cached, grid, atol=atol * scale, rtol=1e-3)
+    assert cache.get('seq', 'left', 3, source_file) is None
+    assert cache.get('seq', 'right', 2, source_file) is None
+
+
+def test_voxel_cache_ignores_stale_shards(tmp_path, rng):
+    source_file = tmp_path / 'events.h5'
+    source_file.write_bytes(rng.bytes(100_000))
+    cache = VoxelCache(tmp_path / 'cache', num_bins=3, delta_t_ms=50, height=8, width=10)
+    cache.write_shard('seq', 'left', [2], iter([torch.ones(3, 8, 10)]), source_file)
+    source_file.write_bytes(rng.bytes(100_000))
+    # A new cache, such that the content hash is computed again
+    cache = VoxelCache(tmp_path / 'cache', num_bins=3, delta_t_ms=50, height=8, width=10)
+    assert cache.get('seq', 'left', 2, source_file) is None
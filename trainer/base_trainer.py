@@ -1,7 +1,13 @@
 import torch
 from abc import abstractmethod
+from torch.utils.data import ConcatDataset
 from numpy import inf
 from logger import TensorboardWriter
+from dataset.augmentation import output_size
+from dataset.representations import VoxelGrid
+from dataset.prefetcher import BatchPrefetcher
+from model.loss import depth_targets, get_projectmat
+from model.metric import ERROR_TABLE_KEYS, depth_error_table
 
 
 class BaseTrainer:
@@ -37,6 +43,21 @@ class BaseTrainer:
 
         self.start_epoch = 1
 
+        # Number of batches staged on the device in the background, 0 to read them synchronously
+        self.prefetch_batches = cfg_trainer.get('prefetch_batches', 0)
+        # Steps between two writes of the metrics to Tensorboard, see utils.MetricTracker
+        self.metric_flush_steps = cfg_trainer.get('metric_flush_steps', 1)
+
+        # Voxelizes compact events (see dataset.dataloader.collate_events) on the training device,
+        # at the size of the samples (see dataset.augmentation.EventAugmentation). Configs without
+        # these keys, e.g. of runs started before they existed, get full 15-bin frames.
+        dataset_args = config.config.get('dataset', {}).get('args', {})
+        self.input_size = output_size(**(dataset_args.get('augmentation') or {}))
+        num_bins = config['arch'].get('args', {}).get('n_channels', 15)
+        self.voxel_grid = VoxelGrid(num_bins, *self.input_size, normalize=True)
+        # Reprojection matrix of the depth targets, moved to the device of the first batch
+        self.target_Q = None
+
         self.checkpoint_dir = config.save_dir
 
         # setup visualization writer instance
@@ -46,6 +67,82 @@ class BaseTrainer:
         if config.resume is not None and torch.cuda.is_available():
             self._resume_checkpoint(config.resume)
 
+    def _to_model_input(self, representation, device):
+        """
+        Move an event representation of a batch to the device, as a float32 (B, C, H, W) tensor
+        :param representation: Dense tensor (B, C, H, W) of any float dtype, or packed compact
+            events or sparse voxel grids from collate_events
+        """
+        if isinstance(representation, dict):
+            packed = {k: v.to(device, non_blocking=True) for k, v in representation.items()}
+            if 'indices' in packed:
+                return self.voxel_grid.densify_batch(packed['indices'], packed['values'], packed['offsets'])
+            return self.voxel_grid.convert_batch(
+                packed['x'], packed['y'], packed['p'].float(), packed['t'], packed['offsets'])
+        return representation.to(device, non_blocking=True).float()
+
+    @staticmethod
+    def _set_epoch(data_loader, epoch, training):
+        """
+        Pass the epoch and the mode to the datasets of a data loader, e.g. for their augmentation
+        Called before iterating, such that DataLoader workers get the updated datasets.
+        """
+        dataset = getattr(data_loader, 'dataset', None)
+        datasets = dataset.datasets if isinstance(dataset, ConcatDataset) else [dataset]
+        for dataset in datasets:
+            if hasattr(dataset, 'set_epoch'):
+                dataset.set_epoch(epoch, training)
+
+    def _depth_targets(self, target):
+        """
+        DepthTargets of a batch of disparity maps, computed once for the criterion and all metrics
+        """
+        if self.target_Q is None or self.target_Q.device != target.device:
+            self.target_Q = get_projectmat().float().to(target.device)
+        return depth_targets(target, self.target_Q)
+
+    def _update_metrics(self, tracker, output, targets):
+        """
+        Update tracker with the metrics of a batch
+        The metrics of ERROR_TABLE_KEYS share a single depth_error_table of the batch.
+        """
+        table = None
+        for met in self.metric_ftns:
+            if met.__name__ in ERROR_TABLE_KEYS:
+                if table is None:
+                    table = depth_error_table(output, targets)
+                tracker.update(met.__name__, met(output, targets, table=table))
+            else:
+                tracker.update(met.__name__, met(output, targets))
+
+    def _valid_region(self, image):
+        """
+        Region of (..., H, W) images with ground truth, [:430, 40:] of full DSEC frames
+        Cropped samples (see dataset.augmentation.EventAugmentation) are shown entirely.
+        """
+        if tuple(image.shape[-2:]) == (480, 640):
+            return image[..., :430, 40:]
+        return image
+
+    def _prefetch(self, data_loader, device):
+        """
+        Wrap a data loader into a BatchPrefetcher, unless prefetch_batches is 0
+        """
+        if data_loader is None or self.prefetch_batches <= 0:
+            return data_loader
+        return BatchPrefetcher(data_loader, device, self.prefetch_batches)
+
+    @staticmethod
+    def _data_wait_log(prefetcher, epoch_time_s):
+        """
+        Time spent waiting for training batches, in seconds and as a fraction of the epoch
+        A fraction close to 1 means that training is input-bound.
+        """
+        if prefetcher is None:
+            return {}
+        return {'data_wait_s': prefetcher.wait_s,
+                'data_wait': prefetcher.wait_s / epoch_time_s if epoch_time_s > 0 else 0.0}
+
     @abstractmethod
     def _train_epoch(self, epoch):
         """
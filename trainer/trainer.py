@@ -1,8 +1,10 @@
 import imp
+import time
 import numpy as np
 import torch
 from torchvision.utils import make_grid
 from .base_trainer import BaseTrainer
+from dataset.prefetcher import BatchPrefetcher
 from utils import inf_loop, MetricTracker
 from tqdm import tqdm
 from model.loss import from_log_to_depth,get_projectmat
@@ -32,6 +34,9 @@ class Trainer(BaseTrainer):
         len_epoch=None,
     ):
         super().__init__(model, criterion, metric_ftns, optimizer, config)
+        data_loader = self._prefetch(data_loader, device)
+        valid_data_loader = self._prefetch(valid_data_loader, device)
+        self.prefetcher = data_loader if isinstance(data_loader, BatchPrefetcher) else None
         self.config = config
         self.device = device
         self.data_loader = data_loader
@@ -40,12 +45,10 @@ class Trainer(BaseTrainer):
         self.lr_scheduler = lr_scheduler
         self.log_step = int(np.sqrt(data_loader.batch_size))
 
-        self.train_metrics = MetricTracker(
-            "loss", *[m.__name__ for m in self.metric_ftns], writer=self.writer
-        )
-        self.valid_metrics = MetricTracker(
-            "loss", *[m.__name__ for m in self.metric_ftns], writer=self.writer
-        )
+        self.train_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
+        self.valid_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
         
         if len_epoch is None:
             # epoch-based training
@@ -59,8 +62,10 @@ class Trainer(BaseTrainer):
         self.lr_scheduler = lr_scheduler
         self.log_step = int(np.sqrt(data_loader.batch_size))
 
-        self.train_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer)
-        self.valid_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer)
+        self.train_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
+        self.valid_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
         ###########################################
         # self.writer_tensbd = writer_tensbd
         # self.count_train=0
@@ -75,15 +80,18 @@ class Trainer(BaseTrainer):
         """
         self.model.train()
         self.train_metrics.reset()
+        if self.prefetcher is not None:
+            self.prefetcher.reset_stats()
+        epoch_start = time.perf_counter()
+        self._set_epoch(self.data_loader, epoch, training=True)
         for batch_idx, data in enumerate(tqdm(self.data_loader)):
-            inputs = data["representation"]["left"]
-            target = data["disparity_gt"]
-
-            inputs, target = inputs.to(self.device), target.to(self.device)
+            inputs = self._to_model_input(data["representation"]["left"], self.device)
+            target = data["disparity_gt"].to(self.device)
 
             self.optimizer.zero_grad()
             output = self.model(inputs)
-            loss = self.criterion(output, target)
+            targets = self._depth_targets(target)
+            loss = self.criterion(output, targets)
             loss.backward()
             self.optimizer.step()
             # self.count_train+=1
@@ -93,9 +101,8 @@ class Trainer(BaseTrainer):
             #     self.writer_tensbd.add_scalars("Loss", {'Train': loss.item()}, self.count_train)
             ########################################################
             self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
-            self.train_metrics.update("loss", loss.item())
-            for met in self.metric_ftns:
-                self.train_metrics.update(met.__name__, met(output, target))
+            self.train_metrics.update("loss", loss.detach())
+            self._update_metrics(self.train_metrics, output, targets)
 
             if batch_idx % self.log_step == 0:
                 self.logger.debug(
@@ -110,6 +117,7 @@ class Trainer(BaseTrainer):
             if batch_idx == self.len_epoch:
                 break
         log = self.train_metrics.result()
+        log.update(self._data_wait_log(self.prefetcher, time.perf_counter() - epoch_start))
 
         if self.do_validation:
             val_log = self._valid_epoch(epoch)
@@ -127,14 +135,15 @@ class Trainer(BaseTrainer):
         """
         self.model.eval()
         self.valid_metrics.reset()
+        self._set_epoch(self.valid_data_loader, epoch, training=False)
         with torch.no_grad():
             for batch_idx, data in enumerate(self.data_loader):
-                inputs = data["representation"]["left"]
-                target = data["disparity_gt"]
-                inputs, target = inputs.to(self.device), target.to(self.device)
+                inputs = self._to_model_input(data["representation"]["left"], self.device)
+                target = data["disparity_gt"].to(self.device)
 
                 output, _ = self.model(inputs)
-                loss = self.criterion(output, target)
+                targets = self._depth_targets(target)
+                loss = self.criterion(output, targets)
                 # self.count_val+=1
                 ########################################################
                 # if self.config['trainer']['tensorboard']:
@@ -143,9 +152,8 @@ class Trainer(BaseTrainer):
                 self.writer.set_step(
                     (epoch - 1) * len(self.valid_data_loader) + batch_idx, "valid"
                 )
-                self.valid_metrics.update("loss", loss.item())
-                for met in self.metric_ftns:
-                    self.valid_metrics.update(met.__name__, met(output, target))
+                self.valid_metrics.update("loss", loss.detach())
+                self._update_metrics(self.valid_metrics, output, targets)
                 # self.writer.add_image(
                 #     "input", make_grid(inputs.cpu(), nrow=8, normalize=True)
                 # )
@@ -186,23 +194,36 @@ class LSTMTrainer(BaseTrainer):
         len_epoch=None,
     ):
         super().__init__(model, criterion, metric_ftns, optimizer, config)
+        data_loader = self._prefetch(data_loader, device)
+        valid_data_loader = self._prefetch(valid_data_loader, device)
+        self.prefetcher = data_loader if isinstance(data_loader, BatchPrefetcher) else None
         self.config = config
         self.device = device
         self.data_loader = data_loader
         self.valid_data_loader = valid_data_loader
         self.do_validation = self.valid_data_loader is not None
         self.lr_scheduler = lr_scheduler
-        self.log_step = int(np.sqrt(data_loader.batch_size))
+        # data_loader.batch_size is None with a batch sampler (e.g. SequenceLaneBatchSampler)
+        self.batch_size = data_loader.batch_sampler.batch_size
+        self.log_step = int(np.sqrt(self.batch_size))
         self.Q=get_projectmat()
-        
-        self.state = None
 
-        self.train_metrics = MetricTracker(
-            "loss", *[m.__name__ for m in self.metric_ftns], writer=self.writer
-        )
-        self.valid_metrics = MetricTracker(
-            "loss", *[m.__name__ for m in self.metric_ftns], writer=self.writer
-        )
+        # Truncated BPTT: the graph is kept over bptt_steps batches, then backpropagated and freed.
+        self.bptt_steps = config['trainer'].get('bptt_steps', 1)
+        assert self.bptt_steps >= 1
+        self.state = None
+        # (sequence_id, index) of the samples of the previous batch, to detect lane boundaries.
+        # Only batches of a SequenceLaneBatchSampler continue their previous windows; otherwise the
+        # detached state is carried on over the shuffled batches, and validation starts each batch
+        # from a zero state.
+        self.sequence_lanes = getattr(data_loader, 'sequence_lanes', False)
+        self.valid_sequence_lanes = getattr(valid_data_loader, 'sequence_lanes', False)
+        self.lane_keys = None
+
+        self.train_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
+        self.valid_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
         
         if len_epoch is None:
             # epoch-based training
@@ -214,10 +235,12 @@ class LSTMTrainer(BaseTrainer):
         self.valid_data_loader = valid_data_loader
         self.do_validation = self.valid_data_loader is not None
         self.lr_scheduler = lr_scheduler
-        self.log_step = int(10 * (data_loader.batch_size))
+        self.log_step = int(10 * self.batch_size)
 
-        self.train_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer)
-        self.valid_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer)
+        self.train_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
+        self.valid_metrics = MetricTracker('loss', *[m.__name__ for m in self.metric_ftns], writer=self.writer,
+                                           device=device, flush_steps=self.metric_flush_steps)
         ###########################################
         # self.writer_tensbd = writer_tensbd
         # self.count_train=0
@@ -232,24 +255,31 @@ class LSTMTrainer(BaseTrainer):
         """
         self.model.train()
         self.train_metrics.reset()
+        if self.prefetcher is not None:
+            self.prefetcher.reset_stats()
+        epoch_start = time.perf_counter()
+        self._set_epoch(self.data_loader, epoch, training=True)
+        self.state = None
+        self.lane_keys = None
+        losses = []
         for batch_idx, data in enumerate(tqdm(self.data_loader)):
-            inputs = data["representation"]["left"]
-            target = data["disparity_gt"]
-
-            inputs, target = inputs.to(self.device), target.to(self.device)
-
-            self.optimizer.zero_grad()
-            output, state = self.model(inputs, self.state)
-
-            self.state = []
-            for s in state:
-                s0_ = s[0].detach()
-                s1_ = s[1].detach()
-                self.state.append((s0_, s1_))
-                
-            loss = self.criterion(output, target)
-            loss.backward(retain_graph=True)
-            self.optimizer.step()
+            inputs = self._to_model_input(data["representation"]["left"], self.device)
+            target = data["disparity_gt"].to(self.device)
+
+            if self.sequence_lanes:
+                self.state, self.lane_keys = self._reset_lanes(self.state, self.lane_keys, data)
+            output, self.state = self.model(inputs, self.state)
+            targets = self._depth_targets(target)
+            loss = self.criterion(output, targets)
+            losses.append(loss)
+
+            if len(losses) == self.bptt_steps or batch_idx + 1 >= self.len_epoch:
+                self.optimizer.zero_grad()
+                torch.stack(losses).mean().backward()
+                self.optimizer.step()
+                # The graph of the unrolled steps is freed, the state is carried on without it.
+                self.state = [(h.detach(), c.detach()) for h, c in self.state]
+                losses = []
             # self.count_train+=1
             # print(self.count)
             ########################################################
@@ -257,9 +287,8 @@ class LSTMTrainer(BaseTrainer):
             #     self.writer_tensbd.add_scalars("Loss", {'Train': loss.item()}, self.count_train)
             ########################################################
             self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
-            self.train_metrics.update("loss", loss.item())
-            for met in self.metric_ftns:
-                self.train_metrics.update(met.__name__, met(output, target))
+            self.train_metrics.update("loss", loss.detach())
+            self._update_metrics(self.train_metrics, output, targets)
 
             if batch_idx % self.log_step == 0:
                 self.logger.debug(
@@ -268,7 +297,7 @@ class LSTMTrainer(BaseTrainer):
                     )
                 )
                 self.writer.add_image(
-                    "output", make_grid(1/from_log_to_depth(output[:,:,:430,40:]).cpu(), nrow=2, normalize=True)
+                    "output", make_grid(1/from_log_to_depth(self._valid_region(output)).cpu(), nrow=2, normalize=True)
                 )
                 target_cpu = target.detach().cpu()
                 valid_idx = target_cpu != 0
@@ -276,12 +305,13 @@ class LSTMTrainer(BaseTrainer):
                 temp[valid_idx] =self.Q[2, 3] / ((target_cpu[valid_idx] - self.Q[3, 3])*self.Q[3,2])
                 temp=torch.unsqueeze(temp,dim=1)
                 self.writer.add_image(
-                    "target", make_grid(1/temp[:,:,:430,40:].cpu(), nrow=2, normalize=True)
+                    "target", make_grid(1/self._valid_region(temp).cpu(), nrow=2, normalize=True)
                 )
 
             if batch_idx == self.len_epoch:
                 break
         log = self.train_metrics.result()
+        log.update(self._data_wait_log(self.prefetcher, time.perf_counter() - epoch_start))
 
         if self.do_validation:
             val_log = self._valid_epoch(epoch)
@@ -299,14 +329,21 @@ class LSTMTrainer(BaseTrainer):
         """
         self.model.eval()
         self.valid_metrics.reset()
+        self._set_epoch(self.valid_data_loader, epoch, training=False)
+        state = None
+        lane_keys = None
         with torch.no_grad():
-            for batch_idx, data in enumerate(self.data_loader):
-                inputs = data["representation"]["left"]
-                target = data["disparity_gt"]
-                inputs, target = inputs.to(self.device), target.to(self.device)
-
-                output, _ = self.model(inputs, self.state)
-                loss = self.criterion(output, target)
+            for batch_idx, data in enumerate(self.valid_data_loader):
+                inputs = self._to_model_input(data["representation"]["left"], self.device)
+                target = data["disparity_gt"].to(self.device)
+
+                if self.valid_sequence_lanes:
+                    state, lane_keys = self._reset_lanes(state, lane_keys, data)
+                else:
+                    state = None
+                output, state = self.model(inputs, state)
+                targets = self._depth_targets(target)
+                loss = self.criterion(output, targets)
                 # self.count_val+=1
                 # ########################################################
                 # if self.config['trainer']['tensorboard']:
@@ -315,11 +352,10 @@ class LSTMTrainer(BaseTrainer):
                 self.writer.set_step(
                     (epoch - 1) * len(self.valid_data_loader) + batch_idx, "valid"
                 )
-                self.valid_metrics.update("loss", loss.item())
-                for met in self.metric_ftns:
-                    self.valid_metrics.update(met.__name__, met(output, target))
+                self.valid_metrics.update("loss", loss.detach())
+                self._update_metrics(self.valid_metrics, output, targets)
                 self.writer.add_image(
-                    "output", make_grid(1/from_log_to_depth(output[:,:,:430,40:]).cpu(), nrow=2, normalize=True)
+                    "output", make_grid(1/from_log_to_depth(self._valid_region(output)).cpu(), nrow=2, normalize=True)
                 )
                 target_cpu = target.detach().cpu()
                 valid_idx = target_cpu != 0
@@ -327,7 +363,7 @@ class LSTMTrainer(BaseTrainer):
                 temp[valid_idx] =self.Q[2, 3] / ((target_cpu[valid_idx] - self.Q[3, 3])*self.Q[3,2])
                 temp=torch.unsqueeze(temp,dim=1)
                 self.writer.add_image(
-                    "target", make_grid(1/temp[:,:,:430,40:].cpu(), nrow=2, normalize=True)
+                    "target", make_grid(1/self._valid_region(temp).cpu(), nrow=2, normalize=True)
                 )
 
 
@@ -336,10 +372,30 @@ class LSTMTrainer(BaseTrainer):
             self.writer.add_histogram(name, p, bins="auto")
         return self.valid_metrics.result()
 
+    @staticmethod
+    def _reset_lanes(state, lane_keys, data):
+        """
+        Zero the recurrent state of the lanes that do not continue their previous window
+        :param state: ConvLSTM states [(h, c), ...] of the previous batch, or None
+        :param lane_keys: (sequence_id, index) of the previous batch, or None
+        :param data: current batch, with 'sequence_id' and 'index' (see Sequence.__getitem__)
+        :return: The state to feed to the model and the keys of the current batch.
+        """
+        keys = torch.stack([data["sequence_id"], data["index"]], dim=1)
+        if state is None or lane_keys is None or lane_keys.shape != keys.shape:
+            return None, keys
+        keep = (keys[:, 0] == lane_keys[:, 0]) & (keys[:, 1] == lane_keys[:, 1] + 1)
+        if bool(keep.all()):
+            return state, keys
+        if not bool(keep.any()):
+            return None, keys
+        keep = keep.to(device=state[0][0].device, dtype=state[0][0].dtype).view(-1, 1, 1, 1)
+        return [(h * keep, c * keep) for h, c in state], keys
+
     def _progress(self, batch_idx):
         base = "[{}/{} ({:.0f}%)]"
         if hasattr(self.data_loader, "n_samples"):
-            current = batch_idx * self.data_loader.batch_size
+            current = batch_idx * self.batch_size
             total = self.data_loader.n_samples
         else:
             current = batch_idx
@@ -1,2 +1,7 @@
 from .util import *
-from .eventslicer import *
\ No newline at end of file
+from .eventslicer import *
+from .eventstore import *
+from .disparitystore import *
+from .chunkcache import *
+from .h5pool import *
+from .pipeline import *
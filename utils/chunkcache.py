@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+import numpy as np
+
+
+class ChunkCache:
+    """LRU cache of decompressed HDF5 chunks with a byte budget
+    Keys are (file, dataset, chunk index). Every process (e.g. DataLoader worker) holds
+    its own copy, hence max_nbytes is a budget per worker.
+    """
+    def __init__(self, max_nbytes: int):
+        assert max_nbytes > 0
+        self.max_nbytes = max_nbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._chunks = OrderedDict()
+
+    def get(self, key: Hashable, load: Callable[[], np.ndarray]) -> np.ndarray:
+        chunk = self._chunks.get(key)
+        if chunk is not None:
+            self._chunks.move_to_end(key)
+            self.hits += 1
+            return chunk
+
+        self.misses += 1
+        chunk = load()
+        if chunk.nbytes > self.max_nbytes:
+            return chunk
+        chunk.setflags(write=False)
+        self._chunks[key] = chunk
+        self.nbytes += chunk.nbytes
+        while self.nbytes > self.max_nbytes:
+            _, evicted = self._chunks.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return chunk
+
+    def read(self, filename: str, dset, idx_start: int, idx_end: int) -> np.ndarray:
+        """Read dset[idx_start:idx_end] of a 1-D chunked dataset through the cache"""
+        chunk_size = dset.chunks[0] if dset.chunks is not None else None
+        if chunk_size is None or idx_end <= idx_start:
+            return np.asarray(dset[idx_start:idx_end])
+
+        chunk_first = idx_start // chunk_size
+        chunk_last = (idx_end - 1) // chunk_size
+        parts = list()
+        for chunk_idx in range(chunk_first, chunk_last + 1):
+            chunk_start = chunk_idx * chunk_size
+            chunk = self.get((filename, dset.name, chunk_idx),
+                             lambda: np.asarray(dset[chunk_start:chunk_start + chunk_size]))
+            parts.append(chunk[max(idx_start - chunk_start, 0):idx_end - chunk_start])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def clear(self):
+        self._chunks.clear()
+        self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'nbytes': self.nbytes,
+            'num_chunks': len(self._chunks),
+        }
@@ -0,0 +1,70 @@
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+# Stack of the ground truth of a sequence, written into its disparity directory.
+# Row i of the stack corresponds to the i-th PNG of disparity/event (in file name order)
+# and to line i of disparity/timestamps.txt. The file index (PNG name) of each row is
+# stored in the json file, DSEC file indices are not contiguous. Depth targets are not
+# stored: they depend on the crop of a sample, see model.loss.depth_targets.
+DISPARITY_STACK_FILE = 'disparity_event.npy'
+DISPARITY_META_FILE = 'disparity_event.json'
+
+
+def pack_disparity_dir(disp_dir: Path):
+    """Decode the disparity PNGs of a sequence into a memory-mappable stack
+    The disparity directory will contain:
+    disparity_event.npy:  uint16 (N, H, W) stack of the PNGs (disparity * 256)
+    disparity_event.json: the file index of each row and the frame size
+    Parameters
+    ----------
+    disp_dir: disparity directory of a sequence, containing event/ and timestamps.txt
+    """
+    assert disp_dir.is_dir(), str(disp_dir)
+    timestamps = np.loadtxt(disp_dir / 'timestamps.txt', dtype='int64')
+    png_paths = sorted((disp_dir / 'event').glob('*.png'))
+    assert len(png_paths) == timestamps.size
+    file_indices = [int(path.stem) for path in png_paths]
+
+    height, width = cv2.imread(str(png_paths[0]), cv2.IMREAD_ANYDEPTH).shape
+    stack = np.lib.format.open_memmap(
+            str(disp_dir / DISPARITY_STACK_FILE), mode='w+', dtype='uint16', shape=(len(png_paths), height, width))
+    for row, png_path in enumerate(png_paths):
+        disp_16bit = cv2.imread(str(png_path), cv2.IMREAD_ANYDEPTH)
+        assert disp_16bit.dtype == np.uint16 and disp_16bit.shape == (height, width)
+        stack[row] = disp_16bit
+    stack.flush()
+    del stack
+
+    meta = {
+        'file_indices': file_indices,
+        'height': height,
+        'width': width,
+    }
+    with (disp_dir / DISPARITY_META_FILE).open('wt') as handle:
+        json.dump(meta, handle, indent=4)
+
+
+class DisparityStack:
+    """Reader of the ground truth stack written by pack_disparity_dir
+    The stack is memory-mapped read-only, a frame is a view into the file.
+    """
+    def __init__(self, disp_dir: Path):
+        with (disp_dir / DISPARITY_META_FILE).open('rt') as handle:
+            meta = json.load(handle)
+        self.rows = {int(file_index): row for row, file_index in enumerate(meta['file_indices'])}
+        self.num_frames = len(self.rows)
+        shape = (self.num_frames, meta['height'], meta['width'])
+
+        self.disparity = np.load(str(disp_dir / DISPARITY_STACK_FILE), mmap_mode='r')
+        assert self.disparity.shape == shape and self.disparity.dtype == np.uint16
+
+    def __len__(self):
+        return self.num_frames
+
+    def get_disparity_map(self, file_index: int) -> np.ndarray:
+        # Same values as Sequence.get_disparity_map of the PNG
+        return self.disparity[self.rows[file_index]].astype('float32') / 256
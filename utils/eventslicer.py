@@ -1,18 +1,89 @@
 import math
-from typing import Dict, Tuple
+from typing import Dict, NamedTuple, Optional, Tuple
 import hdf5plugin
 import h5py
 from numba import jit
 import numpy as np
+
+from utils.chunkcache import ChunkCache
 # import hdf5plugin
 
+class MergedRanges(NamedTuple):
+    """Event index ranges of many time windows, merged such that every event is read once
+    The merged ranges [starts, ends) are read one after the other into a single buffer,
+    range i at buffer_starts[i]. window_ids are the windows that can be retrieved and
+    window_ranges the merged range of each of them.
+    """
+    window_ids: np.ndarray
+    window_ranges: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    buffer_starts: np.ndarray
+
+    @property
+    def num_events(self) -> int:
+        return int((self.ends - self.starts).sum())
+
+    def window_offsets(self, time_buffer: np.ndarray, t_starts_us: np.ndarray, t_ends_us: np.ndarray) -> np.ndarray:
+        """Exact [start, end) offsets into the buffer of every window, (-1, -1) if it cannot be retrieved
+        time_buffer holds the timestamps of the merged ranges, in the time base of t_starts_us
+        and t_ends_us. Ranges are disjoint and in file order, hence the buffer is sorted and
+        all windows are resolved with a single binary search.
+        """
+        offsets = np.full((t_starts_us.size, 2), -1, dtype='int64')
+        lower = self.buffer_starts[self.window_ranges]
+        upper = lower + (self.ends - self.starts)[self.window_ranges]
+        for column, times in enumerate([t_starts_us, t_ends_us]):
+            found = np.searchsorted(time_buffer, times[self.window_ids], side='left')
+            offsets[self.window_ids, column] = np.clip(found, lower, upper)
+        return offsets
+
+    def index_ranges(self, offsets: np.ndarray) -> np.ndarray:
+        """Event indices [start, end) in the file of the offsets of window_offsets"""
+        ranges = np.full_like(offsets, -1)
+        shift = (self.starts - self.buffer_starts)[self.window_ranges]
+        ranges[self.window_ids] = offsets[self.window_ids] + shift[:, None]
+        return ranges
+
+
+def merge_window_ranges(ms_to_idx: np.ndarray, t_starts_us: np.ndarray, t_ends_us: np.ndarray) -> MergedRanges:
+    """Bound the windows [t_starts_us, t_ends_us) (relative to t_offset) with ms_to_idx and merge
+    overlapping or adjacent index ranges, see EventSlicer for the definition of ms_to_idx.
+    Windows ending after the last millisecond of ms_to_idx cannot be retrieved.
+    """
+    assert t_starts_us.ndim == 1
+    assert t_starts_us.shape == t_ends_us.shape
+    assert np.all(t_starts_us < t_ends_us)
+    assert np.all(t_starts_us >= 0)
+
+    # Conservative index ranges, same as in EventSlicer.get_events.
+    start_ms = t_starts_us // 1000
+    end_ms = -(-t_ends_us // 1000)
+    valid = end_ms < ms_to_idx.size
+    window_ids = np.flatnonzero(valid)
+    lo = ms_to_idx[start_ms[valid]]
+    hi = ms_to_idx[end_ms[valid]]
+
+    order = np.argsort(lo, kind='stable')
+    window_ids, lo, hi = window_ids[order], lo[order], hi[order]
+    if lo.size == 0:
+        empty = np.zeros(0, dtype='int64')
+        return MergedRanges(window_ids, empty, empty, empty, empty)
+    hi_running = np.maximum.accumulate(hi)
+    new_range = np.ones(lo.size, dtype=bool)
+    new_range[1:] = lo[1:] > hi_running[:-1]
+    range_first_window = np.flatnonzero(new_range)
+    starts = lo[new_range]
+    ends = np.maximum.reduceat(hi, range_first_window)
+    buffer_starts = np.concatenate(([0], np.cumsum(ends - starts)[:-1])).astype('int64')
+    return MergedRanges(window_ids, np.cumsum(new_range) - 1, starts, ends, buffer_starts)
+
+
 class EventSlicer:
-    def __init__(self, h5f: h5py.File):
+    def __init__(self, h5f: h5py.File, chunk_cache: Optional[ChunkCache]=None):
         self.h5f = h5f
-
-        self.events = dict()
-        for dset_str in ['p', 'x', 'y', 't']:
-            self.events[dset_str] = self.h5f['events/{}'.format(dset_str)]
+        # Optional LRU of decompressed chunks, shared between slicers of the same process.
+        self.chunk_cache = chunk_cache
 
         # This is the mapping from milliseconds to event index:
         # It is defined such that
@@ -36,7 +107,7 @@ class EventSlicer:
             # self.t_offset = 0
         else:
             self.t_offset = 0
-        self.t_final = int(self.events['t'][-1]) + self.t_offset
+        self.t_final = int(self._dataset('t')[-1]) + self.t_offset
 
     def get_start_time_us(self):
         return self.t_offset
@@ -44,6 +115,16 @@ class EventSlicer:
     def get_final_time_us(self):
         return self.t_final
 
+    def _dataset(self, dset_str: str) -> h5py.Dataset:
+        # Looked up on every access, such that h5f may also be a PooledH5File
+        # whose underlying file is closed and reopened in between.
+        return self.h5f['events/{}'.format(dset_str)]
+
+    def _read(self, dset_str: str, idx_start: int, idx_end: int) -> np.ndarray:
+        if self.chunk_cache is None:
+            return np.asarray(self._dataset(dset_str)[idx_start:idx_end])
+        return self.chunk_cache.read(self.h5f.filename, self._dataset(dset_str), idx_start, idx_end)
+
     def get_events(self, t_start_us: int, t_end_us: int) -> Dict[str, np.ndarray]:
         """Get events (p, x, y, t) within the specified time window
         Parameters
@@ -69,17 +150,89 @@ class EventSlicer:
             return None
 
         events = dict()
-        time_array_conservative = np.asarray(self.events['t'][t_start_ms_idx:t_end_ms_idx])
+        time_array_conservative = self._read('t', t_start_ms_idx, t_end_ms_idx)
         idx_start_offset, idx_end_offset = self.get_time_indices_offsets(time_array_conservative, t_start_us, t_end_us)
         t_start_us_idx = t_start_ms_idx + idx_start_offset
         t_end_us_idx = t_start_ms_idx + idx_end_offset
         # Again add t_offset to get gps time
         events['t'] = time_array_conservative[idx_start_offset:idx_end_offset] + self.t_offset
         for dset_str in ['p', 'x', 'y']:
-            events[dset_str] = np.asarray(self.events[dset_str][t_start_us_idx:t_end_us_idx])
+            events[dset_str] = self._read(dset_str, t_start_us_idx, t_end_us_idx)
             assert events[dset_str].size == events['t'].size
         return events
 
+    def get_events_batch(self, t_starts_us: np.ndarray, t_ends_us: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Get events (p, x, y, t) for many time windows at once
+        The index range of every window is first bounded with ms_to_idx. Overlapping or
+        adjacent ranges are merged such that each merged range is read only once from
+        the HDF5 file. The exact microsecond bounds of all windows are then resolved with
+        a single vectorized binary search over the timestamps read, see merge_window_ranges.
+        Parameters
+        ----------
+        t_starts_us: start times in microseconds, shape (N,)
+        t_ends_us: end times in microseconds, shape (N,)
+        Returns
+        -------
+        events: dictionary of (p, x, y, t) holding the events of all merged ranges
+        offsets: array of shape (N, 2) such that the events of window i are
+            events[k][offsets[i, 0]:offsets[i, 1]] (a view, no copy).
+            Windows that cannot be retrieved have offsets (-1, -1).
+        """
+        t_starts_us = np.asarray(t_starts_us, dtype='int64') - self.t_offset
+        t_ends_us = np.asarray(t_ends_us, dtype='int64') - self.t_offset
+        merged = merge_window_ranges(self.ms_to_idx, t_starts_us, t_ends_us)
+        events = dict()
+        for dset_str in ['p', 'x', 'y', 't']:
+            dtype = 'int64' if dset_str == 't' else self._dataset(dset_str).dtype
+            events[dset_str] = np.empty(merged.num_events, dtype=dtype)
+            self._read_ranges(dset_str, merged, events[dset_str])
+        offsets = merged.window_offsets(events['t'], t_starts_us, t_ends_us)
+        # Again add t_offset to get gps time
+        events['t'] += self.t_offset
+        return events, offsets
+
+    def _read_ranges(self, dset_str: str, merged: MergedRanges, buffer: np.ndarray):
+        """Read the merged index ranges of a dataset into buffer, one after the other"""
+        dset = self._dataset(dset_str)
+        for range_start, range_end, buffer_start in zip(merged.starts, merged.ends, merged.buffer_starts):
+            if range_end == range_start:
+                continue
+            buffer_end = buffer_start + range_end - range_start
+            if self.chunk_cache is not None:
+                buffer[buffer_start:buffer_end] = self._read(dset_str, range_start, range_end)
+            elif dset.dtype == buffer.dtype:
+                dset.read_direct(buffer, np.s_[range_start:range_end], np.s_[buffer_start:buffer_end])
+            else:
+                buffer[buffer_start:buffer_end] = dset[range_start:range_end]
+
+    def get_index_ranges(self, t_starts_us: np.ndarray, t_ends_us: np.ndarray) -> np.ndarray:
+        """Exact event index ranges of many time windows, without reading x, y and p
+        Only the timestamps of the merged ranges are read, see get_events_batch.
+        Parameters
+        ----------
+        t_starts_us: start times in microseconds, shape (N,)
+        t_ends_us: end times in microseconds, shape (N,)
+        Returns
+        -------
+        ranges: array of shape (N, 2) such that the events of window i are
+            [ranges[i, 0], ranges[i, 1]), see get_events_by_index.
+            Windows that cannot be retrieved have ranges (-1, -1).
+        """
+        t_starts_us = np.asarray(t_starts_us, dtype='int64') - self.t_offset
+        t_ends_us = np.asarray(t_ends_us, dtype='int64') - self.t_offset
+        merged = merge_window_ranges(self.ms_to_idx, t_starts_us, t_ends_us)
+        time_buffer = np.empty(merged.num_events, dtype='int64')
+        self._read_ranges('t', merged, time_buffer)
+        return merged.index_ranges(merged.window_offsets(time_buffer, t_starts_us, t_ends_us))
+
+    def get_events_by_index(self, idx_start: int, idx_end: int) -> Dict[str, np.ndarray]:
+        """Get events (p, x, y, t) [idx_start, idx_end), e.g. from get_index_ranges"""
+        events = dict()
+        for dset_str in ['p', 'x', 'y']:
+            events[dset_str] = self._read(dset_str, idx_start, idx_end)
+        # Again add t_offset to get gps time
+        events['t'] = self._read('t', idx_start, idx_end).astype('int64') + self.t_offset
+        return events
 
     @staticmethod
     def get_conservative_window_ms(ts_start_us: int, ts_end_us) -> Tuple[int, int]:
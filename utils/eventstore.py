@@ -0,0 +1,208 @@
+import json
+from pathlib import Path
+from typing import Dict, Tuple
+
+import hdf5plugin
+import h5py
+import numpy as np
+
+from utils.eventslicer import EventSlicer, MergedRanges, merge_window_ranges
+
+
+# Packed event records. With t_encoding 'int64', t holds the absolute (gps) timestamp
+# in microseconds, i.e. t_offset is already added. With t_encoding 'delta', t holds the
+# offset in microseconds from the start of the millisecond the event belongs to according
+# to ms_to_idx. Events after the last millisecond of ms_to_idx belong to that millisecond,
+# hence their offset may exceed 1000 us, up to the 65535 us of the uint16.
+PACKED_DTYPES = {
+    'int64': np.dtype([('t', '<i8'), ('x', '<u2'), ('y', '<u2'), ('p', 'u1')]),
+    'delta': np.dtype([('t', '<u2'), ('x', '<u2'), ('y', '<u2'), ('p', 'u1')]),
+}
+PACKED_EVENTS_FILE = 'events_packed.npy'
+PACKED_MS_TO_IDX_FILE = 'ms_to_idx.npy'
+PACKED_META_FILE = 'events_packed.json'
+
+
+def pack_event_file(h5_path: Path, out_dir: Path, t_encoding: str='int64', chunk_size: int=10_000_000):
+    """Convert an events.h5 file into an uncompressed packed-record file
+    The output directory will contain:
+    events_packed.npy:  structured array of records (t, x, y, p), see PACKED_DTYPES
+    ms_to_idx.npy:      the ms_to_idx mapping of the source file
+    events_packed.json: t_offset, t_encoding and the number of events
+    Parameters
+    ----------
+    h5_path: path to the events.h5 file
+    out_dir: output directory, usually the directory containing events.h5
+    t_encoding: 'int64' or 'delta'
+    chunk_size: number of events converted at once
+    Raises ValueError if t_encoding is 'delta' and the timestamps of the file do not fit it.
+    """
+    assert t_encoding in PACKED_DTYPES, t_encoding
+    assert h5_path.is_file(), str(h5_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    with h5py.File(str(h5_path), 'r') as h5f:
+        ms_to_idx = np.asarray(h5f['ms_to_idx'], dtype='int64')
+        t_offset = int(h5f['t_offset'][()]) if 't_offset' in h5f else 0
+        num_events = h5f['events/t'].size
+
+        records = np.lib.format.open_memmap(
+                str(out_dir / PACKED_EVENTS_FILE), mode='w+', dtype=PACKED_DTYPES[t_encoding], shape=(num_events,))
+        for idx_start in range(0, num_events, chunk_size):
+            idx_end = min(idx_start + chunk_size, num_events)
+            chunk = records[idx_start:idx_end]
+            for dset_str in ['x', 'y', 'p']:
+                chunk[dset_str] = h5f['events/{}'.format(dset_str)][idx_start:idx_end]
+            t = np.asarray(h5f['events/t'][idx_start:idx_end], dtype='int64')
+            if t_encoding == 'int64':
+                chunk['t'] = t + t_offset
+            else:
+                delta = t - _event_ms(ms_to_idx, idx_start, idx_end) * 1000
+                if delta.size > 0 and (delta.min() < 0 or delta.max() > np.iinfo('uint16').max):
+                    raise ValueError('{}: events [{}, {}) are not within 65 ms after the millisecond ms_to_idx assigns '
+                                     'them to, they cannot be packed with t_encoding=\'delta\', use \'int64\''.format(
+                                         h5_path, idx_start, idx_end))
+                chunk['t'] = delta
+        records.flush()
+        del records
+
+    np.save(str(out_dir / PACKED_MS_TO_IDX_FILE), ms_to_idx)
+    with (out_dir / PACKED_META_FILE).open('wt') as handle:
+        json.dump({'t_offset': t_offset, 't_encoding': t_encoding, 'num_events': int(num_events)}, handle, indent=4)
+
+
+def _event_ms(ms_to_idx: np.ndarray, idx_start: int, idx_end: int) -> np.ndarray:
+    """Millisecond (relative to t_offset) of each event in [idx_start, idx_end)"""
+    if idx_end <= idx_start:
+        return np.zeros(0, dtype='int64')
+    ms_start = max(int(np.searchsorted(ms_to_idx, idx_start, side='right')) - 1, 0)
+    ms_end = int(np.searchsorted(ms_to_idx, idx_end, side='left'))
+    bounds = np.clip(ms_to_idx[ms_start:ms_end + 1], idx_start, idx_end)
+    bounds[0] = idx_start
+    bounds = np.append(bounds, idx_end)
+    counts = np.diff(bounds)
+    return np.repeat(np.arange(ms_start, ms_start + counts.size, dtype='int64'), counts)
+
+
+class MemmapEventSlicer:
+    """EventSlicer-compatible reader of packed-record files written by pack_event_file
+    Events are served as views into a read-only np.memmap, no HDF5 library calls are made.
+    """
+    def __init__(self, event_dir: Path):
+        with (event_dir / PACKED_META_FILE).open('rt') as handle:
+            meta = json.load(handle)
+        self.t_offset = int(meta['t_offset'])
+        self.t_encoding = meta['t_encoding']
+        assert self.t_encoding in PACKED_DTYPES, self.t_encoding
+
+        self.records = np.load(str(event_dir / PACKED_EVENTS_FILE), mmap_mode='r')
+        assert self.records.dtype == PACKED_DTYPES[self.t_encoding]
+        assert self.records.size == meta['num_events']
+        self.events = {dset_str: self.records[dset_str] for dset_str in ['p', 'x', 'y', 't']}
+
+        # See EventSlicer for the definition of ms_to_idx.
+        self.ms_to_idx = np.load(str(event_dir / PACKED_MS_TO_IDX_FILE))
+
+        self.t_final = int(self._get_time(self.records.size - 1, self.records.size)[0])
+        if self.t_encoding == 'delta':
+            self.t_final += self.t_offset
+
+    def get_start_time_us(self):
+        return self.t_offset
+
+    def get_final_time_us(self):
+        return self.t_final
+
+    def _get_time(self, idx_start: int, idx_end: int) -> np.ndarray:
+        """Timestamps of events [idx_start, idx_end) in microseconds
+        Absolute for t_encoding 'int64' (a view), relative to t_offset for 'delta' (decoded).
+        """
+        if self.t_encoding == 'int64':
+            return self.events['t'][idx_start:idx_end]
+        return _event_ms(self.ms_to_idx, idx_start, idx_end) * 1000 + self.events['t'][idx_start:idx_end]
+
+    def _get_index_range(self, t_start_us: int, t_end_us: int):
+        t_start_ms, t_end_ms = EventSlicer.get_conservative_window_ms(t_start_us - self.t_offset, t_end_us - self.t_offset)
+        if t_end_ms >= self.ms_to_idx.size:
+            # Cannot guarantee window size anymore
+            return None
+        t_start_ms_idx = self.ms_to_idx[t_start_ms]
+        t_end_ms_idx = self.ms_to_idx[t_end_ms]
+
+        time_array = self._get_time(t_start_ms_idx, t_end_ms_idx)
+        if self.t_encoding == 'delta':
+            t_start_us -= self.t_offset
+            t_end_us -= self.t_offset
+        idx_start = t_start_ms_idx + int(np.searchsorted(time_array, t_start_us, side='left'))
+        idx_end = t_start_ms_idx + int(np.searchsorted(time_array, t_end_us, side='left'))
+        return idx_start, idx_end, time_array[idx_start - t_start_ms_idx:idx_end - t_start_ms_idx]
+
+    def get_events(self, t_start_us: int, t_end_us: int) -> Dict[str, np.ndarray]:
+        """Get events (p, x, y, t) within the specified time window
+        Parameters
+        ----------
+        t_start_us: start time in microseconds
+        t_end_us: end time in microseconds
+        Returns
+        -------
+        events: dictionary of (p, x, y, t) or None if the time window cannot be retrieved.
+            p, x and y are views into the memory-mapped file, t too if t_encoding is 'int64'.
+        """
+        assert t_start_us < t_end_us
+        index_range = self._get_index_range(t_start_us, t_end_us)
+        if index_range is None:
+            return None
+        idx_start, idx_end, time_array = index_range
+
+        events = dict()
+        for dset_str in ['p', 'x', 'y']:
+            events[dset_str] = self.events[dset_str][idx_start:idx_end]
+        events['t'] = time_array if self.t_encoding == 'int64' else time_array + self.t_offset
+        return events
+
+    def get_index_ranges(self, t_starts_us: np.ndarray, t_ends_us: np.ndarray) -> np.ndarray:
+        """Exact event index ranges of many time windows, see EventSlicer.get_index_ranges"""
+        t_starts_us = np.asarray(t_starts_us, dtype='int64') - self.t_offset
+        t_ends_us = np.asarray(t_ends_us, dtype='int64') - self.t_offset
+        merged = merge_window_ranges(self.ms_to_idx, t_starts_us, t_ends_us)
+        return merged.index_ranges(merged.window_offsets(self._gather_time(merged), t_starts_us, t_ends_us))
+
+    def get_events_by_index(self, idx_start: int, idx_end: int) -> Dict[str, np.ndarray]:
+        """Get events (p, x, y, t) [idx_start, idx_end), views into the file except a decoded t"""
+        events = dict()
+        for dset_str in ['p', 'x', 'y']:
+            events[dset_str] = self.events[dset_str][idx_start:idx_end]
+        events['t'] = self._get_time(idx_start, idx_end)
+        if self.t_encoding == 'delta':
+            events['t'] = events['t'] + self.t_offset
+        return events
+
+    def get_events_batch(self, t_starts_us: np.ndarray, t_ends_us: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Get events (p, x, y, t) for many time windows at once, see EventSlicer.get_events_batch
+        With t_encoding 'int64', the returned arrays are views of the whole file and the
+        offsets are plain event indices.
+        """
+        t_starts_us = np.asarray(t_starts_us, dtype='int64') - self.t_offset
+        t_ends_us = np.asarray(t_ends_us, dtype='int64') - self.t_offset
+        merged = merge_window_ranges(self.ms_to_idx, t_starts_us, t_ends_us)
+        time_buffer = self._gather_time(merged)
+        offsets = merged.window_offsets(time_buffer, t_starts_us, t_ends_us)
+
+        if self.t_encoding == 'int64':
+            return dict(self.events), merged.index_ranges(offsets)
+
+        # Timestamps have to be decoded, hence gather the merged ranges into one buffer.
+        events = dict()
+        for dset_str in ['p', 'x', 'y']:
+            events[dset_str] = np.concatenate(
+                    [self.events[dset_str][:0]] + [self.events[dset_str][s:e] for s, e in zip(merged.starts, merged.ends)])
+        events['t'] = time_buffer + self.t_offset
+        return events, offsets
+
+    def _gather_time(self, merged: MergedRanges) -> np.ndarray:
+        """Timestamps of the merged ranges one after the other, relative to t_offset"""
+        times = [np.zeros(0, dtype='int64')]
+        for idx_start, idx_end in zip(merged.starts, merged.ends):
+            time_array = self._get_time(idx_start, idx_end)
+            times.append(time_array - self.t_offset if self.t_encoding == 'int64' else time_array)
+        return np.concatenate(times)
@@ -0,0 +1,89 @@
+import os
+import weakref
+from collections import OrderedDict
+
+import hdf5plugin
+import h5py
+
+
+class H5FilePool:
+    """LRU pool of read-only h5py files with a bound on the number of open files
+    Files are opened lazily on first access and the least recently used file is closed
+    when more than max_open_files are open. Handles are never shared across processes:
+    after a fork (e.g. in a DataLoader worker), inherited handles are dropped and files
+    are reopened in the new process.
+    """
+    _pools = weakref.WeakSet()
+
+    def __init__(self, max_open_files: int=64, rdcc_nbytes: int=1024**2, rdcc_nslots: int=521, rdcc_w0: float=0.75):
+        assert max_open_files >= 1
+        self.max_open_files = max_open_files
+        self.h5_kwargs = dict(rdcc_nbytes=rdcc_nbytes, rdcc_nslots=rdcc_nslots, rdcc_w0=rdcc_w0)
+        self.num_opened = 0
+        self._files = OrderedDict()
+        self._pid = os.getpid()
+        self._finalizer = weakref.finalize(self, self.close_callback, self._files)
+        H5FilePool._pools.add(self)
+
+    @staticmethod
+    def close_callback(files: OrderedDict):
+        for h5f in files.values():
+            h5f.close()
+        files.clear()
+
+    def get(self, filepath: str) -> h5py.File:
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+
+        h5f = self._files.get(filepath)
+        if h5f is not None:
+            self._files.move_to_end(filepath)
+            return h5f
+
+        while len(self._files) >= self.max_open_files:
+            _, evicted = self._files.popitem(last=False)
+            evicted.close()
+        h5f = h5py.File(filepath, 'r', **self.h5_kwargs)
+        self._files[filepath] = h5f
+        self.num_opened += 1
+        return h5f
+
+    def open(self, filepath: str) -> 'PooledH5File':
+        return PooledH5File(self, str(filepath))
+
+    def reset_after_fork(self):
+        # Inherited handles are dropped without being used, files are reopened in this process.
+        self._files.clear()
+        self._pid = os.getpid()
+
+    def close(self):
+        self.close_callback(self._files)
+
+    @classmethod
+    def reset_all_after_fork(cls):
+        for pool in list(cls._pools):
+            pool.reset_after_fork()
+
+
+class PooledH5File:
+    """Minimal read-only h5py.File stand-in that resolves the file through a H5FilePool
+    on every access. Dataset objects obtained from it are only valid until the file is
+    evicted from the pool, hence they should not be kept across calls.
+    """
+    def __init__(self, pool: H5FilePool, filename: str):
+        self.pool = pool
+        self.filename = filename
+
+    def __getitem__(self, key):
+        return self.pool.get(self.filename)[key]
+
+    def __contains__(self, key):
+        return key in self.pool.get(self.filename)
+
+    def keys(self):
+        return self.pool.get(self.filename).keys()
+
+
+def worker_init_fn(worker_id: int):
+    """DataLoader worker_init_fn: make sure no HDF5 handle of the parent process is used"""
+    H5FilePool.reset_all_after_fork()
@@ -0,0 +1,91 @@
+import inspect
+from pathlib import Path
+from typing import Dict, Union
+
+import numpy as np
+import torch
+
+from dataset.rectify_voxel import RectifiedVoxelGrid
+from dataset.representations import VoxelGrid
+from model.loss import from_log_to_depth
+import model.unet as module_arch
+from utils.util import read_json
+
+
+def load_model(checkpoint_path: Path, device: torch.device, config=None):
+    """
+    Build the model of a checkpoint saved by BaseTrainer and load its weights for inference
+    :param checkpoint_path: Path to a checkpoint-epoch*.pth or model_best.pth file.
+    :param config: Configuration, by default the config.json saved next to the checkpoint.
+    :return: The model in eval mode on device, and the configuration.
+    """
+    checkpoint_path = Path(checkpoint_path)
+    if config is None:
+        config = read_json(checkpoint_path.parent / 'config.json')
+    model = getattr(module_arch, config['arch']['type'])(**config['arch']['args'])
+
+    # Checkpoints hold the pickled configuration, which weights_only loading (the default of
+    # recent torch versions) rejects. torch before 1.13 has no weights_only argument.
+    load_args = dict(weights_only=False) if 'weights_only' in inspect.signature(torch.load).parameters else dict()
+    checkpoint = torch.load(str(checkpoint_path), map_location='cpu', **load_args)
+    state_dict = checkpoint['state_dict']
+    # Checkpoints of multi-GPU training hold the weights of the DataParallel wrapper
+    state_dict = {k[len('module.'):] if k.startswith('module.') else k: v for k, v in state_dict.items()}
+    model.load_state_dict(state_dict)
+    return model.to(device).eval(), config
+
+
+def dataset_args(config) -> Dict:
+    """
+    Arguments of the DatasetProvider of a configuration
+    Configurations written before the dataset section existed only have a data_loader section
+    (batch size and workers): their samples were windows of 50 ms with 15 bins, the defaults of
+    DatasetProvider.
+    """
+    args = dict(delta_t_ms=50, num_bins=15)
+    args.update(config.get('dataset', {}).get('args', {}))
+    return args
+
+
+def depth_to_disparity_16bit(log_depth: torch.Tensor, Q: torch.Tensor,
+                             max_depth: Union[float, torch.Tensor]=80.0) -> np.ndarray:
+    """
+    16-bit disparity (disparity * 256) of the log depth predicted by the model
+    The model is trained on depth normalized to Dmax=80 at the farthest valid pixel of each frame
+    (see model.loss.depth_targets), hence from_log_to_depth gives depth * 80 / max_depth. Frames with
+    valid pixels beyond 80 m have max_depth = 80 (depth is clamped at Dmax) and a metric prediction;
+    max_depth (a float or a tensor that broadcasts to log_depth) rescales the others.
+    """
+    depth = from_log_to_depth(log_depth) * (max_depth / 80.0)
+    # Inverse of depth = Q[2, 3] / ((disparity - Q[3, 3]) * Q[3, 2]), see model.loss
+    disparity = Q[2, 3] / (depth * Q[3, 2]) + Q[3, 3]
+    return torch.clamp(torch.round(disparity * 256), 0, 2**16 - 1).cpu().numpy().astype('uint16')
+
+
+class WindowVoxelizer:
+    """Rectify the events of a window and compute their voxel grid, as Sequence does"""
+    def __init__(self, rectify_map: np.ndarray, num_bins: int, voxel_backend: str='torch', voxel_threads: int=0):
+        assert voxel_backend in ['torch', 'numba'], voxel_backend
+        self.rectify_map = rectify_map
+        self.height, self.width = rectify_map.shape[:2]
+        self.num_bins = num_bins
+        if voxel_backend == 'numba':
+            self.voxel_grid = RectifiedVoxelGrid(rectify_map, num_bins, normalize=True, num_threads=voxel_threads)
+        else:
+            self.voxel_grid = VoxelGrid(num_bins, self.height, self.width, normalize=True)
+
+    def __call__(self, events: Dict[str, np.ndarray]) -> torch.Tensor:
+        """Voxel grid (C, H, W) of the raw events (p, x, y, t) of an EventSlicer, zeros for less than 2 events"""
+        if events is None or events['t'].size < 2:
+            return torch.zeros((self.num_bins, self.height, self.width))
+        if isinstance(self.voxel_grid, RectifiedVoxelGrid):
+            return self.voxel_grid.convert(events['x'], events['y'], events['p'], events['t'])
+
+        xy_rect = self.rectify_map[events['y'], events['x']]
+        t = (events['t'] - events['t'][0]).astype('float32')
+        t = (t/t[-1])
+        return self.voxel_grid.convert(
+                torch.from_numpy(np.ascontiguousarray(xy_rect[:, 0])),
+                torch.from_numpy(np.ascontiguousarray(xy_rect[:, 1])),
+                torch.from_numpy(events['p'].astype('float32')),
+                torch.from_numpy(t))
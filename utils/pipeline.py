@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+class StageStats:
+    """Number of items, busy time and worst latency of one pipeline stage"""
+    def __init__(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def add(self, duration_s: float):
+        self.count += 1
+        self.total_s += duration_s
+        self.max_s = max(self.max_s, duration_s)
+
+    @property
+    def mean_s(self) -> float:
+        return self.total_s / self.count if self.count > 0 else 0.0
+
+
+class _StageError:
+    def __init__(self, stage: str, error: BaseException):
+        self.stage = stage
+        self.error = error
+
+
+_END = object()
+
+
+class ThreadedPipeline:
+    """Run a source and a chain of stages concurrently, one thread each
+    Stages are connected by queues of at most queue_size items: a slow stage blocks the
+    stages before it (backpressure) instead of letting items pile up in memory. Each stage
+    processes its items in order, hence stages may keep state between items (e.g. the
+    recurrent state of a model). Iterating over the pipeline yields the outputs of the last
+    stage. An exception in a stage stops the pipeline and is raised by the iteration.
+
+    Parameters
+    ----------
+    source : iterable of the input items, consumed in the 'read' stage
+    stages : list of (name, function), each function maps the output of the previous stage
+    queue_size : maximum number of items waiting in front of each stage
+    """
+    def __init__(self, source: Iterable, stages: List[Tuple[str, Callable[[Any], Any]]], queue_size: int=2):
+        assert queue_size >= 1
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = {name: StageStats() for name in ['read'] + [name for name, _ in stages]}
+        # End-to-end latency, from the start of the read to the output of the last stage
+        self.latency = StageStats()
+        self.num_items = 0
+        self.wall_time_s = 0.0
+        self._stop = threading.Event()
+
+    def _put(self, out_queue: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, in_queue: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _run_source(self, out_queue: queue.Queue):
+        iterator = iter(self.source)
+        stats = self.stats['read']
+        try:
+            while True:
+                t_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.add(time.perf_counter() - t_start)
+                if not self._put(out_queue, (t_start, item)):
+                    return
+        except BaseException as error:
+            self._put(out_queue, _StageError('read', error))
+            return
+        self._put(out_queue, _END)
+
+    def _run_stage(self, name: str, function: Callable, in_queue: queue.Queue, out_queue: queue.Queue):
+        stats = self.stats[name]
+        while True:
+            entry = self._get(in_queue)
+            if entry is _END or isinstance(entry, _StageError):
+                self._put(out_queue, entry)
+                return
+            t_read, item = entry
+            t_start = time.perf_counter()
+            try:
+                item = function(item)
+            except BaseException as error:
+                self._put(out_queue, _StageError(name, error))
+                return
+            stats.add(time.perf_counter() - t_start)
+            if not self._put(out_queue, (t_read, item)):
+                return
+
+    def __iter__(self):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],), daemon=True)]
+        for i, (name, function) in enumerate(self.stages):
+            threads.append(threading.Thread(
+                    target=self._run_stage, args=(name, function, queues[i], queues[i + 1]), daemon=True))
+
+        self._stop.clear()
+        t_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                entry = queues[-1].get()
+                if entry is _END:
+                    break
+                if isinstance(entry, _StageError):
+                    raise RuntimeError('pipeline stage {} failed'.format(entry.stage)) from entry.error
+                t_read, item = entry
+                self.latency.add(time.perf_counter() - t_read)
+                self.num_items += 1
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall_time_s += time.perf_counter() - t_start
+
+    @property
+    def fps(self) -> float:
+        return self.num_items / self.wall_time_s if self.wall_time_s > 0 else 0.0
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Mean and max latency in milliseconds per stage, and end to end"""
+        summary = {name: {'mean_ms': 1000 * stats.mean_s, 'max_ms': 1000 * stats.max_s}
+                   for name, stats in self.stats.items()}
+        summary['end_to_end'] = {'mean_ms': 1000 * self.latency.mean_s, 'max_ms': 1000 * self.latency.max_s}
+        return summary
@@ -1,6 +1,6 @@
 import json
 import torch
-import pandas as pd
+import torch.distributed as dist
 from pathlib import Path
 from itertools import repeat
 from collections import OrderedDict
@@ -16,6 +16,27 @@ def read_json(fname):
     with fname.open('rt') as handle:
         return json.load(handle, object_hook=OrderedDict)
 
+def read_config(fname):
+    '''
+    Read a configuration json file. A file with a "base" key (a path relative to the file)
+    only holds the keys that differ from its base: dicts are merged recursively, other
+    values replace the ones of the base.
+    '''
+    fname = Path(fname)
+    config = read_json(fname)
+    if 'base' not in config:
+        return config
+    return merge_config(read_config(fname.parent / config.pop('base')), config)
+
+def merge_config(base, override):
+    ''' Copy of base with the keys of override, dicts merged recursively. '''
+    merged = OrderedDict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = merge_config(merged[key], value)
+        merged[key] = value
+    return merged
+
 def write_json(content, fname):
     fname = Path(fname)
     with fname.open('wt') as handle:
@@ -43,25 +64,70 @@ def prepare_device(n_gpu_use):
     list_ids = list(range(n_gpu_use))
     return device, list_ids
 
+def all_reduce_sum(tensor):
+    """Sum a tensor over the processes of torch.distributed in place, if it is initialized"""
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
 class MetricTracker:
-    def __init__(self, *keys, writer=None):
+    """
+    Running averages of metrics, accumulated on the training device
+    Values may be numbers or 0-dim tensors (e.g. the output of a metric on the GPU): totals are
+    summed on the device without a synchronization. The values of every update are sent to
+    the writer, at the step and mode of the writer at the time of the update, but only when the
+    tracker is flushed: every flush_steps steps (flush_steps updates of every key) and by result.
+    result() reduces the totals and counts with all_reduce, summing them over the processes of
+    a distributed run by default.
+    """
+    def __init__(self, *keys, writer=None, device=None, flush_steps=1, all_reduce=all_reduce_sum):
         self.writer = writer
-        self._data = pd.DataFrame(index=keys, columns=['total', 'counts', 'average'])
+        self.keys = list(keys)
+        self._index = {key: i for i, key in enumerate(self.keys)}
+        self.device = torch.device(device) if device is not None else torch.device('cpu')
+        assert flush_steps >= 1
+        self.flush_steps = flush_steps
+        self.all_reduce = all_reduce
+        self._pending = []
         self.reset()
 
     def reset(self):
-        for col in self._data.columns:
-            self._data[col].values[:] = 0
+        self.flush()
+        self._totals = torch.zeros(len(self.keys), dtype=torch.float64, device=self.device)
+        # Counts are host numbers, n of update is never a device tensor.
+        self._counts = [0] * len(self.keys)
 
     def update(self, key, value, n=1):
+        i = self._index[key]
+        if isinstance(value, torch.Tensor):
+            value = value.detach().to(self.device, torch.float64).reshape(())
+        self._totals[i] += value * n
+        self._counts[i] += n
         if self.writer is not None:
-            self.writer.add_scalar(key, value)
-        self._data.total[key] += value * n
-        self._data.counts[key] += n
-        self._data.average[key] = self._data.total[key] / self._data.counts[key]
+            self._pending.append((key, value, self.writer.step, self.writer.mode))
+            if len(self._pending) >= self.flush_steps * len(self.keys):
+                self.flush()
+
+    def flush(self):
+        """Write the values of the updates since the last flush, with a single copy from the device"""
+        pending, self._pending = self._pending, []
+        if self.writer is None or len(pending) == 0:
+            return
+        tensors = [value for _, value, _, _ in pending if isinstance(value, torch.Tensor)]
+        values = iter(torch.stack(tensors).tolist() if len(tensors) > 0 else [])
+        for key, value, step, mode in pending:
+            self.writer.add_scalar_at(key, next(values) if isinstance(value, torch.Tensor) else value, step, mode)
 
     def avg(self, key):
-        return self._data.average[key]
+        """Average of a key in this process"""
+        i = self._index[key]
+        return self._totals[i].item() / self._counts[i] if self._counts[i] > 0 else 0.0
 
     def result(self):
-        return dict(self._data.average)
+        self.flush()
+        reduced = torch.cat([self._totals, torch.tensor(self._counts, dtype=torch.float64, device=self.device)])
+        if self.all_reduce is not None:
+            reduced = self.all_reduce(reduced)
+        reduced = reduced.tolist()
+        return {key: total / count if count > 0 else 0.0
+                for key, total, count in zip(self.keys, reduced[:len(self.keys)], reduced[len(self.keys):])}